@@ -1,12 +1,13 @@
 import os
 import logging
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .extensions import db, login_manager, csrf
 
 
-def create_app():
-    # Flask アプリ作成
-    app = Flask(__name__, instance_relative_config=True)
+def create_app(instance_path=None):
+    # Flask アプリ作成（instance_path を渡すと DB・キャッシュ類をそこに置く。テスト用）
+    app = Flask(__name__, instance_relative_config=True, instance_path=instance_path)
 
     # -----------------------
     # ログ設定
@@ -34,6 +35,138 @@ def create_app():
 
     app.config["WTF_CSRF_TIME_LIMIT"] = None
 
+    # フォロワー数がこれを超えるユーザーの投稿はタイムラインへ書き込み時に展開しない
+    app.config["TIMELINE_FANOUT_LIMIT"] = int(
+        os.environ.get("TIMELINE_FANOUT_LIMIT", 10000)
+    )
+
+    # いいね / 転送の書き込み方式（"sync" か "write_behind"）
+    app.config["ENGAGEMENT_WRITE_MODE"] = os.environ.get("ENGAGEMENT_WRITE_MODE", "sync")
+    app.config["ENGAGEMENT_FLUSH_INTERVAL_MS"] = int(
+        os.environ.get("ENGAGEMENT_FLUSH_INTERVAL_MS", 50)
+    )
+    app.config["ENGAGEMENT_FLUSH_MAX_EVENTS"] = int(
+        os.environ.get("ENGAGEMENT_FLUSH_MAX_EVENTS", 500)
+    )
+    # write_behind のバッチ書き込み時の PRAGMA synchronous（"full" / "normal" / "off"）
+    app.config["ENGAGEMENT_DURABILITY"] = os.environ.get(
+        "ENGAGEMENT_DURABILITY", "normal"
+    )
+
+    # 投稿カード・コメント一覧のレンダリング結果キャッシュ
+    app.config["FRAGMENT_CACHE_ENABLED"] = True
+    app.config["FRAGMENT_CACHE_MAX_BYTES"] = int(
+        os.environ.get("FRAGMENT_CACHE_MAX_BYTES", 8 * 1024 * 1024)
+    )
+
+    # user_loader のユーザーキャッシュ（秒。0 で無効）
+    app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", 30))
+    app.config["USER_CACHE_MAX_SIZE"] = int(
+        os.environ.get("USER_CACHE_MAX_SIZE", 10000)
+    )
+
+    # パスワードハッシュ（werkzeug の method 書式。変更するとログイン時に移行する）
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get(
+        "PASSWORD_HASH_METHOD", "scrypt:32768:8:1"
+    )
+    # ハッシュ計算を行うスレッド数と、それを超えて待たせる最大数（超えたら 503）
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    app.config["PASSWORD_HASH_QUEUE_SIZE"] = int(
+        os.environ.get("PASSWORD_HASH_QUEUE_SIZE", 16)
+    )
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(
+        os.environ.get("PASSWORD_HASH_TIMEOUT", 5)
+    )
+
+    # メール送信（リクエストではアウトボックスに登録するだけ）
+    # EMAIL_TRANSPORT: "sendgrid" / "smtp" / "file"（instance/outbox に .eml を書き出す）
+    app.config["EMAIL_TRANSPORT"] = os.environ.get(
+        "EMAIL_TRANSPORT", "sendgrid" if os.environ.get("SENDGRID_API_KEY") else "file"
+    )
+    app.config["EMAIL_FROM"] = os.environ.get(
+        "SENDGRID_FROM_EMAIL", "no-reply@example.com"
+    )
+    app.config["EMAIL_OUTBOX_DIR"] = os.path.join(app.instance_path, "outbox")
+    app.config["EMAIL_SMTP_HOST"] = os.environ.get("EMAIL_SMTP_HOST", "localhost")
+    app.config["EMAIL_SMTP_PORT"] = int(os.environ.get("EMAIL_SMTP_PORT", 1025))
+    app.config["EMAIL_OUTBOX_ENABLED"] = (
+        os.environ.get("EMAIL_OUTBOX_ENABLED", "1") != "0"
+    )
+    app.config["EMAIL_OUTBOX_POLL_INTERVAL"] = float(
+        os.environ.get("EMAIL_OUTBOX_POLL_INTERVAL", 1.0)
+    )
+    app.config["EMAIL_OUTBOX_BATCH_SIZE"] = int(
+        os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 50)
+    )
+    app.config["EMAIL_OUTBOX_MAX_ATTEMPTS"] = int(
+        os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 6)
+    )
+    app.config["EMAIL_OUTBOX_BACKOFF_SECONDS"] = float(
+        os.environ.get("EMAIL_OUTBOX_BACKOFF_SECONDS", 5)
+    )
+
+    # ログイン・リセットの試行回数制限（"回数/秒数"。空文字で無効）
+    app.config["AUTH_RATE_LIMIT_IP"] = os.environ.get("AUTH_RATE_LIMIT_IP", "30/60")
+    app.config["AUTH_RATE_LIMIT_ACCOUNT"] = os.environ.get(
+        "AUTH_RATE_LIMIT_ACCOUNT", "5/60"
+    )
+    # "memory"（ワーカーごと）か "sqlite"（instance/ratelimit.db を全ワーカーで共有）
+    app.config["AUTH_RATE_LIMIT_BACKEND"] = os.environ.get(
+        "AUTH_RATE_LIMIT_BACKEND", "memory"
+    )
+    # 前段のリバースプロキシの段数。X-Forwarded-For の右からこの数だけ遡った
+    # アドレスを remote_addr にする（試行回数制限の IP キー）。
+    # プロキシなしで直接受ける場合は 0 のまま（ヘッダーを偽装されるため）
+    app.config["PROXY_FIX_X_FOR"] = int(os.environ.get("PROXY_FIX_X_FOR", 0))
+
+    # 本棚の書籍検索: 外部 API を並列に呼んで待つ最大秒数（間に合った結果だけ返す）
+    app.config["BOOKSHELF_SEARCH_DEADLINE"] = float(
+        os.environ.get("BOOKSHELF_SEARCH_DEADLINE", 4)
+    )
+    # 書籍検索結果のキャッシュ（instance/search_cache.db）
+    # TTL 秒は新しいものとして返し、さらに STALE_TTL 秒は古い結果を返しつつ裏で取り直す。
+    # 外部 API が失敗したときは MAX_STALE 秒以内の古い結果を返す
+    app.config["BOOKSHELF_CACHE_ENABLED"] = (
+        os.environ.get("BOOKSHELF_CACHE_ENABLED", "1") != "0"
+    )
+    app.config["BOOKSHELF_CACHE_TTL"] = int(os.environ.get("BOOKSHELF_CACHE_TTL", 3600))
+    app.config["BOOKSHELF_CACHE_STALE_TTL"] = int(
+        os.environ.get("BOOKSHELF_CACHE_STALE_TTL", 86400)
+    )
+    app.config["BOOKSHELF_CACHE_MAX_STALE"] = int(
+        os.environ.get("BOOKSHELF_CACHE_MAX_STALE", 7 * 86400)
+    )
+    app.config["BOOKSHELF_CACHE_MAX_BYTES"] = int(
+        os.environ.get("BOOKSHELF_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    )
+    # 近くの図書館: instance/libraries.json のカタログから探し、
+    # 半径 RADIUS_KM 以内に K 件ないときだけカーリルに問い合わせる。
+    # カタログは REFRESH_HOURS ごとにバックグラウンドで取り直す（"0" で無効）
+    app.config["BOOKSHELF_LIBRARY_K"] = int(os.environ.get("BOOKSHELF_LIBRARY_K", 5))
+    app.config["BOOKSHELF_LIBRARY_RADIUS_KM"] = float(
+        os.environ.get("BOOKSHELF_LIBRARY_RADIUS_KM", 30)
+    )
+    app.config["BOOKSHELF_LIBRARY_REFRESH"] = (
+        os.environ.get("BOOKSHELF_LIBRARY_REFRESH", "1") != "0"
+    )
+    app.config["BOOKSHELF_LIBRARY_REFRESH_HOURS"] = float(
+        os.environ.get("BOOKSHELF_LIBRARY_REFRESH_HOURS", 24)
+    )
+    # 「私の本棚」の保存先: "json"（instance/shelves/ にユーザーごとのファイル）か
+    # "sqlite"（アプリの DB の shelf_books テーブル）。移行は flask shelves-migrate
+    app.config["BOOKSHELF_STORE"] = os.environ.get("BOOKSHELF_STORE", "json")
+    # 表紙画像のディスクキャッシュ（instance/covers）の上限バイト数
+    app.config["BOOKSHELF_COVER_MAX_BYTES"] = int(
+        os.environ.get("BOOKSHELF_COVER_MAX_BYTES", 256 * 1024 * 1024)
+    )
+    # おすすめの索引（タグの転置索引）を作り直す間隔（秒）
+    app.config["BOOKSHELF_RECOMMEND_REBUILD"] = int(
+        os.environ.get("BOOKSHELF_RECOMMEND_REBUILD", 300)
+    )
+
+    if app.config["PROXY_FIX_X_FOR"] > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
     # -----------------------
     # Extensions 初期化
     # -----------------------
@@ -42,6 +175,50 @@ def create_app():
     login_manager.login_view = "auth.login"
     login_manager.session_protection = "strong"
     csrf.init_app(app)
+
+    from .feed.fragment_cache import init_fragment_cache
+
+    init_fragment_cache(app)
+
+    from .auth.passwords import init_password_hasher
+
+    init_password_hasher(app)
+
+    from .auth.rate_limit import init_rate_limiter
+
+    init_rate_limiter(app)
+
+    from .auth.icons import init_icons
+
+    init_icons(app)
+
+    from .auth.user_cache import init_user_cache
+
+    init_user_cache(app)
+
+    from .bookshelf.search_cache import init_search_cache
+
+    init_search_cache(app)
+
+    from .bookshelf.libraries import init_library_catalogue
+
+    init_library_catalogue(app)
+
+    from .bookshelf.shelf_store import init_shelf_store
+
+    init_shelf_store(app)
+
+    from .bookshelf.catalogue import init_curated_catalogue
+
+    init_curated_catalogue(app)
+
+    from .bookshelf.recommend import init_recommender
+
+    init_recommender(app)
+
+    from .bookshelf.covers import init_cover_cache
+
+    init_cover_cache(app)
     logger.debug("Extensions initialized.")
 
     # -----------------------
@@ -53,6 +230,7 @@ def create_app():
     from .ai_diagnosis.routes import ai_diagnosis_bp
     from .posts.routes import post_bp
     from .bookshelf.routes import bookshelf_bp
+    from .search.routes import search_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(feed_bp)
@@ -60,8 +238,13 @@ def create_app():
     app.register_blueprint(ai_diagnosis_bp, url_prefix="/ai")
     app.register_blueprint(post_bp)
     app.register_blueprint(bookshelf_bp)
+    app.register_blueprint(search_bp)
     logger.debug("Blueprints registered.")
 
+    from .commands import register_commands
+
+    register_commands(app)
+
     # -----------------------
     # DB 初期化（初回のみ）
     # -----------------------
@@ -69,7 +252,23 @@ def create_app():
         try:
             db.create_all()
             logger.debug("Database tables created or already exist.")
+
+            from .schema import upgrade_schema
+
+            added = upgrade_schema()
+            if added:
+                logger.debug("Schema upgraded: %s", ", ".join(added))
         except Exception as e:
             logger.exception("Error creating database tables: %s", e)
 
+    # いいね / 転送の write-behind キュー（ENGAGEMENT_WRITE_MODE=write_behind のときのみ）
+    from .posts.engagement import init_engagement
+
+    init_engagement(app)
+
+    # メール送信のバックグラウンドスレッド
+    from .auth.outbox import init_email_outbox
+
+    init_email_outbox(app)
+
     return app
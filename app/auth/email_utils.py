@@ -1,17 +1,32 @@
 # auth/email_utils.py
 import os
 import logging
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
+import smtplib
+from datetime import datetime
+from email.message import EmailMessage
+
+from app.extensions import db
+from app.auth.models import OutboxEmail
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def enqueue_email(to_email, subject, body):
+    """メールをアウトボックスに登録する（commit は呼び出し側）
+
+    送信はバックグラウンドのディスパッチャ（app/auth/outbox.py）が行うため、
+    リクエストはメール送信業者の応答を待たない。
+    """
+    message = OutboxEmail(to_email=to_email, subject=subject, body=body)
+    db.session.add(message)
+    return message
+
+
 def send_otp_email(user, code):
     """
-    ユーザー宛にパスワードリセット用のOTPメールを送信する。
+    ユーザー宛にパスワードリセット用のOTPメールを送信キューに積む。
 
     Parameters:
     - user: User オブジェクト（.email 属性が必要）
@@ -20,23 +35,112 @@ def send_otp_email(user, code):
     if not hasattr(user, "email") or not user.email:
         raise ValueError("ユーザーに有効なメールアドレスが設定されていません。")
 
-    from_email = os.environ.get("SENDGRID_FROM_EMAIL", "no-reply@example.com")
-    api_key = os.environ.get("SENDGRID_API_KEY")
-    if not api_key:
-        raise EnvironmentError("SENDGRID_API_KEY が設定されていません。")
-
-    message = Mail(
-        from_email=from_email,
-        to_emails=user.email,
-        subject="パスワードリセットコード",
-        plain_text_content=f"あなたの確認コードは {code} です。",
+    return enqueue_email(
+        user.email,
+        "パスワードリセットコード",
+        f"あなたの確認コードは {code} です。",
     )
 
-    try:
-        sg = SendGridAPIClient(api_key)
-        response = sg.send(message)
+
+# ----------------------
+# 送信方法（EMAIL_TRANSPORT で選択）
+# ----------------------
+class SendGridTransport:
+    """SendGrid API で送信する（sendgrid パッケージは使うときだけ import）"""
+
+    def __init__(self, config):
+        self.from_email = config.get("EMAIL_FROM")
+        self.api_key = os.environ.get("SENDGRID_API_KEY")
+        self._client = None
+
+    def open(self):
+        if not self.api_key:
+            raise EnvironmentError("SENDGRID_API_KEY が設定されていません。")
+        from sendgrid import SendGridAPIClient
+
+        self._client = SendGridAPIClient(self.api_key)
+
+    def send(self, to_email, subject, body):
+        from sendgrid.helpers.mail import Mail
+
+        message = Mail(
+            from_email=self.from_email,
+            to_emails=to_email,
+            subject=subject,
+            plain_text_content=body,
+        )
+        response = self._client.send(message)
+        if response.status_code >= 300:
+            raise RuntimeError(f"SendGrid status {response.status_code}")
         logger.info(f"Email送信ステータス: {response.status_code}")
-        return response.status_code
-    except Exception as e:
-        logger.error(f"Email送信中にエラー発生: {e}")
-        raise
+
+    def close(self):
+        self._client = None
+
+
+class SMTPTransport:
+    """SMTP で送信する（開発時は python -m aiosmtpd -n -l localhost:1025 などで受ける）"""
+
+    def __init__(self, config):
+        self.from_email = config.get("EMAIL_FROM")
+        self.host = config.get("EMAIL_SMTP_HOST", "localhost")
+        self.port = config.get("EMAIL_SMTP_PORT", 1025)
+        self._smtp = None
+
+    def open(self):
+        # バッチ内は同じ接続を使い回す
+        self._smtp = smtplib.SMTP(self.host, self.port, timeout=10)
+
+    def send(self, to_email, subject, body):
+        message = EmailMessage()
+        message["From"] = self.from_email
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(body)
+        self._smtp.send_message(message)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+
+class FileTransport:
+    """送信せず EMAIL_OUTBOX_DIR に .eml として書き出す（ローカル・オフライン確認用）"""
+
+    def __init__(self, config):
+        self.from_email = config.get("EMAIL_FROM")
+        self.directory = config.get("EMAIL_OUTBOX_DIR")
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def send(self, to_email, subject, body):
+        message = EmailMessage()
+        message["From"] = self.from_email
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(body)
+        name = f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{to_email}.eml"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(message.as_bytes())
+
+    def close(self):
+        pass
+
+
+TRANSPORTS = {
+    "sendgrid": SendGridTransport,
+    "smtp": SMTPTransport,
+    "file": FileTransport,
+}
+
+
+def get_transport(config):
+    name = config.get("EMAIL_TRANSPORT", "file")
+    if name not in TRANSPORTS:
+        raise ValueError(f"unknown EMAIL_TRANSPORT: {name}")
+    return TRANSPORTS[name](config)
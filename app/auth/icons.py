@@ -0,0 +1,162 @@
+# app/auth/icons.py
+# プロフィールアイコンの変換・保存
+#
+# アップロードされた画像はリクエスト内では大きさの確認とハッシュ計算だけ行い、
+# デコード・縮小・再エンコードはバックグラウンドのスレッドで行う。
+# 変換後は ICON_SIZES の各サイズを WebP で "<内容のハッシュ>-<サイズ>.webp" として
+# ICON_FOLDER に保存し、User.icon にハッシュを記録する。
+# ファイル名が内容で決まるため、配信時は immutable（再検証不要）のキャッシュヘッダを付けられる。
+#
+# User.icon がハッシュでない値（"default.png" や従来の "<id>.png"）の場合は static/icons を使う。
+import hashlib
+import io
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import url_for
+from PIL import Image, ImageOps
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+ICON_SIZES = (64, 128, 256)
+DEFAULT_ICON_SIZE = 128
+ICON_FORMAT = "WEBP"
+ICON_QUALITY = 80
+# デコード前に弾く上限（ファイルサイズ / ピクセル数）
+ICON_MAX_BYTES = 5 * 1024 * 1024
+ICON_MAX_PIXELS = 4096 * 4096
+ALLOWED_FORMATS = {"PNG", "JPEG", "WEBP", "GIF"}
+
+ICON_MAX_AGE = 365 * 24 * 60 * 60
+ICON_FILENAME = re.compile(
+    r"^(?P<key>[0-9a-f]{32})-(?P<size>" + "|".join(map(str, ICON_SIZES)) + r")\.webp$"
+)
+_ICON_KEY = re.compile(r"^[0-9a-f]{32}$")
+
+
+class IconError(ValueError):
+    """アイコンとして受け付けられない画像"""
+
+
+def icon_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def icon_filename(key, size):
+    return f"{key}-{size}.webp"
+
+
+def icon_url(icon, size=DEFAULT_ICON_SIZE):
+    """テンプレート用: User.icon の値からアイコンの URL を返す"""
+    if icon and _ICON_KEY.match(icon):
+        size = min((s for s in ICON_SIZES if s >= size), default=ICON_SIZES[-1])
+        return url_for("auth.icon", filename=icon_filename(icon, size))
+    return url_for("static", filename="icons/" + (icon or "default.png"))
+
+
+# ----------------------
+# 変換
+# ----------------------
+def _open(data):
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Exception as e:
+        raise IconError("画像として読み込めません") from e
+    if image.format not in ALLOWED_FORMATS:
+        raise IconError(f"対応していない形式です: {image.format}")
+    width, height = image.size
+    if width * height > ICON_MAX_PIXELS:
+        raise IconError("画像が大きすぎます")
+    return image
+
+
+def render_icons(data):
+    """{サイズ: WebP のバイト列} を返す（正方形に切り抜いて縮小）"""
+    image = _open(data)
+    image.seek(0)  # GIF アニメーションは 1 枚目だけ使う
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    side = min(image.size)
+    image = ImageOps.fit(image, (side, side), Image.LANCZOS)
+
+    rendered = {}
+    for size in ICON_SIZES:
+        resized = image.resize((size, size), Image.LANCZOS) if side > size else image
+        buf = io.BytesIO()
+        resized.save(buf, ICON_FORMAT, quality=ICON_QUALITY, method=6)
+        rendered[size] = buf.getvalue()
+    return rendered
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def store_icons(folder, key, data):
+    """変換して保存する。同じ内容のアイコンが保存済みなら何もしない"""
+    os.makedirs(folder, exist_ok=True)
+    paths = {size: os.path.join(folder, icon_filename(key, size)) for size in ICON_SIZES}
+    if all(os.path.exists(p) for p in paths.values()):
+        return
+    for size, encoded in render_icons(data).items():
+        _write_atomic(paths[size], encoded)
+
+
+# ----------------------
+# バックグラウンド処理
+# ----------------------
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icon")
+
+
+def _process(app, user_id, key, data):
+    from app.auth.models import User
+    from app.feed.fragment_cache import fragment_cache
+
+    with app.app_context():
+        try:
+            store_icons(app.config["ICON_FOLDER"], key, data)
+        except IconError as e:
+            logger.warning("icon for user %d rejected: %s", user_id, e)
+            return
+        except Exception:
+            logger.exception("icon processing failed for user %d", user_id)
+            return
+        user = db.session.get(User, user_id)
+        if user is None:
+            return
+        user.icon = key
+        db.session.commit()
+        # 投稿カードに埋め込まれたアイコンの URL が変わる
+        fragment_cache.clear()
+
+
+def read_icon(upload):
+    """アップロードされたファイルを読み、形式と大きさだけ確認する（デコードはしない）
+
+    戻り値: (キー, バイト列)。受け付けられない場合は IconError
+    """
+    data = upload.read(ICON_MAX_BYTES + 1)
+    if len(data) > ICON_MAX_BYTES:
+        raise IconError("ファイルが大きすぎます")
+    _open(data)
+    return icon_key(data), data
+
+
+def submit_icon(app, user_id, key, data):
+    """変換・保存・User.icon の更新をバックグラウンドで行う"""
+    _executor.submit(_process, app, user_id, key, data)
+
+
+def init_icons(app):
+    app.config.setdefault("ICON_FOLDER", os.path.join(app.instance_path, "icons"))
+    os.makedirs(app.config["ICON_FOLDER"], exist_ok=True)
+    Image.MAX_IMAGE_PIXELS = ICON_MAX_PIXELS
+    app.add_template_global(icon_url)
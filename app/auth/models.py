@@ -1,9 +1,10 @@
 import re
 import random
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from typing import NamedTuple
 from flask_login import UserMixin
 from ..extensions import db
+from .passwords import password_hasher
 
 # ← ここを修正！（プロジェクト直下の extensions.py からimport）
 
@@ -15,8 +16,15 @@ followers = db.Table(
     "followers",
     db.Column("follower_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
     db.Column("followed_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    # 主キー (follower_id, followed_id) では「自分のフォロワー」を引けないため。
+    # follower_id まで含めてフォロワー一覧を follower_id 順に範囲走査できるようにする
+    db.Index("ix_followers_followed", "followed_id", "follower_id"),
 )
 
+# フォロー / フォロワー一覧の 1 ページの件数
+FOLLOW_PAGE_SIZE = 20
+FOLLOW_PAGE_SIZE_MAX = 100
+
 
 # ======================
 # Userモデル
@@ -35,6 +43,10 @@ class User(UserMixin, db.Model):
     otp_code = db.Column(db.String(6), nullable=True)
     otp_expiration = db.Column(db.DateTime, nullable=True)
 
+    # フォロー数カウンタ（follow / unfollow と同じトランザクションで更新）
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
     # フォロー関係（自己参照リレーション）
     followed = db.relationship(
         "User",
@@ -64,11 +76,21 @@ class User(UserMixin, db.Model):
         """パスワードをハッシュ化して保存"""
         if len(password) < 8:
             raise ValueError("パスワードは8文字以上にしてください。")
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
         """ハッシュ化されたパスワードを検証"""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def rehash_password(self, password: str) -> bool:
+        """保存済みハッシュの方式が現在の設定と違えば作り直す（ログイン成功時に呼ぶ）
+
+        戻り値: 作り直した場合 True（commit は呼び出し側）
+        """
+        if not password_hasher.needs_rehash(self.password_hash):
+            return False
+        self.password_hash = password_hasher.hash(password)
+        return True
 
     # ======================
     # OTP関連
@@ -100,23 +122,193 @@ class User(UserMixin, db.Model):
         """指定ユーザーをフォロー"""
         if not self.is_following(user):
             self.followed.append(user)
+            self.following_count = User.following_count + 1
+            user.follower_count = User.follower_count + 1
 
     def unfollow(self, user):
         """指定ユーザーのフォロー解除"""
         if self.is_following(user):
             self.followed.remove(user)
+            self.following_count = User.following_count - 1
+            user.follower_count = User.follower_count - 1
 
     def is_following(self, user) -> bool:
         """指定ユーザーをフォローしているか"""
-        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
+        return is_following(self.id, user.id)
+
+    def follow_state(self, user_ids) -> "FollowState":
+        """user_ids のうちフォローしている / フォローされているユーザー"""
+        return follow_state(self, user_ids)
 
     def followed_count(self) -> int:
         """自分がフォローしている人数"""
-        return self.followed.count()
+        return self.following_count or 0
 
     def followers_count(self) -> int:
         """自分をフォローしている人数"""
-        return self.followers.count()
+        return self.follower_count or 0
 
     def __repr__(self):
         return f"<User {self.username}>"
+
+
+# ======================
+# メール送信待ち（アウトボックス）
+# ======================
+class OutboxEmail(db.Model):
+    """送信待ちのメール。リクエスト内では登録だけ行い、送信は app/auth/outbox.py が行う"""
+
+    __tablename__ = "email_outbox"
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    DEAD = "dead"  # 再試行の上限に達した（手動で確認する）
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # pending: 次に送信してよい時刻 / sending: 取り出したワーカーの持ち時間の期限
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # 送信対象の取り出し: WHERE status = ? AND next_attempt_at <= ?
+        db.Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+    def __repr__(self):
+        return f"<OutboxEmail {self.id} {self.status} to={self.to_email}>"
+
+
+def recount_follow_counters() -> int:
+    """followers テーブルから全ユーザーのフォロー数を再計算する（修復用）"""
+    updated = User.query.update(
+        {
+            User.follower_count: db.select(db.func.count())
+            .select_from(followers)
+            .where(followers.c.followed_id == User.id)
+            .scalar_subquery(),
+            User.following_count: db.select(db.func.count())
+            .select_from(followers)
+            .where(followers.c.follower_id == User.id)
+            .scalar_subquery(),
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return updated
+
+
+# ======================
+# フォロー状態の一括取得
+# ======================
+def is_following(follower_id, followed_id) -> bool:
+    return db.session.execute(
+        db.select(
+            db.select(followers.c.follower_id)
+            .where(
+                followers.c.follower_id == follower_id,
+                followers.c.followed_id == followed_id,
+            )
+            .exists()
+        )
+    ).scalar()
+
+
+class FollowState(NamedTuple):
+    following: frozenset
+    followed_by: frozenset
+
+
+EMPTY_FOLLOW_STATE = FollowState(frozenset(), frozenset())
+
+
+def follow_state_query(viewer_id, user_ids):
+    """follow_state() が発行するクエリ: (kind, user_id)"""
+    following = db.select(
+        db.literal("following").label("kind"), followers.c.followed_id
+    ).where(
+        followers.c.follower_id == viewer_id, followers.c.followed_id.in_(user_ids)
+    )
+    followed_by = db.select(
+        db.literal("followed_by").label("kind"), followers.c.follower_id
+    ).where(
+        followers.c.followed_id == viewer_id, followers.c.follower_id.in_(user_ids)
+    )
+    return db.union_all(following, followed_by)
+
+
+def follow_state(viewer, user_ids) -> FollowState:
+    """user_ids のうち viewer がフォローしている / viewer をフォローしている ID を 1 クエリで返す
+
+    一覧表示でユーザーごとに is_following() を呼ぶ代わりに使う。
+    """
+    user_ids = list(user_ids)
+    if not user_ids or viewer is None or not viewer.is_authenticated:
+        return EMPTY_FOLLOW_STATE
+
+    ids = {"following": set(), "followed_by": set()}
+    for kind, user_id in db.session.execute(follow_state_query(viewer.id, user_ids)):
+        ids[kind].add(user_id)
+    return FollowState(frozenset(ids["following"]), frozenset(ids["followed_by"]))
+
+
+# ======================
+# フォロー / フォロワー一覧（ユーザー ID のキーセットでページング）
+# ======================
+def _clamp_follow_limit(limit):
+    try:
+        return max(1, min(int(limit), FOLLOW_PAGE_SIZE_MAX))
+    except (TypeError, ValueError):
+        return FOLLOW_PAGE_SIZE
+
+
+def _follow_page_query(key_col, owner_col, owner_id, after, limit):
+    query = (
+        User.query.join(followers, key_col == User.id)
+        .filter(owner_col == owner_id)
+        .order_by(key_col)
+    )
+    if after:
+        try:
+            query = query.filter(key_col > int(after))
+        except ValueError:
+            pass
+    return query.limit(limit + 1)
+
+
+def following_page_query(user_id, after=None, limit=FOLLOW_PAGE_SIZE):
+    """following_page() が発行するクエリ"""
+    return _follow_page_query(
+        followers.c.followed_id, followers.c.follower_id, user_id, after, limit
+    )
+
+
+def followers_page_query(user_id, after=None, limit=FOLLOW_PAGE_SIZE):
+    """followers_page() が発行するクエリ"""
+    return _follow_page_query(
+        followers.c.follower_id, followers.c.followed_id, user_id, after, limit
+    )
+
+
+def _follow_page(page_query, user_id, after, limit):
+    limit = _clamp_follow_limit(limit)
+    users = page_query(user_id, after, limit).all()
+    next_cursor = users[limit - 1].id if len(users) > limit else None
+    return users[:limit], next_cursor
+
+
+def following_page(user_id, after=None, limit=FOLLOW_PAGE_SIZE):
+    """user_id がフォローしているユーザー。戻り値: (users, next_cursor)"""
+    return _follow_page(following_page_query, user_id, after, limit)
+
+
+def followers_page(user_id, after=None, limit=FOLLOW_PAGE_SIZE):
+    """user_id をフォローしているユーザー。戻り値: (users, next_cursor)"""
+    return _follow_page(followers_page_query, user_id, after, limit)
@@ -0,0 +1,227 @@
+# app/auth/outbox.py
+# アウトボックス（email_outbox テーブル）のメールを送信するバックグラウンドスレッド
+#
+# - EMAIL_OUTBOX_POLL_INTERVAL 秒ごとに送信時刻を過ぎたメールを最大
+#   EMAIL_OUTBOX_BATCH_SIZE 件取り出し、1 つの接続でまとめて送る。
+# - 取り出しは UPDATE ... RETURNING で status を sending にするため、
+#   複数の gunicorn ワーカーで動いても同じメールを二重に取り出さない。
+#   sending のままプロセスが落ちたメールは持ち時間（EMAIL_OUTBOX_LEASE_SECONDS）後に再送する。
+# - 失敗したメールは backoff * 2^(試行回数-1) 秒後に再試行し、
+#   EMAIL_OUTBOX_MAX_ATTEMPTS 回失敗したら dead にして以後は送らない。
+# - スレッドは最初のリクエストを受けたときに起動する。flask の CLI コマンドでは起動しない。
+import atexit
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from app.extensions import db
+from app.auth.models import OutboxEmail
+from app.auth.email_utils import get_transport
+
+logger = logging.getLogger(__name__)
+
+
+def due_emails_query(now, batch_size):
+    """送信時刻を過ぎたメールの ID（送信予定の早い順に batch_size 件）"""
+    return (
+        db.select(OutboxEmail.id)
+        .where(
+            OutboxEmail.status.in_([OutboxEmail.PENDING, OutboxEmail.SENDING]),
+            OutboxEmail.next_attempt_at <= now,
+        )
+        .order_by(OutboxEmail.next_attempt_at)
+        .limit(batch_size)
+    )
+
+
+class EmailDispatcher:
+    def __init__(
+        self,
+        app,
+        poll_interval=1.0,
+        batch_size=50,
+        max_attempts=6,
+        backoff=5,
+        lease=300,
+    ):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self._wake = threading.Event()
+        self._stopped = False
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="email-outbox", daemon=True
+        )
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+
+    def start(self):
+        """スレッドを起動する（2 回目以降は何もしない）"""
+        with self._start_lock:
+            if self._started:
+                return self
+            self._started = True
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def wake(self):
+        """ポーリング間隔を待たずに送信させる"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                while self.dispatch() == self.batch_size and not self._stopped:
+                    pass
+            except OperationalError as e:
+                # 一括投入などで書き込みロックが長く取られている（次の周期で再試行）
+                logger.warning("email outbox dispatch skipped: %s", e.orig)
+            except Exception:
+                logger.exception("email outbox dispatch failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    # ----------------------
+    # 取り出し・送信
+    # ----------------------
+    def _claim(self, now):
+        """送信対象を sending にして取り出す"""
+        due = due_emails_query(now, self.batch_size)
+        rows = db.session.execute(
+            db.update(OutboxEmail)
+            .where(OutboxEmail.id.in_(due.scalar_subquery()))
+            .values(
+                status=OutboxEmail.SENDING,
+                attempts=OutboxEmail.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=self.lease),
+            )
+            .returning(
+                OutboxEmail.id,
+                OutboxEmail.to_email,
+                OutboxEmail.subject,
+                OutboxEmail.body,
+                OutboxEmail.attempts,
+            )
+        ).all()
+        db.session.commit()
+        return rows
+
+    def _retry_at(self, now, attempts):
+        delay = self.backoff * 2 ** (attempts - 1)
+        # 同時に失敗したメールの再試行が重ならないよう少しずらす
+        return now + timedelta(seconds=delay * random.uniform(1.0, 1.25))
+
+    def dispatch(self):
+        """送信時刻を過ぎたメールを 1 バッチ分送る。戻り値: 取り出した件数"""
+        with self.app.app_context():
+            now = datetime.utcnow()
+            rows = self._claim(now)
+            if not rows:
+                return 0
+
+            results = {}
+            transport = get_transport(self.app.config)
+            try:
+                transport.open()
+            except Exception as e:
+                # 接続できない場合はバッチ全体を失敗扱いにする
+                results = {row.id: e for row in rows}
+            else:
+                try:
+                    for row in rows:
+                        try:
+                            transport.send(row.to_email, row.subject, row.body)
+                            results[row.id] = None
+                        except Exception as e:
+                            results[row.id] = e
+                finally:
+                    transport.close()
+
+            now = datetime.utcnow()
+            for row in rows:
+                error = results[row.id]
+                if error is None:
+                    values = {"status": OutboxEmail.SENT, "sent_at": now, "last_error": None}
+                    self.sent += 1
+                elif row.attempts >= self.max_attempts:
+                    values = {"status": OutboxEmail.DEAD, "last_error": repr(error)}
+                    self.dead += 1
+                    logger.error("email %d to %s is dead: %r", row.id, row.to_email, error)
+                else:
+                    values = {
+                        "status": OutboxEmail.PENDING,
+                        "next_attempt_at": self._retry_at(now, row.attempts),
+                        "last_error": repr(error),
+                    }
+                    self.failed += 1
+                    logger.warning("email %d to %s failed: %r", row.id, row.to_email, error)
+                db.session.execute(
+                    db.update(OutboxEmail).where(OutboxEmail.id == row.id).values(values)
+                )
+            db.session.commit()
+            return len(rows)
+
+
+_dispatcher = None
+
+
+def init_email_outbox(app):
+    global _dispatcher
+    _dispatcher = EmailDispatcher(
+        app,
+        poll_interval=app.config.get("EMAIL_OUTBOX_POLL_INTERVAL", 1.0),
+        batch_size=app.config.get("EMAIL_OUTBOX_BATCH_SIZE", 50),
+        max_attempts=app.config.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 6),
+        backoff=app.config.get("EMAIL_OUTBOX_BACKOFF_SECONDS", 5),
+        lease=app.config.get("EMAIL_OUTBOX_LEASE_SECONDS", 300),
+    )
+    app.extensions["email_outbox"] = _dispatcher
+    if app.config.get("EMAIL_OUTBOX_ENABLED", True):
+        # リクエストを受けたプロセスでだけ起動する
+        # （flask outbox-send などの CLI コマンドでは送信スレッドを動かさない）
+        dispatcher = _dispatcher
+
+        @app.before_request
+        def start_email_outbox():
+            dispatcher.start()
+
+    return _dispatcher
+
+
+def wake_dispatcher():
+    """登録したメールをすぐ送らせる（commit 後に呼ぶ）"""
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def requeue_dead():
+    """dead のメールを再送対象に戻す。戻り値: 件数"""
+    count = (
+        OutboxEmail.query.filter_by(status=OutboxEmail.DEAD)
+        .update(
+            {
+                OutboxEmail.status: OutboxEmail.PENDING,
+                OutboxEmail.attempts: 0,
+                OutboxEmail.next_attempt_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+    )
+    db.session.commit()
+    return count
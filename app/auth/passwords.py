@@ -0,0 +1,106 @@
+# app/auth/passwords.py
+# パスワードハッシュの方式とワーカープール
+#
+# scrypt / pbkdf2 は 1 回で数十〜数百 ms CPU を使うため、ログインが集中すると
+# 全ワーカーがハッシュ計算で埋まる。計算は上限付きのスレッドプールで行い
+# （hashlib の scrypt / pbkdf2 は計算中 GIL を手放す）、待ちがあふれたら
+# PasswordHashBusy を送出して 503 を返す（並ばせ続けない）。
+#
+# 方式・コストは create_app の PASSWORD_HASH_METHOD で設定する（werkzeug の method 書式）。
+# 保存済みハッシュの方式が現在の設定と違う場合は、ログイン成功時に作り直す。
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+DEFAULT_SALT_LENGTH = 16
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_TIMEOUT = 5
+
+
+class PasswordHashBusy(Exception):
+    """ハッシュ計算の待ちがいっぱい（しばらくしてから再試行）"""
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        method=DEFAULT_METHOD,
+        salt_length=DEFAULT_SALT_LENGTH,
+        workers=DEFAULT_WORKERS,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.configure(method, salt_length, workers, queue_size, timeout)
+
+    def configure(
+        self,
+        method=DEFAULT_METHOD,
+        salt_length=DEFAULT_SALT_LENGTH,
+        workers=DEFAULT_WORKERS,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.method = method
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._prefix = None
+        # 実行中 + 待ちの合計がこれを超えたら受け付けない
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        old = getattr(self, "_pool", None)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHashBusy()
+
+    def hash(self, password: str) -> str:
+        return self._run(
+            generate_password_hash, password, self.method, self.salt_length
+        )
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    @property
+    def prefix(self) -> str:
+        """現在の設定で作られるハッシュの "方式:パラメータ" 部分
+
+        method を "scrypt" のように省略した場合も werkzeug の既定値で補われた形になる。
+        """
+        if self._prefix is None:
+            self._prefix = generate_password_hash("", self.method, 1).split("$", 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        return pwhash.split("$", 1)[0] != self.prefix
+
+
+password_hasher = PasswordHasher()
+
+
+def init_password_hasher(app):
+    password_hasher.configure(
+        method=app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD),
+        salt_length=app.config.get("PASSWORD_HASH_SALT_LENGTH", DEFAULT_SALT_LENGTH),
+        workers=app.config.get("PASSWORD_HASH_WORKERS", DEFAULT_WORKERS),
+        queue_size=app.config.get("PASSWORD_HASH_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+        timeout=app.config.get("PASSWORD_HASH_TIMEOUT", DEFAULT_TIMEOUT),
+    )
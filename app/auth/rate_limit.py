@@ -0,0 +1,174 @@
+# app/auth/rate_limit.py
+# ログイン・パスワードリセットの試行回数制限（トークンバケット）
+#
+# 1 回の試行でユーザー検索とパスワードハッシュ（数十〜数百 ms の CPU）が走るため、
+# IP ごと・アカウント（メールアドレス）ごとにバケットを持ち、
+# 空になったら DB にもハッシュにも触れずに 429 を返す。
+#
+# バケットは (残りトークン数, 最終更新時刻) の 2 値だけで、確認は O(1)。
+# - "memory": プロセス内の LRU（AUTH_RATE_LIMIT_MAX_KEYS 個まで。あふれたら古いキーから忘れる）
+# - "sqlite": instance/ratelimit.db を gunicorn の全ワーカーで共有する
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+DEFAULT_MAX_KEYS = 100000
+
+
+class RateLimited(Exception):
+    """試行回数の上限に達した"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def parse_rate(rate):
+    """"回数/秒数" を (容量, 1 秒あたりの回復量) に変換する（例: "10/60"）"""
+    count, seconds = rate.split("/")
+    count, seconds = int(count), float(seconds)
+    return count, count / seconds
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, now=None):
+        """トークンを 1 つ使う。戻り値: 使えなかった場合に待つべき秒数（使えたら 0）"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / refill
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SQLiteBuckets:
+    """複数プロセスで共有するバケット（1 回の確認は 1 トランザクション）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, refill, now=None):
+        # プロセス間で比較するため壁時計を使う
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(now - updated, 0) * refill)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / refill
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated = excluded.updated",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self.prune(now)
+        return wait
+
+    def prune(self, now, horizon=3600):
+        """しばらく使われていない（満タンに戻った）バケットを削除する"""
+        self._connect().execute(
+            "DELETE FROM buckets WHERE updated < ?", (now - horizon,)
+        )
+
+
+class AuthRateLimiter:
+    def __init__(self, backend, rules):
+        self.backend = backend
+        # 種類 -> (容量, 回復量)
+        self.rules = rules
+
+    def check(self, scope, ip, account=None):
+        """IP・アカウントのバケットからトークンを使う。どちらかが空なら RateLimited"""
+        waits = []
+        if "ip" in self.rules and ip:
+            waits.append(self.backend.take(f"{scope}:ip:{ip}", *self.rules["ip"]))
+        if "account" in self.rules and account:
+            waits.append(
+                self.backend.take(f"{scope}:account:{account}", *self.rules["account"])
+            )
+        wait = max(waits, default=0)
+        if wait > 0:
+            raise RateLimited(math.ceil(wait))
+
+
+def init_rate_limiter(app):
+    rules = {}
+    if app.config.get("AUTH_RATE_LIMIT_IP"):
+        rules["ip"] = parse_rate(app.config["AUTH_RATE_LIMIT_IP"])
+    if app.config.get("AUTH_RATE_LIMIT_ACCOUNT"):
+        rules["account"] = parse_rate(app.config["AUTH_RATE_LIMIT_ACCOUNT"])
+
+    if app.config.get("AUTH_RATE_LIMIT_BACKEND") == "sqlite":
+        backend = SQLiteBuckets(os.path.join(app.instance_path, "ratelimit.db"))
+    else:
+        backend = MemoryBuckets(
+            app.config.get("AUTH_RATE_LIMIT_MAX_KEYS", DEFAULT_MAX_KEYS)
+        )
+    app.extensions["auth_rate_limiter"] = AuthRateLimiter(backend, rules)
+
+
+def rate_limited(scope, account_field="email"):
+    """POST のときだけ、ビューの処理（DB・ハッシュ）より前に試行回数を確認する"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get("auth_rate_limiter")
+            if limiter is not None and request.method == "POST":
+                account = (request.form.get(account_field) or "").strip().lower()
+                limiter.check(scope, request.remote_addr, account or None)
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
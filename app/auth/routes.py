@@ -1,4 +1,3 @@
-import os
 from flask import (
     Blueprint,
     render_template,
@@ -7,13 +6,21 @@ from flask import (
     flash,
     request,
     current_app,
+    abort,
+    send_from_directory,
 )
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
 
-from app.auth.models import User
+from app.auth.models import User, following_page, followers_page
+from app.auth.user_cache import user_cache, current_user_model
+from app.auth.passwords import PasswordHashBusy
+from app.auth.rate_limit import RateLimited, rate_limited
+from app.auth.email_utils import send_otp_email
+from app.auth.outbox import wake_dispatcher
+from app.auth.icons import ICON_FILENAME, ICON_MAX_AGE, IconError, read_icon, submit_icon
 from app.auth.forms import RegisterForm, LoginForm, EditProfileForm
 from app.extensions import db, login_manager
+from app.feed import timeline
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth", static_folder="static")
 
@@ -22,7 +29,25 @@ auth_bp = Blueprint("auth", __name__, url_prefix="/auth", static_folder="static"
 # ----------------------
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # 読み取り専用のスナップショット（書き換えるときは current_user_model()）
+    return user_cache.load(int(user_id))
+
+
+# ----------------------
+# パスワードハッシュの待ちがあふれた場合 / 試行回数の上限
+# ----------------------
+@auth_bp.errorhandler(PasswordHashBusy)
+def password_hash_busy(e):
+    return "混み合っています。しばらくしてから再度お試しください。", 503, {"Retry-After": "1"}
+
+
+@auth_bp.errorhandler(RateLimited)
+def rate_limited_error(e):
+    return (
+        "試行回数が多すぎます。しばらくしてから再度お試しください。",
+        429,
+        {"Retry-After": str(e.retry_after)},
+    )
 
 
 # ----------------------
@@ -53,11 +78,15 @@ def register():
 # ログイン
 # ----------------------
 @auth_bp.route("/login", methods=["GET", "POST"])
+@rate_limited("login")
 def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
+            # ハッシュの方式・コストを変更した場合はここで新しい設定に移行する
+            if user.rehash_password(form.password.data):
+                db.session.commit()
             login_user(user)
             flash("ログイン成功！", "success")
             return redirect(url_for("feed.feed_home"))
@@ -90,16 +119,101 @@ def profile():
         flash("ユーザーが存在しません。", "danger")
         return redirect(url_for("feed.feed_home"))
 
-    # キャッシュ回避のためにクエリパラメータを追加
-    icon_url = (
-        url_for(
-            "auth.static",
-            filename=f"icons/{getattr(user, 'icon', 'default.png')}",
-        )
-        + f"?v={user.id}{getattr(user, 'icon', '')}"
+    # モーダルには先頭ページだけ（続きは一覧ページで）
+    followers_preview, followers_more = followers_page(user.id)
+    following_preview, following_more = following_page(user.id)
+
+    return render_template(
+        "auth/profile.html",
+        user=user,
+        is_following=current_user.id != user.id and current_user.is_following(user),
+        followers_preview=followers_preview,
+        followers_more=followers_more is not None,
+        following_preview=following_preview,
+        following_more=following_more is not None,
     )
 
-    return render_template("auth/profile.html", user=user, icon_url=icon_url)
+
+# ----------------------
+# フォロー / フォロワー一覧
+# ----------------------
+def _follow_list(user_id, load_page, title):
+    user = User.query.get_or_404(user_id)
+    users, next_cursor = load_page(
+        user.id, after=request.args.get("after"), limit=request.args.get("limit")
+    )
+    # 各ユーザーをフォロー済みかを 1 クエリで取得
+    state = current_user.follow_state([u.id for u in users])
+    return render_template(
+        "auth/follow_list.html",
+        title=title.format(username=user.username),
+        user=user,
+        users=users,
+        following_ids=state.following,
+        followed_by_ids=state.followed_by,
+        next_cursor=next_cursor,
+    )
+
+
+@auth_bp.route("/following/<int:user_id>")
+@login_required
+def following_list(user_id):
+    return _follow_list(user_id, following_page, "{username} がフォロー中")
+
+
+@auth_bp.route("/followers/<int:user_id>")
+@login_required
+def followers_list(user_id):
+    return _follow_list(user_id, followers_page, "{username} のフォロワー")
+
+
+# ----------------------
+# フォロー / フォロー解除
+# ----------------------
+@auth_bp.route("/follow/<int:user_id>", methods=["POST"])
+@login_required
+def follow(user_id):
+    user = User.query.get_or_404(user_id)
+    if user.id == current_user.id:
+        flash("自分自身はフォローできません。", "danger")
+        return redirect(url_for("auth.profile", user_id=user.id))
+
+    me = current_user_model()
+    if not me.is_following(user):
+        previous = user.follower_count
+        me.follow(user)
+        timeline.backfill(me, user)
+        timeline.switch_fanout(user, previous)
+        db.session.commit()
+    return redirect(url_for("auth.profile", user_id=user.id))
+
+
+@auth_bp.route("/unfollow/<int:user_id>", methods=["POST"])
+@login_required
+def unfollow(user_id):
+    user = User.query.get_or_404(user_id)
+    me = current_user_model()
+    if me.is_following(user):
+        previous = user.follower_count
+        me.unfollow(user)
+        timeline.remove_actor(me, user)
+        timeline.switch_fanout(user, previous)
+        db.session.commit()
+    return redirect(url_for("auth.profile", user_id=user.id))
+
+
+# ----------------------
+# アイコン配信（ファイル名が内容のハッシュなので変更されない）
+# ----------------------
+@auth_bp.route("/icons/<filename>")
+def icon(filename):
+    if not ICON_FILENAME.match(filename):
+        abort(404)
+    response = send_from_directory(
+        current_app.config["ICON_FOLDER"], filename, max_age=ICON_MAX_AGE
+    )
+    response.cache_control.immutable = True
+    return response
 
 
 # ----------------------
@@ -111,33 +225,27 @@ def edit_profile():
     form = EditProfileForm()
 
     if form.validate_on_submit():
+        me = current_user_model()
         # ユーザー名・自己紹介更新
-        current_user.username = form.username.data
-        current_user.bio = getattr(form, "bio", getattr(current_user, "bio", ""))
+        me.username = form.username.data
+        me.bio = form.bio.data or ""
 
-        # アップロードされたアイコン画像を処理
+        # アップロードされたアイコン画像を確認（縮小・保存は commit 後にバックグラウンドで）
+        icon = None
         cropped_icon = request.files.get("cropped_icon")
         if cropped_icon and cropped_icon.filename:
-            # 安全なファイル名と拡張子取得
-            filename_secure = secure_filename(cropped_icon.filename)
-            _, ext = os.path.splitext(filename_secure)
-            ext = ext.lower() if ext else ".png"
-
-            # 保存先フォルダ
-            upload_folder = os.path.join(current_app.root_path, "static", "icons")
-            os.makedirs(upload_folder, exist_ok=True)
-
-            # ファイル名は userID + 拡張子
-            filename = f"{current_user.id}{ext}"
-            filepath = os.path.join(upload_folder, filename)
-
-            # 保存
-            cropped_icon.save(filepath)
-            current_user.icon = filename
+            try:
+                icon = read_icon(cropped_icon)
+            except IconError as e:
+                flash(f"アイコンを更新できませんでした: {e}", "danger")
 
         # DB保存
         db.session.commit()
+        if icon is not None:
+            submit_icon(current_app._get_current_object(), me.id, *icon)
         flash("プロフィールを更新しました！", "success")
+        if icon is not None:
+            flash("アイコンは変換後に反映されます。", "info")
         return redirect(url_for("auth.profile", user_id=current_user.id))
 
     # GETの場合、フォーム初期値設定
@@ -151,6 +259,7 @@ def edit_profile():
 # パスワードリセット（簡易版）
 # ----------------------
 @auth_bp.route("/reset", methods=["GET", "POST"])
+@rate_limited("reset")
 def reset_request():
     if request.method == "POST":
         email = request.form.get("email")
@@ -163,7 +272,13 @@ def reset_request():
             flash("該当ユーザーなし", "danger")
             return redirect(url_for("auth.reset_request"))
 
-        flash(f"{email} にリセットリンクを送信しました（デモ）", "success")
+        # 送信はバックグラウンドで行う（ここではアウトボックスに登録するだけ）
+        code = user.set_otp()
+        send_otp_email(user, code)
+        db.session.commit()
+        wake_dispatcher()
+
+        flash(f"{email} に確認コードを送信しました", "success")
         return redirect(url_for("auth.login"))
 
     return render_template("auth/reset_request.html")
@@ -0,0 +1,153 @@
+# app/auth/user_cache.py
+# Flask-Login の user_loader 用ユーザーキャッシュ
+#
+# ログイン中はいいね・コメントの XHR を含む全リクエストで user_loader が呼ばれるため、
+# プロセス内に読み取り専用のスナップショットを TTL 付きで保持して SELECT を 1 本減らす。
+# current_user はセッションから切り離された UserSnapshot になるので、
+# ユーザーを書き換えるルートは current_user_model() で ORM の User を取り直すこと。
+#
+# User の行が UPDATE されると（プロフィール編集・パスワード変更・フォロー数の増減）
+# commit 後にそのユーザーのエントリを捨てる。他のワーカーでの更新は TTL で反映される。
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin, current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import db
+from app.auth.models import User, FollowState, follow_state, is_following
+
+DEFAULT_TTL = 30
+DEFAULT_MAX_SIZE = 10000
+
+# スナップショットに写す列（パスワードハッシュ・OTP は持たない）
+SNAPSHOT_FIELDS = (
+    "id",
+    "username",
+    "email",
+    "icon",
+    "bio",
+    "follower_count",
+    "following_count",
+)
+
+
+class UserSnapshot(UserMixin):
+    """current_user 用の読み取り専用ユーザー（DB セッションに属さない）"""
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, user):
+        for name in SNAPSHOT_FIELDS:
+            object.__setattr__(self, name, getattr(user, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "UserSnapshot は読み取り専用です。current_user_model() で User を取得してください"
+        )
+
+    def is_following(self, user) -> bool:
+        return is_following(self.id, user.id)
+
+    def follow_state(self, user_ids) -> FollowState:
+        return follow_state(self, user_ids)
+
+    def followed_count(self) -> int:
+        return self.following_count or 0
+
+    def followers_count(self) -> int:
+        return self.follower_count or 0
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.username}>"
+
+
+class UserCache:
+    """TTL・件数上限付きの LRU キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> (期限, UserSnapshot)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_id):
+        """スナップショットを返す。キャッシュになければ DB から読む"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user)
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+user_cache = UserCache()
+
+
+def init_user_cache(app):
+    user_cache.ttl = app.config.get("USER_CACHE_TTL", DEFAULT_TTL)
+    user_cache.max_size = app.config.get("USER_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE)
+
+
+def current_user_model():
+    """ログイン中ユーザーの ORM オブジェクト（書き換え用）"""
+    return db.session.get(User, current_user.id)
+
+
+# ----------------------
+# 更新されたユーザーを commit 後に捨てる
+# ----------------------
+@event.listens_for(User, "after_update")
+def _mark_updated(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("updated_user_ids", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_updated(session):
+    user_ids = session.info.pop("updated_user_ids", None)
+    if user_ids:
+        user_cache.invalidate(*user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_updated(session):
+    session.info.pop("updated_user_ids", None)
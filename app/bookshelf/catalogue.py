@@ -0,0 +1,145 @@
+# app/bookshelf/catalogue.py
+# おすすめの棚（data/curated_shelves.json）
+#
+# 起動時に 1 回読み込んで検証し、書き換えられない形（タプル / MappingProxyType）で
+# 全リクエストから共有する。ファイルの更新時刻が変わったら読み直し、
+# 検証に失敗した場合は前の内容を使い続ける。
+# 棚ページの HTML は棚ごとに初回だけ描画してキャッシュし、ETag を付けて返す
+# （内容が変わっていなければ 304）。カタログを読み直すとキャッシュは捨てる。
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+_RELOAD_CHECK_INTERVAL = 2
+
+# 項目名 -> 許される型（title だけ必須）
+BOOK_FIELDS = {
+    "title": str,
+    "author": str,
+    "description": str,
+    "image": str,
+    "itemUrl": str,
+    "price": int,
+    "isbn": str,
+    "tags": str,
+}
+
+
+class CatalogueError(ValueError):
+    """おすすめの棚のファイルが不正"""
+
+
+def validate(data):
+    """{棚の名前: [本]} を検証して凍結した形にする。不正なら CatalogueError"""
+    if not isinstance(data, dict):
+        raise CatalogueError("棚の名前をキーにしたオブジェクトではありません")
+    errors = []
+    shelves = {}
+    for name, books in data.items():
+        if not isinstance(books, list):
+            errors.append(f"{name}: 本のリストではありません")
+            continue
+        frozen = []
+        for i, book in enumerate(books):
+            where = f"{name}[{i}]"
+            if not isinstance(book, dict):
+                errors.append(f"{where}: オブジェクトではありません")
+                continue
+            if not book.get("title"):
+                errors.append(f"{where}: title がありません")
+            for field, value in book.items():
+                expected = BOOK_FIELDS.get(field)
+                if expected is None:
+                    errors.append(f"{where}: 不明な項目 {field}")
+                elif not isinstance(value, expected) or isinstance(value, bool):
+                    errors.append(f"{where}.{field}: {expected.__name__} ではありません")
+            frozen.append(MappingProxyType(dict(book)))
+        shelves[name] = tuple(frozen)
+    if errors:
+        raise CatalogueError("; ".join(errors))
+    return MappingProxyType(shelves)
+
+
+class CuratedCatalogue:
+    def __init__(self):
+        self.path = None
+        self.version = 0
+        self.shelves = MappingProxyType({})
+        self._mtime = None
+        self._checked = 0.0
+        self._pages = {}  # 棚の名前 -> (HTML, ETag)
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ファイルを読み直す。戻り値: 読み込めたか"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding="utf-8") as f:
+                shelves = validate(json.load(f))
+        except (OSError, ValueError) as e:
+            # 前の内容を使い続ける（同じ更新時刻のファイルは再度読まない）
+            logger.error("curated shelves %s not loaded: %s", self.path, e)
+            self._mtime = self._file_mtime()
+            return False
+        with self._lock:
+            self.shelves = shelves
+            self._mtime = mtime
+            self.version += 1
+            self._pages = {}
+        logger.info("curated shelves loaded: %d shelves", len(shelves))
+        return True
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self):
+        """ファイルが変わっていれば読み直す（数秒に 1 回だけ確認する）"""
+        now = time.monotonic()
+        if now - self._checked < _RELOAD_CHECK_INTERVAL:
+            return
+        self._checked = now
+        if self._file_mtime() != self._mtime:
+            self.load()
+
+    def names(self):
+        self.refresh()
+        return list(self.shelves)
+
+    def books(self, name):
+        self.refresh()
+        return self.shelves.get(name, ())
+
+    def page(self, name, render):
+        """棚ページの (HTML, ETag)。render(books) で初回だけ描画する"""
+        self.refresh()
+        with self._lock:
+            cached = self._pages.get(name)
+            version, shelves = self.version, self.shelves
+        if cached is not None:
+            return cached
+        html = render([dict(book) for book in shelves.get(name, ())])
+        etag = hashlib.sha256(html.encode("utf-8")).hexdigest()[:32]
+        with self._lock:
+            # 描画中に読み直された場合は古い HTML をキャッシュしない
+            if version == self.version:
+                self._pages[name] = (html, etag)
+        return html, etag
+
+
+curated_catalogue = CuratedCatalogue()
+
+
+def init_curated_catalogue(app):
+    curated_catalogue.path = app.config.get("BOOKSHELF_CURATED_FILE") or os.path.join(
+        os.path.dirname(app.root_path), "data", "curated_shelves.json"
+    )
+    curated_catalogue.load()
@@ -0,0 +1,270 @@
+# app/bookshelf/covers.py
+# 表紙画像のプロキシ（/bookshelf/cover/<key>）とディスクキャッシュ（instance/covers）
+#
+# 検索結果・棚の表紙 URL を /bookshelf/cover/<key> に書き換え、ブラウザは外部サイトではなく
+# このアプリから画像を受け取る。<key> は元の URL を base64url にしたもので、
+# COVER_HOSTS のホストだけを取りに行く（任意の URL を取りに行くプロキシにしない）。
+# 呼び出し先（サーキットブレーカー）はホストごとに分ける。
+# - 同じ画像は 1 回だけ取得してディスクに保存し、以後はディスクから返す
+#   （URL の画像は変わらない前提で immutable を付ける）。同時に来たリクエストは
+#   縮小版の幅が違っても元の URL ごとに 1 つだけが取りに行き、残りはその保存を待つ
+# - 取得は COVER_MAX_BYTES までしか読まない
+# - ?w=64/128/256 で縮小版（WebP）を返す。縮小版も初回に作って保存する
+# - 合計サイズが max_bytes を超えたら、最後に使われた（mtime が古い）ファイルから消す
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from flask import url_for
+from PIL import Image, ImageOps
+
+from .http_client import ResponseTooLarge, client
+
+logger = logging.getLogger(__name__)
+
+# 取りに行くホスト -> http_client の送信先
+COVER_HOSTS = {
+    "covers.openlibrary.org": "covers:openlibrary",
+    "thumbnail.image.rakuten.co.jp": "covers:rakuten",
+}
+COVER_WIDTHS = (64, 128, 256)
+COVER_MAX_AGE = 365 * 24 * 60 * 60
+COVER_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# 使われた時刻（mtime）の更新は、前回からこの秒数以上たっているときだけ行う
+_TOUCH_INTERVAL = 60 * 60
+
+
+class CoverError(Exception):
+    """表紙画像を返せない（キーが不正・取得できない・画像でない）"""
+
+
+def cover_key(url):
+    return base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def cover_source(key):
+    """キーから元の URL を取り出す。許可していないホストなら CoverError"""
+    try:
+        url = base64.urlsafe_b64decode(key + "=" * (-len(key) % 4)).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise CoverError("invalid key") from e
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or parts.hostname not in COVER_HOSTS:
+        raise CoverError("host not allowed")
+    return url
+
+
+def cover_url(url, width=None):
+    """表紙の URL をプロキシの URL にする（対象外のホストならそのまま）"""
+    if not url or urlsplit(url).hostname not in COVER_HOSTS:
+        return url
+    if width:
+        return url_for("bookshelf.cover", key=cover_key(url), w=width)
+    return url_for("bookshelf.cover", key=cover_key(url))
+
+
+def proxy_covers(books):
+    """本の image / cover をプロキシの URL にしたコピーを返す"""
+    proxied = []
+    for book in books:
+        book = dict(book)
+        for field in ("image", "cover"):
+            if book.get(field):
+                book[field] = cover_url(book[field])
+        proxied.append(book)
+    return proxied
+
+
+class CoverCache:
+    def __init__(self):
+        self.folder = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self._total = None
+        self._flights = {}  # 元の URL -> [ロック, 待っている数]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, url, width):
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.folder, f"{name}-{width}" if width else name)
+
+    @contextmanager
+    def _single_flight(self, url):
+        """元の URL ごとのロック。最後の 1 つが抜けたときに片付ける"""
+        with self._lock:
+            flight = self._flights.get(url)
+            if flight is None:
+                flight = self._flights[url] = [threading.Lock(), 0]
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[url]
+
+    # ----------------------
+    # ディスク
+    # ----------------------
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # LRU のため使われた時刻を残す
+        try:
+            if time.time() - os.stat(path).st_mtime > _TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data):
+        tmp = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()[1]
+            else:
+                self._total += len(data)
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan(self):
+        files, total = [], 0
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and ".tmp" not in entry.name:
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        return files, total
+
+    def evict(self):
+        """上限の 9 割になるまで古く使われたファイルから消す"""
+        files, total = self._scan()
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._total = total
+
+    # ----------------------
+    # 取得
+    # ----------------------
+    def _fetch(self, url):
+        upstream = client(COVER_HOSTS[urlsplit(url).hostname])
+        try:
+            response = upstream.get(url, max_bytes=COVER_MAX_BYTES)
+        except ResponseTooLarge as e:
+            raise CoverError("too large") from e
+        if response.status_code != 200:
+            raise CoverError(f"HTTP {response.status_code}")
+        return response.content
+
+    def _resize(self, data, width):
+        # 途中で切れた JPEG などはデコード（convert / resize）の段階で失敗するため、全体を囲む
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            buf = io.BytesIO()
+            image.save(buf, "WEBP", quality=80, method=6)
+        except Exception as e:
+            raise CoverError("not an image") from e
+        return buf.getvalue()
+
+    def get(self, key, width=None):
+        """(バイト列, MIME タイプ, ETag) を返す。返せなければ CoverError"""
+        url = cover_source(key)
+        if width is not None and width not in COVER_WIDTHS:
+            raise CoverError("unsupported width")
+        path = self._path(url, width)
+
+        data = self._read(path)
+        if data is None:
+            # 同じ画像を同時に取りに行かない（2 つ目以降は 1 つ目の保存を待つ）
+            with self._single_flight(url):
+                data = self._read(path)
+                if data is None:
+                    self.misses += 1
+                    original = self._original(url)
+                    data = self._resize(original, width) if width else original
+                    if width:
+                        self._write(path, data)
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+
+        mimetype = "image/webp" if width else _sniff(data)
+        if mimetype is None:
+            raise CoverError("not an image")
+        # ETag は返す内容のハッシュ（同じ URL でも取り直して内容が変われば変わる）
+        return data, mimetype, hashlib.sha256(data).hexdigest()[:32]
+
+    def _original(self, url):
+        path = self._path(url, None)
+        data = self._read(path)
+        if data is None:
+            data = self._fetch(url)
+            if _sniff(data) is None:
+                raise CoverError("not an image")
+            self._write(path, data)
+        return data
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _sniff(data):
+    """先頭のバイト列から画像の MIME タイプを判定する（画像でなければ None）"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+cover_cache = CoverCache()
+
+
+def init_cover_cache(app):
+    cover_cache.folder = app.config.get("BOOKSHELF_COVER_FOLDER") or os.path.join(
+        app.instance_path, "covers"
+    )
+    cover_cache.max_bytes = app.config.get("BOOKSHELF_COVER_MAX_BYTES", DEFAULT_MAX_BYTES)
+    os.makedirs(cover_cache.folder, exist_ok=True)
@@ -0,0 +1,279 @@
+# app/bookshelf/http_client.py
+# 外部 API（楽天ブックス / OpenLibrary / カーリル / 表紙画像）呼び出しの共通クライアント
+#
+# - 送信先ごとに requests.Session を 1 つ共有し、keep-alive で接続を使い回す
+#   （検索のたびに TCP + TLS のハンドシェイクをしない）
+# - 送信先ごとの接続 / 読み込みタイムアウト（応答しない API でワーカーが固まらない）
+#   requests のタイムアウトはソケット操作 1 回ごとなので、再試行と本文の読み込みを
+#   含めた全体の締め切り（total_timeout）も持ち、各試行には残り時間を渡す
+# - 接続エラー・タイムアウトと 502/503/504 は、締め切りまでに回数を限って再試行する
+# - サーキットブレーカー: 連続で失敗した送信先にはしばらく送らずに UpstreamError にする
+#   （送信先 = ホスト。表紙画像もホストごとに分ける）
+# - max_bytes を渡すと本文を読みながら上限で打ち切る（大きすぎる応答を全部読まない）
+# - 送信先ごとの件数・エラー数・所要時間（直近の p50 / p95）を記録する
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Upstream:
+    name: str
+    connect_timeout: float = 3.0
+    read_timeout: float = 5.0
+    # 再試行・本文の読み込みを含めた 1 回の get() の締め切り
+    total_timeout: float = 10.0
+    retries: int = 2
+    backoff: float = 0.2
+    pool_size: int = 10
+    # 連続失敗がこの回数に達したら reset_after 秒間は送らない
+    failure_threshold: int = 5
+    reset_after: float = 30.0
+
+
+UPSTREAMS = {
+    "rakuten": Upstream("rakuten"),
+    "openlibrary": Upstream("openlibrary", read_timeout=8.0, total_timeout=12.0),
+    "calil": Upstream("calil"),
+    "covers:openlibrary": Upstream("covers:openlibrary", pool_size=20),
+    "covers:rakuten": Upstream("covers:rakuten", pool_size=20),
+}
+
+
+RETRY_STATUSES = frozenset([502, 503, 504])
+CHUNK_SIZE = 16 * 1024
+
+
+class UpstreamError(Exception):
+    """外部 API が使えない（タイムアウト・接続エラー・エラー応答・遮断中）"""
+
+
+class ResponseTooLarge(UpstreamError):
+    """応答の本文が max_bytes を超えた（送信先の障害ではない）"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold, reset_after):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """送ってよいか。遮断中でも reset_after 経過後は試しに 1 件だけ通す"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "%s: circuit opened after %d failures", self.name, self.failures
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class UpstreamMetrics:
+    WINDOW = 512
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent = deque(maxlen=self.WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms, ok):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self._recent.append(elapsed_ms)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            pick = lambda q: round(recent[min(int(len(recent) * q), len(recent) - 1)], 1)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+                "p50_ms": pick(0.5) if recent else None,
+                "p95_ms": pick(0.95) if recent else None,
+                "max_ms": round(self.max_ms, 1),
+            }
+
+
+class UpstreamClient:
+    def __init__(self, upstream: Upstream):
+        self.upstream = upstream
+        self.session = requests.Session()
+        # 再試行は締め切りを見ながら get() で行う（urllib3 には任せない）
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=upstream.pool_size,
+            max_retries=Retry(total=0, read=False, raise_on_status=False),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker(
+            upstream.name, upstream.failure_threshold, upstream.reset_after
+        )
+        self.metrics = UpstreamMetrics()
+
+    def get(self, url, params=None, timeout=None, max_bytes=None):
+        """GET して Response（本文は読み込み済み）を返す。使えない場合は UpstreamError
+
+        timeout を渡すと total_timeout より短い方を全体の締め切りにする。
+        max_bytes を渡すと、本文がそれを超えた時点で読むのをやめて ResponseTooLarge にする。
+        """
+        if not self.breaker.allow():
+            self.metrics.reject()
+            raise UpstreamError(f"{self.upstream.name}: circuit open")
+
+        budget = self.upstream.total_timeout
+        if timeout is not None:
+            budget = min(budget, timeout)
+        deadline = time.monotonic() + budget
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            try:
+                response = self._get_until(url, params, deadline, max_bytes)
+            except ResponseTooLarge:
+                ok = True  # 送信先は応答している（ブレーカーでは失敗に数えない）
+                raise
+            ok = response.status_code < 500
+            if not ok:
+                raise UpstreamError(f"{self.upstream.name}: HTTP {response.status_code}")
+            return response
+        finally:
+            self.metrics.observe((time.perf_counter() - started) * 1000, ok)
+            self.breaker.record(ok)
+
+    def _get_until(self, url, params, deadline, max_bytes=None):
+        """締め切りまで再試行する。各試行のタイムアウトは残り時間以下"""
+        name = self.upstream.name
+        for attempt in range(self.upstream.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise UpstreamError(f"{name}: deadline exceeded")
+            timeout = (
+                min(self.upstream.connect_timeout, remaining),
+                min(self.upstream.read_timeout, remaining),
+            )
+            last = attempt == self.upstream.retries
+            try:
+                response = self.session.get(
+                    url, params=params, timeout=timeout, stream=True
+                )
+                if response.status_code in RETRY_STATUSES and not last:
+                    response.close()
+                else:
+                    return self._read_body(response, deadline, max_bytes)
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                urllib3.exceptions.HTTPError,  # 本文の読み込み中のタイムアウトなど
+            ) as e:
+                if last:
+                    raise UpstreamError(f"{name}: {e.__class__.__name__}") from e
+            except requests.RequestException as e:
+                raise UpstreamError(f"{name}: {e.__class__.__name__}") from e
+
+            delay = self.upstream.backoff * 2**attempt
+            if time.monotonic() + delay >= deadline:
+                raise UpstreamError(f"{name}: deadline exceeded")
+            time.sleep(delay)
+
+    def _read_body(self, response, deadline, max_bytes=None):
+        """本文を読み込む。締め切りを過ぎたら・max_bytes を超えたら打ち切る
+
+        届いた分ずつ読む（read1）ので、本文を少しずつ送ってくる相手でも
+        締め切りから 1 回の読み込みタイムアウト以上は遅れない。
+        """
+        name = self.upstream.name
+        chunks, size = [], 0
+        try:
+            length = response.headers.get("Content-Length", "")
+            if max_bytes is not None and length.isdigit() and int(length) > max_bytes:
+                raise ResponseTooLarge(f"{name}: {length} bytes")
+            while True:
+                chunk = response.raw.read1(CHUNK_SIZE, decode_content=True)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ResponseTooLarge(f"{name}: over {max_bytes} bytes")
+                if time.monotonic() > deadline:
+                    raise UpstreamError(f"{name}: deadline exceeded")
+        except BaseException:
+            # 読み残しのある接続はプールへ戻さずに閉じる
+            response.close()
+            raise
+        response._content = b"".join(chunks)
+        return response
+
+    def get_json(self, url, params=None, timeout=None):
+        response = self.get(url, params=params, timeout=timeout)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise UpstreamError(f"{self.upstream.name}: invalid JSON") from e
+
+
+_clients = {name: UpstreamClient(upstream) for name, upstream in UPSTREAMS.items()}
+
+
+def client(name) -> UpstreamClient:
+    return _clients[name]
+
+
+def metrics():
+    return {
+        name: {**c.metrics.snapshot(), "circuit": c.breaker.state}
+        for name, c in _clients.items()
+    }
@@ -0,0 +1,322 @@
+# app/bookshelf/libraries.py
+# 図書館カタログ（instance/libraries.json）と近くの図書館の検索
+#
+# カーリルの図書館一覧を手元に持ち、緯度経度の格子（約 5.5km 四方）ごとに
+# 図書館を振り分けた索引で k 件の最近傍をプロセス内で求める。
+# - 検索地点の半径 BOOKSHELF_LIBRARY_RADIUS_KM 以内に k 件そろわなければ
+#   カーリルに問い合わせ、返ってきた図書館をカタログに追加する
+# - 問い合わせた格子は _QUERIED_TTL の間覚えておき、図書館の少ない地域でも
+#   毎回カーリルに問い合わせずに手元で見つかった分だけを返す（ワーカーごと）
+# - バックグラウンドのスレッドが BOOKSHELF_LIBRARY_PREFS の都道府県の一覧を
+#   BOOKSHELF_LIBRARY_REFRESH_HOURS ごとに取り直す。スレッドは最初のリクエストを受けたときに
+#   起動し（CLI コマンドでは動かない）、取り直しはロックを取れた 1 プロセスだけが行う
+# 索引は作り直して差し替える（検索中の索引は書き換えない）。
+# ファイルの更新時刻が変わったら読み直すため、他のワーカーの更新も反映される。
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from filelock import FileLock, Timeout
+
+from .http_client import UpstreamError
+from .providers import find_nearby_libraries, list_libraries
+
+logger = logging.getLogger(__name__)
+
+CELL_DEG = 0.05
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_K = 5
+DEFAULT_RADIUS_KM = 30.0
+_RELOAD_CHECK_INTERVAL = 60
+_QUERIED_TTL = 24 * 60 * 60
+
+PREFECTURES = (
+    "北海道 青森県 岩手県 宮城県 秋田県 山形県 福島県 茨城県 栃木県 群馬県 埼玉県 "
+    "千葉県 東京都 神奈川県 新潟県 富山県 石川県 福井県 山梨県 長野県 岐阜県 静岡県 "
+    "愛知県 三重県 滋賀県 京都府 大阪府 兵庫県 奈良県 和歌山県 鳥取県 島根県 岡山県 "
+    "広島県 山口県 徳島県 香川県 愛媛県 高知県 福岡県 佐賀県 長崎県 熊本県 大分県 "
+    "宮崎県 鹿児島県 沖縄県"
+).split()
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """2 点間の距離（球面上の大円距離）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def library_entry(lib):
+    """カーリルの図書館 1 件を返却用の形にする（geocode はここで 1 回だけ解析する）"""
+    try:
+        lon, lat = map(float, (lib.get("geocode") or "").split(","))
+    except ValueError:
+        lon, lat = None, None
+    return {
+        "id": lib.get("libid") or lib.get("formal"),
+        "name": lib.get("formal"),
+        "lat": lat,
+        "lon": lon,
+        "url": f"https://calil.jp/library/{lib.get('systemid')}",
+    }
+
+
+def _cell(lat, lon):
+    return math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG)
+
+
+class GridIndex:
+    """格子ごとのバケット。中心の格子から外側へ 1 周ずつ広げて最近傍を探す"""
+
+    def __init__(self, entries):
+        self.size = 0
+        self._cells = defaultdict(list)
+        for entry in entries:
+            if entry["lat"] is None or entry["lon"] is None:
+                continue
+            self._cells[_cell(entry["lat"], entry["lon"])].append(entry)
+            self.size += 1
+
+    def nearest(self, lat, lon, k, radius_km):
+        """radius_km 以内で近い順に最大 k 件。戻り値: [(距離, 図書館)]"""
+        if not self.size:
+            return []
+        ci, cj = _cell(lat, lon)
+        # 1 周広げるごとに、少なくとも格子 1 つ分（経度方向は緯度で縮む）遠くなる
+        ring_km = CELL_DEG * 111.0 * max(math.cos(math.radians(abs(lat) + CELL_DEG)), 0.1)
+        max_ring = int(radius_km / ring_km) + 1
+        found = []
+        for ring in range(max_ring + 1):
+            for i in range(ci - ring, ci + ring + 1):
+                for j in range(cj - ring, cj + ring + 1):
+                    if max(abs(i - ci), abs(j - cj)) != ring:
+                        continue
+                    for entry in self._cells.get((i, j), ()):
+                        d = distance_km(lat, lon, entry["lat"], entry["lon"])
+                        if d <= radius_km:
+                            found.append((d, entry))
+            # 次の周の図書館はすべて ring * ring_km より遠い
+            if len(found) >= k:
+                found.sort(key=lambda f: f[0])
+                if found[k - 1][0] <= ring * ring_km:
+                    break
+        found.sort(key=lambda f: f[0])
+        return found[:k]
+
+
+class LibraryCatalogue:
+    def __init__(self):
+        self.path = None
+        self.k = DEFAULT_K
+        self.radius_km = DEFAULT_RADIUS_KM
+        self._libraries = {}  # id -> 図書館
+        self._index = GridIndex([])
+        self._mtime = None
+        self._checked = 0.0
+        self._queried = {}  # カーリルに問い合わせた格子 -> 期限
+        self._lock = threading.Lock()
+
+    # ----------------------
+    # ファイル
+    # ----------------------
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def load(self):
+        mtime = self._file_mtime()
+        if mtime is None:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                libraries = {lib["id"]: lib for lib in json.load(f)}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("library catalogue %s is unreadable: %s", self.path, e)
+            return
+        with self._lock:
+            self._libraries = libraries
+            self._index = GridIndex(libraries.values())
+            self._mtime = mtime
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked < _RELOAD_CHECK_INTERVAL:
+            return
+        self._checked = now
+        if self._file_mtime() != self._mtime:
+            self.load()
+
+    def _save(self, libraries):
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(libraries.values()), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._mtime = self._file_mtime()
+
+    def add(self, entries):
+        """図書館を追加（同じ id は置き換え）して索引を作り直す"""
+        with self._lock:
+            libraries = dict(self._libraries)
+            for entry in entries:
+                libraries[entry["id"]] = entry
+            if len(libraries) == len(self._libraries) and all(
+                self._libraries.get(e["id"]) == e for e in entries
+            ):
+                return
+            self._libraries = libraries
+            self._index = GridIndex(libraries.values())
+            try:
+                self._save(libraries)
+            except OSError as e:
+                logger.warning("library catalogue save failed: %s", e)
+
+    # ----------------------
+    # 検索
+    # ----------------------
+    def _recently_queried(self, lat, lon):
+        expires = self._queried.get(_cell(lat, lon))
+        return expires is not None and expires > time.monotonic()
+
+    def nearest(self, lat, lon, k=None):
+        """手元のカタログで近くの図書館を k 件返す
+
+        足りなければ None（カーリルに問い合わせる）。ただしその格子を最近
+        問い合わせ済みなら、カーリルにもそれ以上ないので見つかった分だけ返す。
+        """
+        k = k or self.k
+        self._reload_if_changed()
+        found = self._index.nearest(lat, lon, k, self.radius_km)
+        if len(found) < k and not self._recently_queried(lat, lon):
+            return None
+        return [dict(entry, distance_km=round(d, 2)) for d, entry in found]
+
+    def fetch_nearby(self, lat, lon, timeout=None):
+        """カーリルに問い合わせてカタログに追加し、近い順に返す"""
+        libs = find_nearby_libraries(lat, lon, timeout=timeout)
+        entries = [library_entry(lib) for lib in libs]
+        self.add([e for e in entries if e["id"]])
+        now = time.monotonic()
+        with self._lock:
+            self._queried = {
+                cell: expires for cell, expires in self._queried.items() if expires > now
+            }
+            self._queried[_cell(lat, lon)] = now + _QUERIED_TTL
+        found = sorted(
+            (
+                (distance_km(lat, lon, e["lat"], e["lon"]), e)
+                for e in entries
+                if e["lat"] is not None and e["lon"] is not None
+            ),
+            key=lambda f: f[0],
+        )
+        return [dict(entry, distance_km=round(d, 2)) for d, entry in found[: self.k]]
+
+    def refresh(self, prefectures):
+        """都道府県ごとの図書館一覧を取り直す。戻り値: 取得した件数
+
+        取れた都道府県の分はその都度カタログに追加する（途中で失敗しても残る）。
+        失敗した都道府県があれば、残りを取り終えてから UpstreamError にする。
+        """
+        count, failed = 0, []
+        for pref in prefectures:
+            try:
+                entries = [library_entry(lib) for lib in list_libraries(pref)]
+            except UpstreamError as e:
+                logger.info("library list for %s failed: %s", pref, e)
+                failed.append(pref)
+                continue
+            self.add([e for e in entries if e["id"]])
+            count += len(entries)
+        if failed:
+            raise UpstreamError(
+                f"{len(failed)} of {len(prefectures)} prefectures failed "
+                f"({count} libraries refreshed)"
+            )
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "libraries": len(self._libraries),
+            "indexed": self._index.size,
+            "queried_cells": len(self._queried),
+        }
+
+
+library_catalogue = LibraryCatalogue()
+
+
+class _Refresher:
+    def __init__(self, catalogue, prefectures, interval):
+        self.catalogue = catalogue
+        self.prefectures = prefectures
+        self.interval = interval
+        # 取り直すのはこのロックを持つ 1 プロセスだけ（持ち主が落ちたら他のプロセスが引き継ぐ）
+        self._owner = FileLock(catalogue.path + ".refresh.lock", thread_local=False)
+        self._stop = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="library-catalogue", daemon=True
+        )
+
+    def start(self):
+        """スレッドを起動する（2 回目以降は何もしない）"""
+        with self._start_lock:
+            if self._started:
+                return self
+            self._started = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._owner.is_locked:
+                try:
+                    self._owner.acquire(timeout=0)
+                except Timeout:
+                    # 他のプロセスが取り直している
+                    self._stop.wait(self.interval)
+                    continue
+            mtime = self.catalogue._file_mtime()
+            age = time.time() - mtime if mtime else None
+            if age is None or age >= self.interval:
+                try:
+                    count = self.catalogue.refresh(self.prefectures)
+                    logger.info("library catalogue refreshed: %d libraries", count)
+                except UpstreamError as e:
+                    # 取れなかった分は次の周期に回す（外部 API を叩き続けない）
+                    logger.warning("library catalogue refresh failed: %s", e)
+                except Exception:
+                    logger.exception("library catalogue refresh failed")
+                wait = self.interval
+            else:
+                wait = self.interval - age
+            self._stop.wait(wait)
+
+
+def init_library_catalogue(app):
+    library_catalogue.path = os.path.join(app.instance_path, "libraries.json")
+    library_catalogue.k = app.config.get("BOOKSHELF_LIBRARY_K", DEFAULT_K)
+    library_catalogue.radius_km = app.config.get(
+        "BOOKSHELF_LIBRARY_RADIUS_KM", DEFAULT_RADIUS_KM
+    )
+    library_catalogue.load()
+
+    prefectures = app.config.get("BOOKSHELF_LIBRARY_PREFS", PREFECTURES)
+    if prefectures and app.config.get("BOOKSHELF_LIBRARY_REFRESH", True):
+        interval = app.config.get("BOOKSHELF_LIBRARY_REFRESH_HOURS", 24) * 3600
+        refresher = _Refresher(library_catalogue, prefectures, interval)
+        app.extensions["library_refresher"] = refresher
+
+        @app.before_request
+        def start_library_refresher():
+            refresher.start()
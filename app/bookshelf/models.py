@@ -0,0 +1,27 @@
+from datetime import datetime
+from ..extensions import db
+
+
+# ======================
+# 「私の本棚」の本（BOOKSHELF_STORE=sqlite のとき使う）
+# ======================
+class ShelfBook(db.Model):
+    __tablename__ = "shelf_books"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # "user:<id>"（ログイン中）または "anon:<セッションごとの id>"
+    owner = db.Column(db.String(64), nullable=False)
+    # ISBN-13（無ければ正規化したタイトル）。app/bookshelf/providers.py の book_key
+    book_key = db.Column(db.String(200), nullable=False)
+    data = db.Column(db.Text, nullable=False)  # 本の JSON
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # ISBN での存在確認・削除
+        db.UniqueConstraint("owner", "book_key", name="uq_shelf_books_owner_key"),
+        # 本棚ごとの追加順の一覧（owner 順の索引は id 順に並ぶ）
+        db.Index("ix_shelf_books_owner", "owner"),
+    )
+
+    def __repr__(self):
+        return f"<ShelfBook {self.owner} {self.book_key}>"
@@ -0,0 +1,226 @@
+# app/bookshelf/providers.py
+# 書籍検索（楽天ブックス / OpenLibrary）と近くの図書館（カーリル）の呼び出し
+#
+# fan_out() は各プロバイダを並列に呼び、全体の締め切り（deadline 秒）までに
+# 返ってきた順に (名前, 結果) を返す。締め切りに間に合わなかったプロバイダは捨てる。
+# 各呼び出しには実行を始めた時点の残り時間を http_client の締め切りとして渡すので、
+# 捨てた呼び出しも検索の締め切りを過ぎてスレッドを使い続けることはない
+# （プールで待っている間に締め切りを過ぎた呼び出しは実行しない）。
+# 検索結果は merge_books() で ISBN ごとにまとめる。
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+
+from .http_client import UpstreamError, client
+
+logger = logging.getLogger(__name__)
+
+RAKUTEN_APP_ID = "1077795699367532233"
+CALIL_APP_KEY = "a4803b22ab1cf9bd6eda17b6518ea542"
+
+# 1 回の検索で最大 3 件（楽天 / OpenLibrary / カーリル）を同時に呼ぶ（4 検索分）。
+# どの呼び出しも検索の締め切りまでに終わるので、同時検索が多くても
+# 待ちは締め切り 1 回分を超えない
+_executor = ThreadPoolExecutor(max_workers=12, thread_name_prefix="bookshelf")
+
+
+# -----------------------------
+# 各プロバイダ
+# -----------------------------
+def genre_tags(genre_ids):
+    """楽天ブックスのジャンル ID（"001004008" のように 3 桁ずつ階層、"/" 区切り）をタグにする
+
+    上位の階層もタグにする（"genre:001004 genre:001004008"）。
+    """
+    tags = []
+    for genre in str(genre_ids or "").split("/"):
+        genre = genre.strip()
+        for end in range(6, len(genre) + 1, 3):
+            tag = "genre:" + genre[:end]
+            if tag not in tags:
+                tags.append(tag)
+    return " ".join(tags)
+
+
+def search_rakuten(title, timeout=None):
+    url = "https://app.rakuten.co.jp/services/api/BooksBook/Search/20170404"
+    params = {
+        "applicationId": RAKUTEN_APP_ID,
+        "title": title,
+        "format": "json",
+        "hits": 20,
+    }
+    data = client("rakuten").get_json(url, params=params, timeout=timeout)
+    books = []
+    for item in data.get("Items", []):
+        book_item = item["Item"]
+        books.append(
+            {
+                "title": book_item.get("title", ""),
+                "author": book_item.get("author", ""),
+                "isbn": book_item.get("isbn", ""),
+                "price": book_item.get("itemPrice", 0),
+                "image": book_item.get("largeImageUrl", ""),
+                "itemUrl": book_item.get("itemUrl", ""),
+                "tags": genre_tags(book_item.get("booksGenreId")),
+                "libraries": [],
+            }
+        )
+    return books
+
+
+def search_openlibrary(title, timeout=None):
+    url = "https://openlibrary.org/search.json"
+    data = client("openlibrary").get_json(url, params={"title": title}, timeout=timeout)
+    books = []
+    for doc in data.get("docs", []):
+        isbn = doc.get("isbn", [None])[0]
+        books.append(
+            {
+                "title": doc.get("title", ""),
+                "author": ", ".join(doc.get("author_name", [])),
+                "isbn": isbn,
+                "year": doc.get("first_publish_year", ""),
+                "cover": f"https://covers.openlibrary.org/b/id/{doc.get('cover_i',0)}-L.jpg"
+                if doc.get("cover_i")
+                else "",
+                "url": f"https://openlibrary.org{doc.get('key')}",
+                "tags": " ".join(doc.get("subject", [])) if doc.get("subject") else "",
+                "libraries": [],
+            }
+        )
+    return books
+
+
+def find_nearby_libraries(lat, lon, timeout=None):
+    url = "https://api.calil.jp/library"
+    params = {
+        "appkey": CALIL_APP_KEY,
+        "geocode": f"{lon},{lat}",
+        "format": "json",
+        "callback": "",
+    }
+    libraries = client("calil").get_json(url, params=params, timeout=timeout)
+    if not isinstance(libraries, list):
+        return []
+    return libraries[:5]
+
+
+def list_libraries(pref, timeout=None):
+    """都道府県内の図書館をすべて返す（図書館カタログの更新用）"""
+    url = "https://api.calil.jp/library"
+    params = {"appkey": CALIL_APP_KEY, "pref": pref, "format": "json", "callback": ""}
+    libraries = client("calil").get_json(url, params=params, timeout=timeout)
+    return libraries if isinstance(libraries, list) else []
+
+
+# 並列検索の対象（この順で結果を優先してまとめる）
+BOOK_PROVIDERS = {
+    "rakuten": search_rakuten,
+    "openlibrary": search_openlibrary,
+}
+
+
+# -----------------------------
+# 並列呼び出し
+# -----------------------------
+def _call_until(fn, args, deadline_at):
+    """締め切り（time.monotonic() の値）までの残り時間を timeout にして呼ぶ"""
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise UpstreamError(f"{fn.__name__}: deadline passed before start")
+    return fn(*args, timeout=remaining)
+
+
+def fan_out(calls, deadline, missing=None):
+    """calls: {名前: (関数, 引数...)} を並列に呼び、終わった順に (名前, 結果) を返す
+
+    失敗したものは結果を None にする。deadline 秒を過ぎたら残りは待たずに打ち切り、
+    その名前を missing（リスト）に追加する。
+    """
+    deadline_at = time.monotonic() + deadline
+    futures = {
+        _executor.submit(_call_until, fn, args, deadline_at): name
+        for name, (fn, *args) in calls.items()
+    }
+    pending = dict(futures)
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            name = pending.pop(future)
+            try:
+                result = future.result()
+            except UpstreamError as e:
+                logger.warning("%s failed: %s", name, e)
+                result = None
+            except Exception:
+                logger.exception("%s failed", name)
+                result = None
+            yield name, result
+    except TimeoutError:
+        pass
+    finally:
+        for future, name in pending.items():
+            future.cancel()
+            logger.warning("%s missed the %.1fs deadline", name, deadline)
+            if missing is not None:
+                missing.append(name)
+
+
+# -----------------------------
+# ISBN ごとにまとめる
+# -----------------------------
+def normalize_isbn(isbn):
+    """ハイフン等を除き、ISBN-10 は ISBN-13 にそろえる。ISBN でなければ None"""
+    digits = re.sub(r"[^0-9Xx]", "", str(isbn or "")).upper()
+    if len(digits) == 13 and digits.isdigit():
+        return digits
+    if len(digits) == 10 and digits[:9].isdigit():
+        body = "978" + digits[:9]
+        check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body)) % 10) % 10
+        return body + str(check)
+    return None
+
+
+def book_key(book):
+    isbn = normalize_isbn(book.get("isbn"))
+    if isbn:
+        return isbn
+    return "title:" + " ".join(str(book.get("title", "")).lower().split())
+
+
+class BookMerger:
+    """プロバイダの結果を順に受け取り、ISBN が同じ本は 1 冊にまとめる
+
+    先に受け取った値を優先し、空の項目だけ後の結果で埋める。
+    """
+
+    def __init__(self):
+        self._books = {}
+
+    def add(self, books):
+        """まとめて、新しく増えた本だけを返す"""
+        added = []
+        for book in books or []:
+            key = book_key(book)
+            existing = self._books.get(key)
+            if existing is None:
+                self._books[key] = dict(book)
+                added.append(self._books[key])
+                continue
+            for field, value in book.items():
+                if value and not existing.get(field):
+                    existing[field] = value
+        return added
+
+    def books(self):
+        return list(self._books.values())
+
+
+def merge_books(results):
+    """[(名前, 本のリスト)] をプロバイダの優先順にまとめる"""
+    order = list(BOOK_PROVIDERS)
+    merger = BookMerger()
+    for _, books in sorted(results, key=lambda r: order.index(r[0])):
+        merger.add(books)
+    return merger.books()
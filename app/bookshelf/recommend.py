@@ -0,0 +1,208 @@
+# app/bookshelf/recommend.py
+# おすすめの本（/bookshelf/recommend）
+#
+# 対象はおすすめの棚・全ユーザーの「私の本棚」・検索キャッシュに入っている本。
+# - タグ（と著者）の TF-IDF で本を表し、語 -> [(本, 重み)] の転置索引を作る。
+#   各語の一覧は重みの大きい順に POSTING_LIMIT 件、クエリは QUERY_TERMS 語までに絞る
+#   （よくあるタグや長い履歴でも 1 回の計算量が一定）
+#   タグは楽天のジャンル ID（genre_tags()）と OpenLibrary の subject。おすすめの棚の
+#   本にはタグがないため、それらは著者と共起だけで近さが決まる
+# - 同じ本棚に入っている本どうしを共起として数え、閲覧履歴の本と一緒に置かれやすい本を加点する
+#   （本ごとに回数の多い COOCCUR_LIMIT 冊だけ残す）
+# - 得点を足し合わせ、heapq で上位 k 件だけ取り出す
+# 索引は最初のリクエストを受けたときにバックグラウンドで作り（できるまでは空の結果を返す）、
+# その後は BOOKSHELF_RECOMMEND_REBUILD 秒ごとに作り直して差し替える。
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+from .catalogue import curated_catalogue
+from .providers import book_key
+from .search_cache import normalize_title, search_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = 10
+POSTING_LIMIT = 200
+# クエリに使う特徴語の上限（重みの大きい順）
+QUERY_TERMS = 8
+# 1 つの本棚から数える共起の上限（大きな本棚で組の数が爆発しないように）
+COOCCUR_SHELF_LIMIT = 200
+# 本ごとに残す共起相手の上限（回数の多い順）
+COOCCUR_LIMIT = 50
+COOCCUR_WEIGHT = 0.3
+
+
+def book_terms(book):
+    """本の特徴語: タグと著者"""
+    terms = [normalize_title(tag) for tag in str(book.get("tags") or "").split()]
+    for author in str(book.get("author") or "").replace("、", ",").split(","):
+        author = normalize_title(author)
+        if author:
+            terms.append("author:" + author)
+    return [t for t in terms if t]
+
+
+class RecommendIndex:
+    def __init__(self, books, shelves=()):
+        """books: 本の一覧 / shelves: 本棚ごとの本の一覧（共起用）"""
+        self.books = []
+        self.ids = {}  # 本のキー -> 番号
+        for book in books:
+            key = book_key(book)
+            if key not in self.ids:
+                self.ids[key] = len(self.books)
+                self.books.append(book)
+        self.built_at = time.monotonic()
+
+        # TF-IDF（本ごとに長さ 1 にそろえる）
+        doc_terms = [Counter(book_terms(book)) for book in self.books]
+        df = Counter(term for terms in doc_terms for term in terms)
+        n = len(self.books) or 1
+        self.idf = {term: math.log((1 + n) / (1 + count)) + 1 for term, count in df.items()}
+        postings = defaultdict(list)
+        for doc, terms in enumerate(doc_terms):
+            weights = {t: (1 + math.log(tf)) * self.idf[t] for t, tf in terms.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, w in weights.items():
+                postings[term].append((w / norm, doc))
+        self.postings = {
+            term: heapq.nlargest(POSTING_LIMIT, docs) for term, docs in postings.items()
+        }
+
+        # 共起（同じ本棚にある本の組）
+        cooccur = defaultdict(Counter)
+        for shelf in shelves:
+            docs = {self.ids.get(book_key(b)) for b in shelf[:COOCCUR_SHELF_LIMIT]}
+            docs.discard(None)
+            for a in docs:
+                for b in docs:
+                    if a != b:
+                        cooccur[a][b] += 1
+        self.cooccur = {
+            doc: dict(counts.most_common(COOCCUR_LIMIT))
+            for doc, counts in cooccur.items()
+        }
+
+    def recommend(self, history, k=DEFAULT_K):
+        """閲覧履歴の本に近い本を最大 k 件（履歴にある本は除く）"""
+        seen_keys = {book_key(b) for b in history}
+        seen_titles = {b.get("title") for b in history}
+
+        # 履歴の特徴語をまとめたクエリ（長さ 1 にそろえ、重い順に QUERY_TERMS 語だけ使う）
+        query = Counter()
+        for book in history:
+            for term in book_terms(book):
+                if term in self.postings:
+                    query[term] += self.idf[term]
+        norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+
+        scores = defaultdict(float)
+        for term, qw in query.most_common(QUERY_TERMS):
+            qw /= norm
+            for dw, doc in self.postings[term]:
+                scores[doc] += qw * dw
+        for key in seen_keys:
+            doc = self.ids.get(key)
+            counts = self.cooccur.get(doc)
+            if counts:
+                top = max(counts.values())
+                for other, count in counts.items():
+                    scores[other] += COOCCUR_WEIGHT * count / top
+
+        books = self.books
+        seen_docs = {self.ids[key] for key in seen_keys if key in self.ids}
+        candidates = (
+            (score, doc)
+            for doc, score in scores.items()
+            if doc not in seen_docs and books[doc].get("title") not in seen_titles
+        )
+        return [dict(books[doc]) for _, doc in heapq.nlargest(k, candidates)]
+
+
+def collect_books(shelf_store):
+    """索引の対象: (本の一覧, 本棚の一覧)"""
+    books, shelves = [], []
+    for shelf in curated_catalogue.shelves.values():
+        shelf = [dict(b) for b in shelf]
+        books.extend(shelf)
+        shelves.append(shelf)
+    for _, shelf in shelf_store.all_shelves():
+        books.extend(shelf)
+        shelves.append(shelf)
+    if search_cache.enabled:
+        for results in search_cache.values():
+            books.extend(results)
+    return books, shelves
+
+
+class Recommender:
+    def __init__(self):
+        self.app = None
+        self.rebuild_after = 300
+        self._index = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def build(self):
+        from .shelf_store import get_shelf_store
+
+        started = time.perf_counter()
+        books, shelves = collect_books(get_shelf_store())
+        index = RecommendIndex(books, shelves)
+        self._index = index
+        logger.info(
+            "recommend index: %d books, %d terms (%.2fs)",
+            len(index.books), len(index.postings), time.perf_counter() - started,
+        )
+        return index
+
+    def _build_in_background(self):
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception:
+            logger.exception("recommend index rebuild failed")
+        finally:
+            self._building = False
+
+    def start(self):
+        """索引がないか古ければバックグラウンドで作る（作り中なら何もしない）"""
+        index = self._index
+        if index is not None and time.monotonic() - index.built_at <= self.rebuild_after:
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(
+            target=self._build_in_background, name="recommend-index", daemon=True
+        ).start()
+
+    def index(self):
+        """現在の索引（まだなければ None）。古くなっていれば今の索引を返しつつ裏で作り直す"""
+        self.start()
+        return self._index
+
+    def recommend(self, history, k=DEFAULT_K):
+        index = self.index()
+        if index is None:
+            return []
+        return index.recommend(history, k)
+
+
+recommender = Recommender()
+
+
+def init_recommender(app):
+    recommender.app = app
+    recommender._index = None
+    recommender.rebuild_after = app.config.get("BOOKSHELF_RECOMMEND_REBUILD", 300)
+
+    # リクエストを受けたプロセスでだけ作る（CLI コマンドでは作らない）
+    @app.before_request
+    def start_recommend_index():
+        recommender.start()
@@ -1,9 +1,31 @@
-from flask import Blueprint, render_template, request, jsonify
-import requests
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    render_template,
+    request,
+    jsonify,
+    session,
+    abort,
+    stream_with_context,
+)
+from flask_login import current_user
 import json
-import os
+import logging
+import secrets
 from urllib.parse import unquote
 
+from .http_client import UpstreamError, metrics
+from .providers import BOOK_PROVIDERS, BookMerger, fan_out, merge_books
+from .catalogue import curated_catalogue
+from .covers import COVER_MAX_AGE, CoverError, cover_cache, proxy_covers
+from .libraries import library_catalogue
+from .recommend import recommender
+from .search_cache import search_cache
+from .shelf_store import find_key, get_shelf_store
+
+logger = logging.getLogger(__name__)
+
 bookshelf_bp = Blueprint(
     "bookshelf",
     __name__,
@@ -11,146 +33,107 @@ bookshelf_bp = Blueprint(
     # template_folder は不要。Flask の templates ディレクトリを使う
 )
 
-RAKUTEN_APP_ID = "1077795699367532233"
-CALIL_APP_KEY = "a4803b22ab1cf9bd6eda17b6518ea542"
-DATA_FILE = "data/shelves.json"
-
-SHELVES = [
-    "貯蓄優先型",
-    "積立安定型",
-    "アクティブチャレンジ型",
-    "ステーキング運用型",
-    "株式アクティブ型",
-    "ハイリスクハイリターン型",
-    "テクノロジー志向型",
-    "積立応用型",
-    "私の本棚",
-]
-
-# -----------------------------
-# JSON読み書き
-# -----------------------------
-def load_shelves():
-    os.makedirs("data", exist_ok=True)
-    if not os.path.exists(DATA_FILE):
-        data = {shelf: [] for shelf in SHELVES}
-        save_shelves(data)
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def save_shelves(shelves):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(shelves, f, ensure_ascii=False, indent=2)
+# ユーザーごとの本棚（それ以外の棚は data/curated_shelves.json）
+MY_SHELF = "私の本棚"
 
 
 # -----------------------------
-# 書籍検索API (楽天 / OpenLibrary)
+# 書籍検索 API エンドポイント
 # -----------------------------
-def search_openlibrary(title):
-    url = "https://openlibrary.org/search.json"
-    response = requests.get(url, params={"title": title})
-    data = response.json()
-    books = []
-    for doc in data.get("docs", []):
-        isbn = doc.get("isbn", [None])[0]
-        books.append(
-            {
-                "title": doc.get("title", ""),
-                "author": ", ".join(doc.get("author_name", [])),
-                "isbn": isbn,
-                "year": doc.get("first_publish_year", ""),
-                "cover": f"https://covers.openlibrary.org/b/id/{doc.get('cover_i',0)}-L.jpg"
-                if doc.get("cover_i")
-                else "",
-                "url": f"https://openlibrary.org{doc.get('key')}",
-                "tags": " ".join(doc.get("subject", [])) if doc.get("subject") else "",
-                "libraries": [],
-            }
-        )
-    return books
+def _parse_location():
+    """クエリの lat / lon を (緯度, 経度) にする。無い・不正なら None"""
+    try:
+        return float(request.args["lat"]), float(request.args["lon"])
+    except (KeyError, ValueError):
+        return None
 
 
-def find_nearby_libraries(lat, lon):
-    url = "https://api.calil.jp/library"
-    params = {
-        "appkey": CALIL_APP_KEY,
-        "geocode": f"{lon},{lat}",
-        "format": "json",
-        "callback": "",
+def _search_calls(title, location, providers):
+    """並列に呼ぶ関数と、手元のカタログで分かった近くの図書館を返す"""
+    calls = {
+        name: (search_cache.wrap(name, BOOK_PROVIDERS[name]), title) for name in providers
     }
-    response = requests.get(url, params=params)
-    try:
-        libraries = response.json()
-    except json.JSONDecodeError:
-        libraries = []
-    return libraries[:5]
+    libraries = []
+    if location:
+        libraries = library_catalogue.nearest(*location)
+        if libraries is None:
+            # カタログが近くをカバーしていない: カーリルに問い合わせる
+            calls["calil"] = (library_catalogue.fetch_nearby, *location)
+            libraries = []
+    return calls, libraries
 
 
-# -----------------------------
-# 書籍検索 API エンドポイント
-# -----------------------------
 @bookshelf_bp.route("/search")
 def search_books():
+    """書籍検索。楽天・OpenLibrary・カーリル（位置があれば）を並列に呼び、ISBN でまとめる
+
+    全体で BOOKSHELF_SEARCH_DEADLINE 秒を過ぎたら、間に合った結果だけ返す。
+    """
     title = request.args.get("title", "")
-    lat = request.args.get("lat")
-    lon = request.args.get("lon")
     if not title:
         return jsonify([])
+    deadline = current_app.config["BOOKSHELF_SEARCH_DEADLINE"]
 
-    books = []
+    calls, libraries = _search_calls(title, _parse_location(), BOOK_PROVIDERS)
+    results = []
+    for name, result in fan_out(calls, deadline):
+        if name == "calil":
+            libraries = result or []
+        elif result:
+            results.append((name, result))
+    books = merge_books(results)
 
-    # 楽天API
-    url = "https://app.rakuten.co.jp/services/api/BooksBook/Search/20170404"
-    params = {
-        "applicationId": RAKUTEN_APP_ID,
-        "title": title,
-        "format": "json",
-        "hits": 20,
-    }
-    resp = requests.get(url, params=params)
-    data = resp.json()
-    for item in data.get("Items", []):
-        book_item = item["Item"]
-        books.append(
-            {
-                "title": book_item.get("title", ""),
-                "author": book_item.get("author", ""),
-                "isbn": book_item.get("isbn", ""),
-                "price": book_item.get("itemPrice", 0),
-                "image": book_item.get("largeImageUrl", ""),
-                "itemUrl": book_item.get("itemUrl", ""),
-                "tags": "",
-                "libraries": [],
-            }
-        )
+    # 近場図書館情報（全冊で同じ一覧）
+    for book in books:
+        book["libraries"] = libraries
+
+    return jsonify(proxy_covers(books))
+
+
+@bookshelf_bp.route("/search/stream")
+def search_books_stream():
+    """書籍検索（NDJSON）。各プロバイダの結果を返ってきた順に 1 行ずつ送る
+
+    {"provider": "rakuten", "books": [...]}   まだ返していない本だけ
+    {"provider": "catalogue" または "calil", "libraries": [...]}
+    {"done": true, "missing": [締め切りに間に合わなかったプロバイダ]}
+    """
+    title = request.args.get("title", "")
+    calls, libraries = (
+        _search_calls(title, _parse_location(), BOOK_PROVIDERS) if title else ({}, [])
+    )
+    deadline = current_app.config["BOOKSHELF_SEARCH_DEADLINE"]
+
+    def generate():
+        if libraries:
+            line = {"provider": "catalogue", "libraries": libraries}
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        merger = BookMerger()
+        missing = []
+        for name, result in fan_out(calls, deadline, missing):
+            if name == "calil":
+                line = {"provider": name, "libraries": result or []}
+            else:
+                line = {"provider": name, "books": proxy_covers(merger.add(result))}
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "missing": missing}) + "\n"
 
-    # OpenLibrary fallback
-    if not books:
-        books = search_openlibrary(title)
-
-    # 近場図書館情報
-    if lat and lon:
-        libs = find_nearby_libraries(float(lat), float(lon))
-        for book in books:
-            book["libraries"] = []
-            for lib in libs:
-                try:
-                    lib_lat, lib_lon = map(
-                        float, lib.get("geocode", "0,0").split(",")[::-1]
-                    )
-                except:
-                    lib_lat, lib_lon = None, None
-                book["libraries"].append(
-                    {
-                        "name": lib.get("formal"),
-                        "lat": lib_lat,
-                        "lon": lib_lon,
-                        "url": f"https://calil.jp/library/{lib.get('systemid')}",
-                    }
-                )
-
-    return jsonify(books)
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# -----------------------------
+# 外部 API の呼び出し状況（件数・エラー数・所要時間・遮断状態）と検索キャッシュ
+# -----------------------------
+@bookshelf_bp.route("/metrics")
+def upstream_metrics():
+    return jsonify(
+        {
+            **metrics(),
+            "search_cache": search_cache.stats(),
+            "library_catalogue": library_catalogue.stats(),
+            "covers": cover_cache.stats(),
+        }
+    )
 
 
 # -----------------------------
@@ -158,40 +141,46 @@ def search_books():
 # -----------------------------
 @bookshelf_bp.route("/")
 def index():
-    return render_template("bookshelf/index.html", shelves=SHELVES)
+    shelves = curated_catalogue.names() + [MY_SHELF]
+    return render_template("bookshelf/index.html", shelves=shelves)
 
 
 # -----------------------------
 # 「私の本棚」操作 API
 # -----------------------------
+def _shelf_owner():
+    """本棚の持ち主。ログインしていなければセッションごとの本棚にする"""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    if "shelf_owner" not in session:
+        session["shelf_owner"] = secrets.token_hex(8)
+    return f"anon:{session['shelf_owner']}"
+
+
 @bookshelf_bp.route("/add_to_my_shelf", methods=["POST"])
 def add_to_my_shelf():
     book = request.get_json().get("book")
     if not book:
         return jsonify({"error": "bookが指定されていません"}), 400
-    shelves = load_shelves()
-    my = shelves.setdefault("私の本棚", [])
-    if not any(b["title"] == book["title"] for b in my):
-        my.append(book)
-        save_shelves(shelves)
+    my = get_shelf_store().add(_shelf_owner(), book)
     return jsonify({"my_shelf": my})
 
 
 @bookshelf_bp.route("/remove_from_my_shelf", methods=["POST"])
 def remove_from_my_shelf():
-    title = request.get_json().get("title")
-    if not title:
+    data = request.get_json()
+    isbn, title = data.get("isbn"), data.get("title")
+    if not isbn and not title:
         return jsonify({"error": "titleが指定されていません"}), 400
-    shelves = load_shelves()
-    shelves["私の本棚"] = [b for b in shelves.get("私の本棚", []) if b["title"] != title]
-    save_shelves(shelves)
-    return jsonify({"my_shelf": shelves["私の本棚"]})
+    store = get_shelf_store()
+    owner = _shelf_owner()
+    my = store.remove(owner, find_key(store, owner, isbn=isbn, title=title))
+    return jsonify({"my_shelf": my})
 
 
 @bookshelf_bp.route("/get_my_shelf")
 def get_my_shelf():
-    shelves = load_shelves()
-    return jsonify({"my_shelf": shelves.get("私の本棚", [])})
+    return jsonify({"my_shelf": get_shelf_store().get(_shelf_owner())})
 
 
 # -----------------------------
@@ -200,46 +189,30 @@ def get_my_shelf():
 @bookshelf_bp.route("/shelf/<path:name>")
 def shelf_page(name):
     name = unquote(name)
-    shelves = load_shelves()  # JSON から読み込み
-    # 手書きで追加
-    shelves["貯蓄優先型"] = [
-        {
-            "author": "ベンジャミン・グレアム",
-            "description": "『賢明なる投資家』の理解度が一気に進む解説付き！",
-            "image": "https://thumbnail.image.rakuten.co.jp/@0_mall/book/cabinet/3400/9784775973400_1_2.jpg?_ex=200x200",
-            "itemUrl": "https://books.rakuten.co.jp/rb/18327208/?rafcid=wsc_b_bs_1077795699367532233",
-            "price": 4180,
-            "title": "新　賢明なる投資家（下）第3版",
-        },
-        {
-            "author": "両＠リベ大学長",
-            "description": "142万部突破の『お金の大学』が超・パワーアップ！「新NISA」などの金融制度にも完全対応。さらに「証券口座やクレカ、銀行などの選び方」「超危険な金融商品リスト」など、新規内容も50ページ以上追加。実践しやすいお金の教養がてんこ盛りの一冊！",
-            "image": "https://thumbnail.image.rakuten.co.jp/@0_mall/book/cabinet/3780/9784023323780_1_3.jpg?_ex=200x200",
-            "itemUrl": "https://books.rakuten.co.jp/rb/18041936/?rafcid=wsc_b_bs_1077795699367532233",
-            "price": 1650,
-            "title": "改訂版　本当の自由を手に入れる　お金の大学",
-        },
-    ]
-    shelves["積立安定型"] = [
-        {
-            "author": "両＠リベ大学長",
-            "description": "142万部突破の『お金の大学』が超・パワーアップ！「新NISA」などの金融制度にも完全対応。さらに「証券口座やクレカ、銀行などの選び方」「超危険な金融商品リスト」など、新規内容も50ページ以上追加。実践しやすいお金の教養がてんこ盛りの一冊！",
-            "image": "https://thumbnail.image.rakuten.co.jp/@0_mall/book/cabinet/3780/9784023323780_1_3.jpg?_ex=200x200",
-            "itemUrl": "https://books.rakuten.co.jp/rb/18041936/?rafcid=wsc_b_bs_1077795699367532233",
-            "price": 1650,
-            "title": "改訂版　本当の自由を手に入れる　お金の大学",
-        },
-    ]
-
-    my_books = shelves.get("私の本棚", [])
-    shelf_books = shelves.get(name, [])
-
-    return render_template(
-        "bookshelf/shelf.html",
-        shelf_name=name,
-        shelves=shelves,
-        my_shelf=my_books,
-    )
+    if name == MY_SHELF:
+        # ユーザーごとの内容なのでキャッシュしない
+        my_books = proxy_covers(get_shelf_store().get(_shelf_owner()))
+        return render_template(
+            "bookshelf/shelf.html",
+            shelf_name=name,
+            shelves={name: my_books},
+            my_shelf=my_books,
+        )
+
+    def render(books):
+        return render_template(
+            "bookshelf/shelf.html", shelf_name=name, shelves={name: proxy_covers(books)}
+        )
+
+    if name not in curated_catalogue.names():
+        return render([])
+
+    html, etag = curated_catalogue.page(name, render)
+    response = Response(html, mimetype="text/html")
+    response.set_etag(etag)
+    # カタログの更新がすぐ反映されるよう、毎回 ETag で確認させる
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # -----------------------------
@@ -247,17 +220,31 @@ def shelf_page(name):
 # -----------------------------
 @bookshelf_bp.route("/recommend")
 def recommend_books():
-    history_json = request.args.get("history", "[]")
-    history = json.loads(history_json)
-    recommended = []
-    all_books = []  # 実際の全書籍データをここでロードするとよい
-    for h in history:
-        for b in all_books:
-            if b["title"] not in [x["title"] for x in history + recommended]:
-                if (
-                    h.get("tags")
-                    and b.get("tags")
-                    and any(tag in h["tags"].split() for tag in b["tags"].split())
-                ):
-                    recommended.append(b)
-    return jsonify(recommended[:10])
+    """閲覧履歴（history: 本の JSON 配列）に近い本を最大 10 件"""
+    try:
+        history = json.loads(request.args.get("history", "[]"))
+    except ValueError:
+        return jsonify({"error": "historyが不正です"}), 400
+    if not isinstance(history, list):
+        return jsonify({"error": "historyが不正です"}), 400
+    history = [h for h in history if isinstance(h, dict)]
+    return jsonify(proxy_covers(recommender.recommend(history, k=10)))
+
+
+# -----------------------------
+# 表紙画像（外部の画像を 1 回だけ取得してディスクから返す）
+# -----------------------------
+@bookshelf_bp.route("/cover/<key>")
+def cover(key):
+    try:
+        data, mimetype, etag = cover_cache.get(key, request.args.get("w", type=int))
+    except CoverError:
+        abort(404)
+    except UpstreamError:
+        abort(502)
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = COVER_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
@@ -0,0 +1,238 @@
+# app/bookshelf/search_cache.py
+# 書籍検索結果のキャッシュ（instance/search_cache.db を全ワーカーで共有し、再起動後も残す）
+#
+# キーは "プロバイダ名:正規化したタイトル"。正規化は NFKC（全角英数・半角カナをそろえる）、
+# 大文字小文字の同一視、カタカナ→ひらがな、空白の圧縮。
+# 保存してからの経過時間で扱いを変える:
+# - ttl 以内: そのまま返す
+# - ttl + stale_ttl 以内: 古い結果をすぐ返し、裏で取り直す（stale-while-revalidate）
+# - それより古い・無い: 外部 API を呼ぶ。失敗したら max_stale 以内の古い結果を返す
+# 合計サイズが max_bytes を超えたら最後に使われた時刻が古いものから消す（LRU）。
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from .http_client import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60 * 60
+DEFAULT_STALE_TTL = 24 * 60 * 60
+DEFAULT_MAX_STALE = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 使われた時刻の更新は、前回からこの秒数以上たっているときだけ書き込む
+_TOUCH_INTERVAL = 60
+_EVICT_EVERY = 100
+
+# カタカナ（ァ〜ヶ）をひらがなに
+_KANA_FOLD = {c: c - 0x60 for c in range(0x30A1, 0x30F7)}
+
+
+def normalize_title(title):
+    """表記ゆれ（全角 / 半角、大文字 / 小文字、カタカナ / ひらがな、空白）をそろえる"""
+    text = unicodedata.normalize("NFKC", title or "").casefold()
+    return " ".join(text.translate(_KANA_FOLD).split())
+
+
+class SearchCache:
+    def __init__(self):
+        self.path = None
+        self.ttl = DEFAULT_TTL
+        self.stale_ttl = DEFAULT_STALE_TTL
+        self.max_stale = DEFAULT_MAX_STALE
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self._local = threading.local()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-cache")
+        self._puts = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.stale_on_error = 0
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def open(self, path):
+        self.path = path
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "stored REAL NOT NULL, accessed REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_search_cache_accessed ON search_cache (accessed)"
+        )
+
+    # ----------------------
+    # 読み書き
+    # ----------------------
+    def get(self, key, now=None):
+        """(値, 保存してからの秒数) を返す。無ければ None"""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, stored, accessed FROM search_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, stored, accessed = row
+        if now - accessed >= _TOUCH_INTERVAL:
+            conn.execute("UPDATE search_cache SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value), now - stored
+
+    def put(self, key, value, now=None):
+        now = time.time() if now is None else now
+        data = json.dumps(value, ensure_ascii=False)
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO search_cache (key, value, size, stored, accessed) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "value = excluded.value, size = excluded.size, "
+            "stored = excluded.stored, accessed = excluded.accessed",
+            (key, data, len(data.encode("utf-8")), now, now),
+        )
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % _EVICT_EVERY == 1
+        if evict:
+            self.evict(now)
+
+    def evict(self, now=None):
+        """期限切れを消し、max_bytes を超えていれば古く使われたものから消す"""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM search_cache WHERE stored < ?",
+            (now - max(self.ttl + self.stale_ttl, self.max_stale),),
+        )
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM search_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 上限の 9 割まで減らす
+        excess = total - self.max_bytes * 0.9
+        removed = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM search_cache ORDER BY accessed"
+        ).fetchall():
+            if removed >= excess:
+                break
+            conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+            removed += size
+
+    def values(self):
+        """キャッシュされている検索結果をすべて返す（おすすめの索引用）"""
+        for (value,) in self._connect().execute("SELECT value FROM search_cache"):
+            yield json.loads(value)
+
+    def clear(self):
+        self._connect().execute("DELETE FROM search_cache")
+
+    # ----------------------
+    # 検索関数のラップ
+    # ----------------------
+    def _refresh(self, key, fn, title):
+        try:
+            self.put(key, fn(title))
+        except UpstreamError as e:
+            logger.info("search cache refresh failed for %s: %s", key, e)
+        except Exception:
+            logger.exception("search cache refresh failed for %s", key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _revalidate(self, key, fn, title):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, fn, title)
+
+    def fetch(self, name, fn, title, timeout=None):
+        """キャッシュを通して fn(title, timeout=...) を呼ぶ"""
+        if not self.enabled:
+            return fn(title, timeout=timeout)
+        key = f"{name}:{normalize_title(title)}"
+        try:
+            cached = self.get(key)
+        except sqlite3.Error as e:
+            logger.warning("search cache read failed: %s", e)
+            cached = None
+
+        if cached is not None:
+            value, age = cached
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._revalidate(key, fn, title)
+                return value
+
+        self.misses += 1
+        try:
+            value = fn(title, timeout=timeout)
+        except UpstreamError:
+            if cached is not None and cached[1] < self.max_stale:
+                self.stale_on_error += 1
+                logger.info("serving stale search results for %s", key)
+                return cached[0]
+            raise
+        try:
+            self.put(key, value)
+        except sqlite3.Error as e:
+            logger.warning("search cache write failed: %s", e)
+        return value
+
+    def wrap(self, name, fn):
+        def cached(title, timeout=None):
+            return self.fetch(name, fn, title, timeout=timeout)
+
+        return cached
+
+    def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "stale_on_error": self.stale_on_error,
+        }
+        if self.enabled:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM search_cache"
+            ).fetchone()
+            stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+
+search_cache = SearchCache()
+
+
+def init_search_cache(app):
+    search_cache.ttl = app.config.get("BOOKSHELF_CACHE_TTL", DEFAULT_TTL)
+    search_cache.stale_ttl = app.config.get("BOOKSHELF_CACHE_STALE_TTL", DEFAULT_STALE_TTL)
+    search_cache.max_stale = app.config.get("BOOKSHELF_CACHE_MAX_STALE", DEFAULT_MAX_STALE)
+    search_cache.max_bytes = app.config.get("BOOKSHELF_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+    if app.config.get("BOOKSHELF_CACHE_ENABLED", True):
+        os.makedirs(app.instance_path, exist_ok=True)
+        search_cache.open(os.path.join(app.instance_path, "search_cache.db"))
@@ -0,0 +1,194 @@
+# app/bookshelf/shelf_store.py
+# 「私の本棚」の保存先（ユーザーごと）
+#
+# 本はキー（ISBN-13。無ければ正規化したタイトル）で管理し、追加・削除・存在確認は O(1)。
+# - "json": 本棚ごとに 1 ファイル（instance/shelves/<owner>.json）。
+#   書き込みは filelock で排他し、一時ファイル + os.replace で置き換える（途中で落ちても壊れない）。
+#   読み込んだ内容はメモリに持ち、ファイルの更新時刻が変わったときだけ読み直す。
+# - "sqlite": アプリの DB の shelf_books テーブル
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from filelock import FileLock
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from .models import ShelfBook
+from .providers import book_key
+
+LOCK_TIMEOUT = 10
+
+
+class JSONShelfStore:
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._cache = {}  # owner -> (mtime, OrderedDict[key, book])
+        self._lock = threading.Lock()
+
+    def _path(self, owner):
+        # owner はファイル名に使える文字だけにする（それ以外はハッシュにする）
+        if re.fullmatch(r"[A-Za-z0-9_.:-]{1,64}", owner):
+            name = owner.replace(":", "_")
+        else:
+            name = hashlib.sha256(owner.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.folder, name + ".json")
+
+    def _load(self, owner):
+        """メモリ上の本棚（ファイルが更新されていれば読み直す）"""
+        path = self._path(owner)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return OrderedDict()
+        with self._lock:
+            cached = self._cache.get(owner)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        with open(path, encoding="utf-8") as f:
+            books = OrderedDict((book_key(b), b) for b in json.load(f))
+        with self._lock:
+            self._cache[owner] = (mtime, books)
+        return books
+
+    def _save(self, owner, books):
+        path = self._path(owner)
+        tmp = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(books.values()), f, ensure_ascii=False)
+        os.replace(tmp, path)
+        with self._lock:
+            self._cache[owner] = (os.stat(path).st_mtime_ns, books)
+
+    def _update(self, owner, change):
+        """ロックを取って最新の内容に change(books) を適用し、変わったら保存する"""
+        with FileLock(self._path(owner) + ".lock", timeout=LOCK_TIMEOUT):
+            books = OrderedDict(self._load(owner))
+            if change(books):
+                self._save(owner, books)
+            return list(books.values())
+
+    def get(self, owner):
+        return list(self._load(owner).values())
+
+    def contains(self, owner, key):
+        return key in self._load(owner)
+
+    def add(self, owner, book):
+        key = book_key(book)
+
+        def change(books):
+            if key in books:
+                return False
+            books[key] = book
+            return True
+
+        return self._update(owner, change)
+
+    def remove(self, owner, key):
+        return self._update(owner, lambda books: books.pop(key, None) is not None)
+
+    def all_shelves(self):
+        """保存されているすべての本棚: (owner, 本の一覧)（移行・おすすめの索引用）"""
+        for name in sorted(os.listdir(self.folder)):
+            if name.endswith(".json"):
+                path = os.path.join(self.folder, name)
+                with open(path, encoding="utf-8") as f:
+                    yield name[: -len(".json")].replace("_", ":", 1), json.load(f)
+
+
+class SQLiteShelfStore:
+    def get(self, owner):
+        rows = db.session.execute(
+            db.select(ShelfBook.data).where(ShelfBook.owner == owner).order_by(ShelfBook.id)
+        ).scalars()
+        return [json.loads(data) for data in rows]
+
+    def contains(self, owner, key):
+        return db.session.execute(
+            db.select(ShelfBook.id).where(ShelfBook.owner == owner, ShelfBook.book_key == key)
+        ).first() is not None
+
+    def add(self, owner, book):
+        key = book_key(book)
+        if not self.contains(owner, key):
+            db.session.add(
+                ShelfBook(owner=owner, book_key=key, data=json.dumps(book, ensure_ascii=False))
+            )
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 同時に同じ本が追加された
+                db.session.rollback()
+        return self.get(owner)
+
+    def remove(self, owner, key):
+        db.session.execute(
+            db.delete(ShelfBook).where(ShelfBook.owner == owner, ShelfBook.book_key == key)
+        )
+        db.session.commit()
+        return self.get(owner)
+
+    def all_shelves(self):
+        rows = db.session.execute(
+            db.select(ShelfBook.owner, ShelfBook.data).order_by(ShelfBook.owner, ShelfBook.id)
+        )
+        owner, books = None, []
+        for row_owner, data in rows:
+            if row_owner != owner:
+                if books:
+                    yield owner, books
+                owner, books = row_owner, []
+            books.append(json.loads(data))
+        if books:
+            yield owner, books
+
+
+def find_key(store, owner, isbn=None, title=None):
+    """削除対象のキー。ISBN があれば O(1)、タイトルだけなら本棚から探す"""
+    if isbn:
+        return book_key({"isbn": isbn, "title": title})
+    key = book_key({"title": title})
+    if store.contains(owner, key):
+        return key
+    for book in store.get(owner):
+        if book.get("title") == title:
+            return book_key(book)
+    return key
+
+
+def get_shelf_store():
+    return current_app.extensions["shelf_store"]
+
+
+def init_shelf_store(app):
+    if app.config.get("BOOKSHELF_STORE") == "sqlite":
+        store = SQLiteShelfStore()
+    else:
+        store = JSONShelfStore(
+            app.config.get("BOOKSHELF_STORE_DIR") or os.path.join(app.instance_path, "shelves")
+        )
+    app.extensions["shelf_store"] = store
+    return store
+
+
+# ----------------------
+# 移行
+# ----------------------
+def import_books(store, owner, books):
+    """本をまとめて追加する（既にある本は飛ばす）。戻り値: 件数"""
+    for book in books:
+        store.add(owner, book)
+    return len(books)
+
+
+def migrate_legacy_file(store, path, owner, shelf="私の本棚"):
+    """従来の data/shelves.json（全員共通の「私の本棚」）を owner の本棚に移す"""
+    with open(path, encoding="utf-8") as f:
+        books = json.load(f).get(shelf, [])
+    return import_books(store, owner, books)
@@ -0,0 +1,129 @@
+# app/commands.py
+# flask コマンド（flask --app run.py <command>）
+import click
+
+from .posts.models import recount_post_counters
+from .auth.models import recount_follow_counters
+
+
+def register_commands(app):
+    @app.cli.command("recount")
+    def recount():
+        """いいね・コメント・転送・フォロー数のカウンタを再計算する"""
+        posts = recount_post_counters()
+        users = recount_follow_counters()
+        click.echo(f"recounted {posts} posts, {users} users")
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans_command():
+        """主要クエリがフルスキャンしていないか EXPLAIN QUERY PLAN で確認する"""
+        from .query_plans import check_query_plans
+
+        failed = []
+        for name, plan, scans in check_query_plans():
+            status = "NG" if scans else "ok"
+            click.echo(f"[{status}] {name}")
+            for detail in plan:
+                click.echo(f"       {detail}")
+            if scans:
+                failed.append(name)
+
+        if failed:
+            raise click.ClickException(f"full table scan in: {', '.join(failed)}")
+        click.echo("all queries use an index")
+
+    @app.cli.command("search-rebuild")
+    def search_rebuild():
+        """全文検索の索引を投稿・コメントから作り直す"""
+        from .search.index import rebuild_search_index
+
+        count = rebuild_search_index()
+        click.echo(f"indexed {count} posts/comments")
+
+    @app.cli.command("outbox-send")
+    def outbox_send():
+        """送信待ちのメールを今すぐ送る（バックグラウンドスレッドを待たない）"""
+        dispatcher = app.extensions["email_outbox"]
+        total = 0
+        while True:
+            count = dispatcher.dispatch()
+            total += count
+            if count < dispatcher.batch_size:
+                break
+        click.echo(
+            f"processed {total} emails "
+            f"(sent {dispatcher.sent}, retry {dispatcher.failed}, dead {dispatcher.dead})"
+        )
+
+    @app.cli.command("outbox-requeue-dead")
+    def outbox_requeue_dead():
+        """送信をあきらめた（dead の）メールを再送対象に戻す"""
+        from .auth.outbox import requeue_dead
+
+        click.echo(f"requeued {requeue_dead()} emails")
+
+    @app.cli.command("seed")
+    @click.option("--users", default=1000, show_default=True, help="追加するユーザー数")
+    @click.option("--follows-mean", default=20.0, show_default=True, help="1 人あたりの平均フォロー数")
+    @click.option("--follow-skew", default=1.1, show_default=True, help="フォロー先の偏り（Zipf の指数）")
+    @click.option("--posts-mean", default=10.0, show_default=True, help="1 人あたりの平均投稿数")
+    @click.option("--likes-mean", default=10.0, show_default=True, help="1 投稿あたりの平均いいね数")
+    @click.option("--comments-mean", default=2.0, show_default=True, help="1 投稿あたりの平均コメント数")
+    @click.option("--reposts-mean", default=0.5, show_default=True, help="1 投稿あたりの平均転送数")
+    @click.option("--pareto-alpha", default=1.5, show_default=True, help="投稿数・反応数のばらつき（小さいほど偏る）")
+    @click.option("--days", default=365, show_default=True, help="投稿日時を散らばらせる日数")
+    @click.option("--batch-size", default=10000, show_default=True, help="1 トランザクションの行数")
+    @click.option("--seed", "random_seed", default=0, show_default=True, help="乱数の種")
+    @click.option("--timeline/--no-timeline", default=True, help="フォロー中タイムラインを展開する")
+    @click.option("--search/--no-search", default=True, help="検索索引を作り直す")
+    def seed_command(random_seed, timeline, search, **options):
+        """負荷確認用のダミーデータ（ユーザー・フォロー・投稿・反応）を追加する"""
+        import time
+
+        from .auth.passwords import password_hasher
+        from .extensions import db
+        from .feed.timeline import rebuild_timelines
+        from .search.index import rebuild_search_index
+        from .seed import SEED_PASSWORD, SeedConfig, seed
+
+        started = time.perf_counter()
+        cfg = SeedConfig(seed=random_seed, **options)
+        first_post = seed(cfg, password_hasher.hash(SEED_PASSWORD), echo=click.echo)
+
+        recount_post_counters()
+        recount_follow_counters()
+        click.echo(f"counters ({time.perf_counter() - started:.1f}s)")
+        if timeline:
+            entries = rebuild_timelines(first_post)
+            click.echo(f"timeline: {entries} entries ({time.perf_counter() - started:.1f}s)")
+        if search:
+            rebuild_search_index()
+            click.echo(f"search index ({time.perf_counter() - started:.1f}s)")
+
+        for table in ("users", "followers", "posts", "likes", "comments", "reposts"):
+            count = db.session.execute(db.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            click.echo(f"{table}: {count}")
+        click.echo(f"password for seeded users: {SEED_PASSWORD}")
+
+    @app.cli.command("shelves-migrate")
+    @click.option("--user", "user_id", type=int, help="従来の共通「私の本棚」を移すユーザーの id")
+    @click.option("--legacy-file", default="data/shelves.json", show_default=True)
+    @click.option("--from-json", "json_dir", help="JSON の本棚フォルダ（instance/shelves）から移す")
+    def shelves_migrate(user_id, legacy_file, json_dir):
+        """「私の本棚」を BOOKSHELF_STORE の保存先に移す"""
+        from .bookshelf.shelf_store import (
+            JSONShelfStore,
+            get_shelf_store,
+            import_books,
+            migrate_legacy_file,
+        )
+
+        store = get_shelf_store()
+        if user_id is not None:
+            count = migrate_legacy_file(store, legacy_file, f"user:{user_id}")
+            click.echo(f"{legacy_file}: {count} books -> user:{user_id}")
+        if json_dir:
+            for owner, books in JSONShelfStore(json_dir).all_shelves():
+                click.echo(f"{owner}: {import_books(store, owner, books)} books")
+        if user_id is None and not json_dir:
+            raise click.UsageError("--user か --from-json を指定してください")
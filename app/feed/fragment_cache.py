@@ -0,0 +1,162 @@
+# app/feed/fragment_cache.py
+# 投稿カード・コメント一覧のレンダリング結果キャッシュ
+#
+# キーは (種類, post_id, post.version, ...)。post.version は like / comment / repost の
+# 書き込みと同じ UPDATE で +1 されるため、他のワーカーで更新された投稿も
+# 古いキーが使われなくなるだけで済む。同じプロセス内の書き込みでは invalidate() で
+# 古いエントリを即座に捨ててメモリを空ける。
+# 埋め込むユーザー名・アイコン（投稿者とコメント投稿者）もキーに含めるため、
+# プロフィールを変更すると全ワーカーで新しいキーに切り替わる。
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+
+class FragmentCache:
+    """バイト数上限付き LRU キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_post = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        size = len(html.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        post_id = key[1]
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = html
+            self._by_post.setdefault(post_id, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def invalidate(self, post_id):
+        """post_id に関するエントリを全バージョン分削除"""
+        with self._lock:
+            for key in list(self._by_post.get(post_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_post.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _discard(self, key):
+        html = self._entries.pop(key)
+        self._bytes -= len(html.encode("utf-8"))
+        keys = self._by_post.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_post[key[1]]
+
+
+fragment_cache = FragmentCache()
+
+
+def init_fragment_cache(app):
+    fragment_cache.max_bytes = app.config.get(
+        "FRAGMENT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES
+    )
+
+
+def _cached(key, render):
+    if not current_app.config.get("FRAGMENT_CACHE_ENABLED", True):
+        return Markup(render())
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render()
+        fragment_cache.set(key, html)
+    return Markup(html)
+
+
+def _commenters(comments):
+    """コメント一覧に埋め込むコメント投稿者のユーザー名・アイコン（キー用）"""
+    return tuple((c.user.username, c.user.icon) for c in comments)
+
+
+def render_comments(post, comments):
+    """コメント一覧（post.ordered_comments など）のフラグメント"""
+    return _cached(
+        ("comments", post.id, post.version, _commenters(comments)),
+        lambda: render_template("feed/_comment_items.html", comments=comments),
+    )
+
+
+def render_post_card(post, viewer, liked=False, reposted=False):
+    """投稿カードのフラグメント
+
+    閲覧者ごとに変わるのはいいね / 転送済みとログイン有無だけなので
+    それらもキーに含める（1 投稿あたり最大 5 通り）。
+    """
+    authenticated = bool(viewer and viewer.is_authenticated)
+    author = post.user
+    key = (
+        "card",
+        post.id,
+        post.version,
+        author.username,
+        author.icon,
+        _commenters(post.ordered_comments),
+        authenticated,
+        liked,
+        reposted,
+    )
+    return _cached(
+        key,
+        lambda: render_template(
+            "feed/_post_card.html",
+            post=post,
+            comments_html=render_comments(post, post.ordered_comments),
+            authenticated=authenticated,
+            liked=liked,
+            reposted=reposted,
+        ),
+    )
+
+
+def render_post_cards(posts, viewer, state):
+    """ページ内の投稿カードをまとめてレンダリング（state は viewer_state() の結果）"""
+    return [
+        render_post_card(
+            post,
+            viewer,
+            liked=post.id in state.liked,
+            reposted=post.id in state.reposted,
+        )
+        for post in posts
+    ]
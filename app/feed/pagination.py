@@ -0,0 +1,192 @@
+# app/feed/pagination.py
+import base64
+from collections import defaultdict
+
+from sqlalchemy.orm import aliased, joinedload
+
+from app.extensions import db
+from app.posts.models import Post, Comment
+
+FEED_PAGE_SIZE = 20
+FEED_PAGE_SIZE_MAX = 100
+# フィードに埋め込むコメント数（続きはコメント API から取得）
+COMMENT_PAGE_SIZE = 5
+
+
+# ----------------------
+# カーソル (created_at, id) のエンコード / デコード
+# ----------------------
+# created_at は db.func.now()（秒まで）と datetime.utcnow（マイクロ秒付き）の
+# 両方の形式で SQLite に保存されているため、カーソルには保存されている
+# 文字列をそのまま持たせ、比較も文字列同士で行う（ORDER BY と同じ順序になる）。
+def encode_cursor(raw_ts, row_id) -> str:
+    raw = f"{raw_ts}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """カーソル文字列を (created_at文字列, id) に戻す。不正な値は None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return ts, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def clamp_limit(limit, default=FEED_PAGE_SIZE, maximum=FEED_PAGE_SIZE_MAX) -> int:
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def raw_ts(ts_col):
+    """DateTime 列を変換せず保存文字列のまま取り出す式"""
+    return db.type_coerce(ts_col, db.String)
+
+
+def keyset_filter(query, ts_col, id_col, cursor=None, desc=True):
+    """(ts_col, id_col) がカーソルより後ろの行に絞り込む"""
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return query
+    ts, row_id = decoded
+    raw = raw_ts(ts_col)
+    # 先頭の ts_col <= ts（>= ts）でインデックスの範囲検索になる
+    # （OR だけで書くと SQLite はインデックスを先頭から走査する）
+    if desc:
+        return query.filter(raw <= ts, db.or_(raw < ts, id_col < row_id))
+    return query.filter(raw >= ts, db.or_(raw > ts, id_col > row_id))
+
+
+def keyset_query(query, ts_col, id_col, cursor=None, limit=FEED_PAGE_SIZE, desc=True):
+    """keyset_page() が発行するクエリ: (行, ts_col の保存文字列) を limit + 1 件"""
+    query = keyset_filter(query, ts_col, id_col, cursor, desc)
+    if desc:
+        order = (ts_col.desc(), id_col.desc())
+    else:
+        order = (ts_col.asc(), id_col.asc())
+    return query.add_columns(raw_ts(ts_col)).order_by(*order).limit(limit + 1)
+
+
+def _split_page(rows, limit, id_key):
+    """keyset_query() の結果を (rows, next_cursor) にする"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_row, last_ts = rows[-1]
+        next_cursor = encode_cursor(last_ts, getattr(last_row, id_key))
+    return [row for row, _ in rows], next_cursor
+
+
+def keyset_page(query, ts_col, id_col, cursor=None, limit=FEED_PAGE_SIZE, desc=True):
+    """(ts_col, id_col) のキーセットで 1 ページ取得する
+
+    desc=True なら新しい順、False なら古い順。
+    戻り値: (rows, next_cursor)。次ページがなければ next_cursor は None。
+    """
+    rows = keyset_query(query, ts_col, id_col, cursor, limit, desc).all()
+    return _split_page(rows, limit, id_col.key)
+
+
+# ----------------------
+# 一括ロード
+# ----------------------
+def page_comments_query(post_ids, per_post=COMMENT_PAGE_SIZE):
+    """投稿ごとの先頭 per_post 件のコメント（+ コメント投稿者）: (Comment, created_at文字列)
+
+    投稿ごとに ix_comments_post_created を per_post 件だけ読む相関サブクエリで絞る
+    （コメントの多い投稿でも全件を読まない）。
+    """
+    first = aliased(Comment)
+    first_ids = (
+        db.select(first.id)
+        .where(first.post_id == Post.id)
+        .order_by(first.created_at.asc(), first.id.asc())
+        .limit(per_post)
+        .correlate(Post)
+    )
+    return (
+        db.session.query(Comment, raw_ts(Comment.created_at))
+        .options(joinedload(Comment.user))
+        .select_from(Post)
+        .join(Comment, Comment.id.in_(first_ids))
+        .filter(Post.id.in_(post_ids))
+        .order_by(Comment.post_id, Comment.created_at.asc(), Comment.id.asc())
+    )
+
+
+def attach_comments(posts, per_post=COMMENT_PAGE_SIZE):
+    """ページ内の投稿の先頭 per_post 件のコメントとコメント投稿者を 1 クエリで取得し
+    post.ordered_comments に詰める
+
+    post.comments_cursor には続きを取得するためのカーソル（なければ None）を入れる。
+    """
+    by_post = defaultdict(list)
+    last_ts = {}
+    post_ids = [p.id for p in posts]
+    if post_ids:
+        for c, ts in page_comments_query(post_ids, per_post).all():
+            by_post[c.post_id].append(c)
+            last_ts[c.post_id] = ts
+
+    for post in posts:
+        post.ordered_comments = by_post.get(post.id, [])
+        post.comments_cursor = None
+        if post.ordered_comments and (post.comment_count or 0) > len(
+            post.ordered_comments
+        ):
+            post.comments_cursor = encode_cursor(
+                last_ts[post.id], post.ordered_comments[-1].id
+            )
+    return posts
+
+
+def comments_page_query(post_id, cursor=None, limit=COMMENT_PAGE_SIZE, desc=False):
+    """load_comments_page() が発行するクエリ（コメント + コメント投稿者）"""
+    query = Comment.query.options(joinedload(Comment.user)).filter(
+        Comment.post_id == post_id
+    )
+    return keyset_query(query, Comment.created_at, Comment.id, cursor, limit, desc)
+
+
+def load_comments_page(post_id, after=None, before=None, limit=COMMENT_PAGE_SIZE):
+    """1 投稿のコメントをキーセットで 1 ページ取得する（表示は古い順）
+
+    after を指定するとそれより新しいコメント、before を指定するとそれより古いコメント。
+    戻り値: (comments, cursor)。cursor は同じ向きの続きのカーソル（なければ None）。
+    """
+    limit = clamp_limit(limit, default=COMMENT_PAGE_SIZE)
+    if before:
+        rows = comments_page_query(post_id, before, limit, desc=True).all()
+        comments, cursor = _split_page(rows, limit, "id")
+        comments.reverse()
+        return comments, cursor
+    rows = comments_page_query(post_id, after, limit).all()
+    return _split_page(rows, limit, "id")
+
+
+def feed_page_query(cursor=None, limit=FEED_PAGE_SIZE, query=None):
+    """load_feed_page() が発行するクエリ（投稿 + 投稿者を JOIN で 1 クエリ）"""
+    if query is None:
+        query = Post.query
+    return keyset_query(
+        query.options(joinedload(Post.user)), Post.created_at, Post.id, cursor, limit
+    )
+
+
+def load_feed_page(cursor=None, limit=FEED_PAGE_SIZE, query=None):
+    """フィード 1 ページ分を固定回数のクエリで取得する
+
+    投稿 + 投稿者（JOIN で 1 クエリ）、コメント + コメント投稿者（1 クエリ）。
+    戻り値: (posts, next_cursor)。次ページがなければ next_cursor は None。
+    """
+    limit = clamp_limit(limit)
+    posts, next_cursor = _split_page(
+        feed_page_query(cursor, limit, query).all(), limit, "id"
+    )
+    return attach_comments(posts), next_cursor
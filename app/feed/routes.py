@@ -1,7 +1,13 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, abort
 from flask_login import login_required, current_user
 from app import db
-from app.posts.models import Post, Like, Comment, Repost
+from app.posts.models import Comment, bump_post_counters
+from app.posts import engagement
+from app.feed.pagination import load_feed_page, load_comments_page
+from app.feed.timeline import home_timeline
+from app.feed.fragment_cache import fragment_cache, render_post_cards
+from app.auth.user_cache import user_cache
+from app.search.index import index_comment
 
 # url_prefixを空にしてトップページに設定
 feed_bp = Blueprint("feed", __name__, template_folder="templates", url_prefix="")
@@ -9,34 +15,82 @@ feed_bp = Blueprint("feed", __name__, template_folder="templates", url_prefix=""
 
 @feed_bp.route("/")
 def feed_home():
-    # 投稿を作成日順に取得
-    posts = Post.query.order_by(Post.created_at.desc()).all()
+    # 投稿を (created_at, id) のカーソルでページ単位に取得
+    # 投稿者・コメント・コメント投稿者はまとめてロード済み
+    posts, next_cursor = load_feed_page(
+        cursor=request.args.get("cursor"), limit=request.args.get("limit")
+    )
+    # ログインユーザーのいいね / 転送状態をページ単位で 1 クエリ取得
+    state = engagement.current_viewer_state(current_user, [p.id for p in posts])
+
+    return render_template(
+        "feed/feed.html",
+        cards=render_post_cards(posts, current_user, state),
+        next_cursor=next_cursor,
+        current_user=current_user,
+    )
+
 
-    # 各投稿にコメントリストを追加
-    for post in posts:
-        post.ordered_comments = post.comments.order_by(Comment.created_at.asc()).all()
+@feed_bp.route("/following")
+@login_required
+def following():
+    # フォロー中ユーザーの投稿・転送（展開済みタイムラインを範囲走査）
+    posts, next_cursor = home_timeline(
+        current_user, cursor=request.args.get("cursor"), limit=request.args.get("limit")
+    )
+    state = engagement.current_viewer_state(current_user, [p.id for p in posts])
 
-    return render_template("feed/feed.html", posts=posts, current_user=current_user)
+    return render_template(
+        "feed/feed.html",
+        cards=render_post_cards(posts, current_user, state),
+        next_cursor=next_cursor,
+        current_user=current_user,
+    )
+
+
+def _requested_state(name):
+    """{"liked": true} のように状態が指定されていればその値、なければ None（反転）"""
+    data = request.get_json(silent=True) or request.form
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "on", "yes")
+    return bool(value)
 
 
 # ❤️ いいね
 @feed_bp.route("/like/<int:post_id>", methods=["POST"])
 @login_required
 def like(post_id):
-    post = Post.query.get_or_404(post_id)
-    existing = Like.query.filter_by(user_id=current_user.id, post_id=post.id).first()
-
-    if existing:
-        db.session.delete(existing)
-        db.session.commit()
-        count = post.likes.count()
-        return jsonify({"liked": False, "count": count})
-
-    new_like = Like(user_id=current_user.id, post_id=post.id)
-    db.session.add(new_like)
-    db.session.commit()
-    count = post.likes.count()
-    return jsonify({"liked": True, "count": count})
+    # INSERT ... ON CONFLICT DO NOTHING / DELETE ... RETURNING で切り替え、
+    # カウンタも UPDATE ... RETURNING で同じトランザクション内で取得する
+    # （write_behind ではキューに積んでまとめて書き込む）
+    result = engagement.record(
+        engagement.LIKE, current_user, post_id, _requested_state("liked")
+    )
+    if result is None:
+        abort(404)
+    return jsonify({"liked": result.active, "count": result.count})
+
+
+# 💬 コメント一覧（キーセットで続きを取得）
+@feed_bp.route("/comments/<int:post_id>", methods=["GET"])
+def comments(post_id):
+    items, cursor = load_comments_page(
+        post_id,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        limit=request.args.get("limit"),
+    )
+    return jsonify(
+        {
+            "comments_html": render_template(
+                "feed/_comment_items.html", comments=items
+            ),
+            "cursor": cursor,
+        }
+    )
 
 
 # 💬 コメント（Ajax用部分テンプレート返却）
@@ -54,26 +108,36 @@ def comment(post_id):
         post_id=post_id,
     )
     db.session.add(new_comment)
+    if bump_post_counters(post_id, comment_count=1) is None:
+        db.session.rollback()
+        abort(404)
+    index_comment(new_comment)
     db.session.commit()
+    fragment_cache.invalidate(post_id)
 
-    # 最新コメントを取得
-    post = Post.query.get_or_404(post_id)
-    ordered_comments = post.comments.order_by(Comment.created_at.asc()).all()
-
-    # 部分テンプレートでレンダリング
-    comments_html = render_template("feed/_comments.html", comments=ordered_comments)
+    # 追加したコメントだけをレンダリング（スレッド全体は再取得しない）
+    comment_html = render_template(
+        "feed/_comment_items.html", comments=[new_comment]
+    )
 
-    return jsonify({"ok": True, "comments_html": comments_html})
+    return jsonify({"ok": True, "comment_html": comment_html})
 
 
-# 🔁 転送
+# 🔁 転送（もう一度押すと取り消し）
 @feed_bp.route("/repost/<int:post_id>", methods=["POST"])
 @login_required
 def repost(post_id):
-    new_rp = Repost(
-        user_id=current_user.id,
-        post_id=post_id,
+    result = engagement.record(
+        engagement.REPOST, current_user, post_id, _requested_state("reposted")
+    )
+    if result is None:
+        abort(404)
+    return jsonify({"ok": True, "reposted": result.active, "count": result.count})
+
+
+# 📈 レンダリング結果・ログインユーザーのキャッシュのヒット率（このワーカーの値）
+@feed_bp.route("/metrics")
+def cache_metrics():
+    return jsonify(
+        {"fragment_cache": fragment_cache.stats(), "user_cache": user_cache.stats()}
     )
-    db.session.add(new_rp)
-    db.session.commit()
-    return jsonify({"ok": True})
@@ -0,0 +1,299 @@
+# app/feed/timeline.py
+# フォロー中タイムライン
+#
+# 投稿・転送の書き込み時にフォロワー全員の timeline_entries へ展開しておき
+# (fan-out-on-write)、読み込みは user_id で始まるインデックスの範囲走査 1 回で済ませる。
+# フォロワーが TIMELINE_FANOUT_LIMIT を超えるユーザーは書き込み時に展開せず、
+# 読み込み時にその人の投稿・転送を別途取得してマージする (fan-out-on-read)。
+# フォロワー数が上限をまたいだときは switch_fanout() で展開済みのエントリを
+# 取り除く / 最近の投稿・転送を展開し直す。
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app.extensions import db
+from app.auth.models import User, followers
+from app.posts.models import Post, Repost, TimelineEntry
+from app.feed.pagination import (
+    FEED_PAGE_SIZE,
+    attach_comments,
+    clamp_limit,
+    encode_cursor,
+    keyset_filter,
+    raw_ts,
+)
+
+DEFAULT_FANOUT_LIMIT = 10000
+BACKFILL_SIZE = 50
+
+_ENTRY_COLUMNS = ["user_id", "post_id", "actor_id", "created_at"]
+
+
+def fanout_limit() -> int:
+    return current_app.config.get("TIMELINE_FANOUT_LIMIT", DEFAULT_FANOUT_LIMIT)
+
+
+def _is_celebrity(user) -> bool:
+    return (user.follower_count or 0) > fanout_limit()
+
+
+def _insert_entries(select):
+    """重複 (user_id, post_id) は無視して挿入"""
+    stmt = (
+        db.insert(TimelineEntry)
+        .prefix_with("OR IGNORE")
+        .from_select(_ENTRY_COLUMNS, select)
+    )
+    return db.session.execute(stmt).rowcount
+
+
+def post_fanout_query(*where):
+    """where に合う投稿をフォロワーのタイムラインへ展開する行"""
+    return (
+        db.select(followers.c.follower_id, Post.id, Post.user_id, raw_ts(Post.created_at))
+        .select_from(Post)
+        .join(followers, followers.c.followed_id == Post.user_id)
+        .where(*where)
+    )
+
+
+def repost_fanout_query(*where):
+    """where に合う転送をフォロワーのタイムラインへ展開する行"""
+    return (
+        db.select(
+            followers.c.follower_id,
+            Repost.post_id,
+            Repost.user_id,
+            raw_ts(Repost.created_at),
+        )
+        .select_from(Repost)
+        .join(followers, followers.c.followed_id == Repost.user_id)
+        .where(*where)
+    )
+
+
+# ----------------------
+# 書き込み時の展開
+# ----------------------
+def fan_out_post(post):
+    """新規投稿を投稿者本人とフォロワーのタイムラインへ展開する（commit は呼び出し側）"""
+    db.session.flush()
+    author = post.user or db.session.get(User, post.user_id)
+
+    own = db.select(
+        Post.user_id.label("owner_id"), Post.id, Post.user_id, raw_ts(Post.created_at)
+    ).where(Post.id == post.id)
+    if _is_celebrity(author):
+        # フォロワーには読み込み時にマージする
+        return _insert_entries(own)
+
+    to_followers = post_fanout_query(Post.id == post.id)
+    return _insert_entries(db.union_all(own, to_followers))
+
+
+def fan_out_repost(actor, repost_id):
+    """転送をフォロワーのタイムラインへ展開する（すでにある投稿は無視）"""
+    if _is_celebrity(actor):
+        return 0
+
+    return _insert_entries(repost_fanout_query(Repost.id == repost_id))
+
+
+def rebuild_timelines(min_post_id=0):
+    """post_id >= min_post_id の投稿・転送をまとめて展開する（一括投入後用。commit する）"""
+    celebrities = db.select(User.id).where(User.follower_count > fanout_limit())
+    own = db.select(
+        Post.user_id.label("owner_id"), Post.id, Post.user_id, raw_ts(Post.created_at)
+    ).where(Post.id >= min_post_id)
+    to_followers = post_fanout_query(
+        Post.id >= min_post_id, Post.user_id.not_in(celebrities)
+    )
+    reposts = repost_fanout_query(
+        Repost.post_id >= min_post_id, Repost.user_id.not_in(celebrities)
+    )
+    # 転送より元の投稿のエントリを優先する（OR IGNORE なので先に入れた方が残る）
+    count = _insert_entries(db.union_all(own, to_followers))
+    count += _insert_entries(reposts)
+    db.session.commit()
+    return count
+
+
+def retract_repost_query(actor_id, post_id):
+    return db.delete(TimelineEntry).where(
+        TimelineEntry.actor_id == actor_id,
+        TimelineEntry.post_id == post_id,
+        TimelineEntry.user_id != actor_id,
+    )
+
+
+def retract_repost(actor, post_id):
+    """転送の取り消し時に、その転送で展開したエントリを取り除く"""
+    return db.session.execute(
+        retract_repost_query(actor.id, post_id),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+
+def backfill(user, followed_user, size=BACKFILL_SIZE):
+    """フォロー直後に相手の最近の投稿をタイムラインへ取り込む"""
+    db.session.flush()
+    if _is_celebrity(followed_user):
+        return 0
+    select = (
+        db.select(
+            db.literal(user.id), Post.id, Post.user_id, raw_ts(Post.created_at)
+        )
+        .where(Post.user_id == followed_user.id)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(size)
+    )
+    return _insert_entries(select)
+
+
+def remove_actor(user, actor):
+    """フォロー解除時に相手由来のエントリを取り除く"""
+    return TimelineEntry.query.filter_by(user_id=user.id, actor_id=actor.id).delete(
+        synchronize_session=False
+    )
+
+
+def switch_fanout(user, previous_count, size=BACKFILL_SIZE):
+    """フォロワー数が TIMELINE_FANOUT_LIMIT をまたいだら展開方式を切り替える
+
+    follow / unfollow の後（commit 前）に、変更前のフォロワー数を渡して呼ぶ。
+    - 上限を超えた: 以後は読み込み時に取得するので、フォロワーへ展開済みのエントリを消す
+    - 上限以下に戻った: 読み込み時に取得していた最近の投稿・転送を size 件ずつ展開する
+    """
+    db.session.flush()
+    was_celebrity = (previous_count or 0) > fanout_limit()
+    if was_celebrity == _is_celebrity(user):
+        return 0
+    if not was_celebrity:
+        return (
+            TimelineEntry.query.filter(
+                TimelineEntry.actor_id == user.id, TimelineEntry.user_id != user.id
+            )
+            .delete(synchronize_session=False)
+        )
+
+    recent_posts = (
+        db.select(Post.id)
+        .where(Post.user_id == user.id)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(size)
+    )
+    recent_reposts = (
+        db.select(Repost.id)
+        .where(Repost.user_id == user.id)
+        .order_by(Repost.created_at.desc(), Repost.id.desc())
+        .limit(size)
+    )
+    posts = post_fanout_query(Post.id.in_(recent_posts))
+    reposts = repost_fanout_query(Repost.id.in_(recent_reposts))
+    # 元の投稿のエントリを優先する（rebuild_timelines と同じ）
+    return _insert_entries(posts) + _insert_entries(reposts)
+
+
+# ----------------------
+# 読み込み
+# ----------------------
+def celebrity_ids_query(user_id):
+    """フォロー中のうち書き込み時に展開していないユーザーの ID"""
+    return (
+        db.select(User.id)
+        .join(followers, followers.c.followed_id == User.id)
+        .where(
+            followers.c.follower_id == user_id,
+            User.follower_count > fanout_limit(),
+        )
+    )
+
+
+def _celebrity_ids(user):
+    return [row[0] for row in db.session.execute(celebrity_ids_query(user.id))]
+
+
+def timeline_entries_query(user_id, cursor=None, limit=FEED_PAGE_SIZE):
+    """展開済みエントリ 1 ページ分: (post_id, created_at文字列)"""
+    return (
+        keyset_filter(
+            db.session.query(TimelineEntry.post_id, raw_ts(TimelineEntry.created_at)),
+            TimelineEntry.created_at,
+            TimelineEntry.post_id,
+            cursor,
+        )
+        .filter(TimelineEntry.user_id == user_id)
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+        .limit(limit + 1)
+    )
+
+
+def celebrity_posts_query(user_ids, cursor=None, limit=FEED_PAGE_SIZE):
+    """展開していないユーザーの投稿 1 ページ分: (post_id, created_at文字列)"""
+    return (
+        keyset_filter(
+            db.session.query(Post.id, raw_ts(Post.created_at)),
+            Post.created_at,
+            Post.id,
+            cursor,
+        )
+        .filter(Post.user_id.in_(user_ids))
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(limit + 1)
+    )
+
+
+def celebrity_reposts_query(user_ids, cursor=None, limit=FEED_PAGE_SIZE):
+    """展開していないユーザーの転送 1 ページ分: (post_id, 転送の created_at文字列)"""
+    return (
+        keyset_filter(
+            db.session.query(Repost.post_id, raw_ts(Repost.created_at)),
+            Repost.created_at,
+            Repost.post_id,
+            cursor,
+        )
+        .filter(Repost.user_id.in_(user_ids))
+        .order_by(Repost.created_at.desc(), Repost.post_id.desc())
+        .limit(limit + 1)
+    )
+
+
+def home_timeline(user, cursor=None, limit=FEED_PAGE_SIZE):
+    """フォロー中タイムライン 1 ページ分
+
+    戻り値: (posts, next_cursor)。posts には feed_home と同じく
+    投稿者と ordered_comments がロード済み。
+    """
+    limit = clamp_limit(limit)
+    rows = timeline_entries_query(user.id, cursor, limit).all()
+
+    celebrity_ids = _celebrity_ids(user)
+    if celebrity_ids:
+        pulled = celebrity_posts_query(celebrity_ids, cursor, limit).all()
+        pulled += celebrity_reposts_query(celebrity_ids, cursor, limit).all()
+        merged = {}
+        for post_id, ts in list(rows) + list(pulled):
+            if post_id not in merged or ts > merged[post_id]:
+                merged[post_id] = ts
+        rows = sorted(
+            ((pid, ts) for pid, ts in merged.items()),
+            key=lambda r: (r[1], r[0]),
+            reverse=True,
+        )[: limit + 1]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_id, last_ts = rows[-1]
+        next_cursor = encode_cursor(last_ts, last_id)
+
+    post_ids = [post_id for post_id, _ in rows]
+    if not post_ids:
+        return [], None
+    by_id = {
+        p.id: p
+        for p in Post.query.options(joinedload(Post.user))
+        .filter(Post.id.in_(post_ids))
+        .all()
+    }
+    posts = [by_id[pid] for pid in post_ids if pid in by_id]
+    return attach_comments(posts), next_cursor
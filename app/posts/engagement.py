@@ -0,0 +1,304 @@
+# app/posts/engagement.py
+# いいね / 転送の書き込み
+#
+# ENGAGEMENT_WRITE_MODE = "sync"（既定）: リクエストごとに 1 トランザクションで書き込む。
+# ENGAGEMENT_WRITE_MODE = "write_behind": イベントをプロセス内のキューに積み、
+#   ENGAGEMENT_FLUSH_INTERVAL_MS ごと、または ENGAGEMENT_FLUSH_MAX_EVENTS 件たまった時点で
+#   1 トランザクションにまとめて書き込む（グループコミット）。SQLite は書き込みが 1 本に
+#   直列化されるため、バズった投稿へのいいねが commit / fsync 待ちで詰まらなくなる。
+#   応答済みでまだ書き込んでいないイベントは、プロセスが異常終了すると失われる。
+#   正常終了時は atexit でキューを書き切る。
+#   書き込みスレッドは最初のリクエストを受けたときに起動する（flask の CLI コマンドや
+#   gunicorn --preload のマスタープロセスでは起動しない）。
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.auth.models import User
+from app.posts.models import (
+    ToggleResult,
+    get_post_counters,
+    toggle_like,
+    toggle_repost,
+    viewer_state,
+)
+from app.feed.timeline import fan_out_repost, retract_repost
+from app.feed.fragment_cache import fragment_cache
+
+logger = logging.getLogger(__name__)
+
+LIKE = "like"
+REPOST = "repost"
+
+_TOGGLES = {LIKE: toggle_like, REPOST: toggle_repost}
+_COUNTERS = {LIKE: "like_count", REPOST: "repost_count"}
+_DURABILITY = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+
+def _apply(kind, actor, post_id, active):
+    """1 件分の書き込み（commit は呼び出し側）"""
+    result = _TOGGLES[kind](actor.id, post_id, active)
+    if result is not None and result.changed and kind == REPOST:
+        if result.active:
+            fan_out_repost(actor, result.row_id)
+        else:
+            retract_repost(actor, post_id)
+    return result
+
+
+class EngagementQueue:
+    """いいね / 転送イベントの書き込み待ちキュー
+
+    同じ (種類, ユーザー, 投稿) のイベントは最後の状態だけを残す。
+    """
+
+    def __init__(self, app, interval_ms=50, max_events=500, durability="normal"):
+        self.app = app
+        self.interval = interval_ms / 1000
+        self.max_events = max_events
+        self.synchronous = _DURABILITY.get(durability, "NORMAL")
+        # (kind, user_id, post_id) -> [書き込み前の DB 上の状態, 目標の状態]
+        self._pending = {}
+        # 書き込み中のバッチ（commit されるまでは DB の状態として扱う）
+        self._inflight = {}
+        # (kind, post_id) -> カウンタの未反映分
+        self._deltas = {}
+        # 書き込みが終わるたびに +1
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._started = False
+        self._thread = threading.Thread(
+            target=self._run, name="engagement-flush", daemon=True
+        )
+        self.flushed_batches = 0
+        self.flushed_events = 0
+
+    def start(self):
+        """スレッドを起動する（2 回目以降は何もしない）"""
+        with self._cond:
+            if self._started:
+                return self
+            self._started = True
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    # ----------------------
+    # リクエスト側
+    # ----------------------
+    def submit(self, kind, user_id, post_id, active=None):
+        """イベントを積んで切り替え後の状態とカウンタを返す（投稿がなければ None）"""
+        counters = get_post_counters(post_id)
+        if counters is None:
+            return None
+        key = (kind, user_id, post_id)
+
+        baseline, generation = None, None
+        while True:
+            with self._cond:
+                entry = self._pending.get(key)
+                if entry is None and key in self._inflight:
+                    baseline = self._inflight[key][1]
+                elif entry is None and generation != self._generation:
+                    # DB を読んでいる間に書き込みが終わった: 読み直す
+                    baseline = None
+                if entry is not None or baseline is not None:
+                    if entry is None:
+                        entry = self._pending[key] = [baseline, baseline]
+                    current = entry[1]
+                    target = (not current) if active is None else bool(active)
+                    entry[1] = target
+                    delta = self._deltas.get((kind, post_id), 0)
+                    delta += int(target) - int(current)
+                    self._deltas[(kind, post_id)] = delta
+                    if len(self._pending) >= self.max_events:
+                        self._cond.notify()
+                    break
+                generation = self._generation
+            baseline = self._db_state(kind, user_id, post_id)
+
+        count = counters[_COUNTERS[kind]] + delta
+        return ToggleResult(target, target != current, max(count, 0), None)
+
+    def overlay(self, user, state):
+        """viewer_state() の結果に未書き込みのイベントを反映する"""
+        if not user.is_authenticated:
+            return state
+        liked, reposted = set(state.liked), set(state.reposted)
+        with self._cond:
+            events = list(self._inflight.items()) + list(self._pending.items())
+            for (kind, user_id, post_id), (_, target) in events:
+                if user_id != user.id:
+                    continue
+                ids = liked if kind == LIKE else reposted
+                (ids.add if target else ids.discard)(post_id)
+        return type(state)(frozenset(liked), frozenset(reposted))
+
+    @staticmethod
+    def _db_state(kind, user_id, post_id):
+        state = viewer_state(_Viewer(user_id), [post_id])
+        return post_id in (state.liked if kind == LIKE else state.reposted)
+
+    # ----------------------
+    # 書き込みスレッド
+    # ----------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self.max_events:
+                    self._cond.wait(self.interval)
+                stopped = self._stopped
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("engagement flush failed")
+            if stopped:
+                return
+
+    def flush(self):
+        """キューの中身を 1 トランザクションで書き込む"""
+        with self._cond:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+
+        started = time.perf_counter()
+        changed_posts = set()
+        try:
+            with self.app.app_context(), db.engine.connect() as conn:
+                # synchronous は接続ごとの設定なので、専用の接続で書き込み、
+                # プールへ返す前に元の値へ戻す（他のリクエストの接続に残さない）
+                previous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+                conn.exec_driver_sql(f"PRAGMA synchronous = {self.synchronous}")
+                conn.commit()
+                db.session.registry.set(Session(bind=conn))
+                try:
+                    actors = {}
+                    for (kind, user_id, post_id), (baseline, target) in batch.items():
+                        if baseline == target:
+                            continue
+                        if user_id not in actors:
+                            actors[user_id] = db.session.get(User, user_id)
+                        if actors[user_id] is None:
+                            continue
+                        result = _apply(kind, actors[user_id], post_id, target)
+                        if result is not None and result.changed:
+                            changed_posts.add(post_id)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self._requeue(batch)
+                    raise
+                finally:
+                    db.session.remove()
+                    conn.exec_driver_sql(f"PRAGMA synchronous = {previous}")
+                    conn.commit()
+        finally:
+            with self._cond:
+                self._inflight = {}
+                self._generation += 1
+
+        # DB に反映された分をカウンタの未反映分から差し引く
+        with self._cond:
+            for (kind, _, post_id), (baseline, target) in batch.items():
+                key = (kind, post_id)
+                delta = self._deltas.get(key, 0) - (int(target) - int(baseline))
+                if delta:
+                    self._deltas[key] = delta
+                else:
+                    self._deltas.pop(key, None)
+
+        for post_id in changed_posts:
+            fragment_cache.invalidate(post_id)
+        self.flushed_batches += 1
+        self.flushed_events += len(batch)
+        logger.debug(
+            "flushed %d engagement events in %.1fms",
+            len(batch),
+            (time.perf_counter() - started) * 1000,
+        )
+        return len(batch)
+
+    def _requeue(self, batch):
+        """書き込みに失敗したイベントをキューへ戻す（後から来たイベントを優先）"""
+        with self._cond:
+            for key, entry in batch.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = entry
+                else:
+                    newer[0] = entry[0]
+
+    def stop(self):
+        """残りを書き切ってスレッドを止める"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            self.flush()
+
+
+class _Viewer:
+    """viewer_state() に user_id だけを渡すための軽量オブジェクト"""
+
+    is_authenticated = True
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+_queue = None
+
+
+def init_engagement(app):
+    global _queue
+    _queue = None
+    if app.config.get("ENGAGEMENT_WRITE_MODE") == "write_behind":
+        _queue = EngagementQueue(
+            app,
+            interval_ms=app.config.get("ENGAGEMENT_FLUSH_INTERVAL_MS", 50),
+            max_events=app.config.get("ENGAGEMENT_FLUSH_MAX_EVENTS", 500),
+            durability=app.config.get("ENGAGEMENT_DURABILITY", "normal"),
+        )
+        app.extensions["engagement_queue"] = _queue
+        queue = _queue
+
+        @app.before_request
+        def start_engagement_queue():
+            queue.start()
+
+
+def record(kind, actor, post_id, active=None):
+    """いいね / 転送を切り替える。投稿がなければ None
+
+    write_behind ではキューに積むだけで、書き込みは後でまとめて行う。
+    """
+    if _queue is not None:
+        return _queue.submit(kind, actor.id, post_id, active)
+
+    result = _apply(kind, actor, post_id, active)
+    if result is None:
+        db.session.rollback()
+        return None
+    db.session.commit()
+    if result.changed:
+        fragment_cache.invalidate(post_id)
+    return result
+
+
+def current_viewer_state(user, post_ids):
+    """viewer_state() に未書き込みのイベントを重ねたもの"""
+    state = viewer_state(user, post_ids)
+    if _queue is not None:
+        state = _queue.overlay(user, state)
+    return state
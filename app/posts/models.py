@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from app.auth.models import db, User
 
 # ----------------------
@@ -14,8 +16,22 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     created_at = db.Column(db.DateTime, default=db.func.now())
 
+    # 集計カウンタ（likes / comments / reposts の書き込みと同じトランザクションで更新）
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    repost_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # カウンタ更新のたびに +1（レンダリング結果キャッシュのキーに使う）
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
     user = db.relationship("User", backref=db.backref("posts", lazy="dynamic"))
 
+    __table_args__ = (
+        # フィード: ORDER BY created_at DESC, id DESC のキーセット
+        db.Index("ix_posts_created_id", "created_at", "id"),
+        # ユーザー別の投稿一覧・タイムラインの取り込み
+        db.Index("ix_posts_user_created", "user_id", "created_at"),
+    )
+
     # ここは名前かぶりしないようにbackrefを変更
     likes = db.relationship(
         "Like", backref="post_ref", lazy="dynamic", cascade="all, delete-orphan"
@@ -31,12 +47,11 @@ class Post(db.Model):
         return f"<Post {self.id} by User {self.user_id}: {self.title}>"
 
     def is_liked_by(self, user):
-        """ユーザーがこの投稿にいいねしているか"""
-        if not user.is_authenticated:
-            return False
-        return (
-            Like.query.filter_by(user_id=user.id, post_id=self.id).first() is not None
-        )
+        """ユーザーがこの投稿にいいねしているか
+
+        複数の投稿を表示するときは viewer_state() でまとめて取得すること。
+        """
+        return self.id in viewer_state(user, [self.id]).liked
 
 
 # ----------------------
@@ -52,6 +67,13 @@ class Like(db.Model):
 
     user = db.relationship("User", backref=db.backref("likes", lazy="dynamic"))
 
+    __table_args__ = (
+        # 同じユーザーが同じ投稿に 2 回いいねできないようにする
+        db.Index("uq_likes_user_post", "user_id", "post_id", unique=True),
+        # 投稿ごとのいいね一覧・集計
+        db.Index("ix_likes_post_user", "post_id", "user_id"),
+    )
+
     def __repr__(self):
         return f"<Like {self.id} by User {self.user_id} on Post {self.post_id}>"
 
@@ -74,6 +96,11 @@ class Comment(db.Model):
         "Post", backref=db.backref("comments_from_comment", lazy="dynamic")
     )
 
+    __table_args__ = (
+        # 投稿ごとのコメントを古い順に取得
+        db.Index("ix_comments_post_created", "post_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<Comment {self.id} by User {self.user_id} on Post {self.post_id}>"
 
@@ -94,5 +121,188 @@ class Repost(db.Model):
         "Post", backref=db.backref("reposts_from_repost", lazy="dynamic")
     )
 
+    __table_args__ = (
+        db.Index("uq_reposts_user_post", "user_id", "post_id", unique=True),
+        db.Index("ix_reposts_post", "post_id"),
+        # フォロワーの多いユーザーの転送をタイムライン読み込み時に新しい順で取得
+        db.Index("ix_reposts_user_created", "user_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<Repost {self.id} by User {self.user_id} on Post {self.post_id}>"
+
+
+# ----------------------
+# ホームタイムライン（フォロー中ユーザーの投稿・転送を書き込み時に展開）
+# ----------------------
+class TimelineEntry(db.Model):
+    __tablename__ = "timeline_entries"
+
+    # タイムラインの持ち主
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    # 投稿者または転送したユーザー
+    actor_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    # 投稿 / 転送の created_at をそのままコピーする
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_timeline_user_created", "user_id", "created_at", "post_id"),
+        # フォロー解除・転送取り消し時の削除
+        db.Index("ix_timeline_actor_post", "actor_id", "post_id"),
+    )
+
+    def __repr__(self):
+        return f"<TimelineEntry user={self.user_id} post={self.post_id}>"
+
+
+# ----------------------
+# 閲覧ユーザーごとの状態（いいね済み / 転送済み）
+# ----------------------
+class ViewerState(NamedTuple):
+    liked: frozenset
+    reposted: frozenset
+
+
+EMPTY_VIEWER_STATE = ViewerState(frozenset(), frozenset())
+
+
+def viewer_state_query(user_id, post_ids):
+    """viewer_state() が発行するクエリ: (kind, post_id)"""
+    likes = db.select(db.literal("like").label("kind"), Like.post_id).where(
+        Like.user_id == user_id, Like.post_id.in_(post_ids)
+    )
+    reposts = db.select(db.literal("repost").label("kind"), Repost.post_id).where(
+        Repost.user_id == user_id, Repost.post_id.in_(post_ids)
+    )
+    return db.union_all(likes, reposts)
+
+
+def viewer_state(user, post_ids) -> ViewerState:
+    """post_ids のうち user がいいね / 転送した投稿 ID を 1 クエリで返す"""
+    post_ids = list(post_ids)
+    if not post_ids or user is None or not user.is_authenticated:
+        return EMPTY_VIEWER_STATE
+
+    liked, reposted = set(), set()
+    for kind, post_id in db.session.execute(viewer_state_query(user.id, post_ids)):
+        (liked if kind == "like" else reposted).add(post_id)
+    return ViewerState(frozenset(liked), frozenset(reposted))
+
+
+# ----------------------
+# 集計カウンタ
+# ----------------------
+COUNTER_SOURCES = {
+    "like_count": Like,
+    "comment_count": Comment,
+    "repost_count": Repost,
+}
+
+
+def bump_post_counters(post_id, **deltas):
+    """投稿のカウンタを加算する（commit は呼び出し側）
+
+    例: bump_post_counters(post.id, like_count=1)
+    UPDATE posts SET like_count = like_count + 1 なので同時更新でもずれない。
+    同じ UPDATE で version も +1 する。
+    戻り値: 更新後のカウンタ dict（投稿が存在しなければ None）
+    """
+    values = {Post.version: Post.version + 1}
+    for name, delta in deltas.items():
+        if name not in COUNTER_SOURCES:
+            raise ValueError(f"unknown counter: {name}")
+        column = getattr(Post, name)
+        values[column] = column + delta
+    row = db.session.execute(
+        db.update(Post)
+        .where(Post.id == post_id)
+        .values(values)
+        .returning(Post.like_count, Post.comment_count, Post.repost_count)
+        .execution_options(synchronize_session=False)
+    ).first()
+    return dict(row._mapping) if row is not None else None
+
+
+def get_post_counters(post_id):
+    """カウンタ列だけを主キーで取得（投稿がなければ None）"""
+    row = (
+        db.session.query(Post.like_count, Post.comment_count, Post.repost_count)
+        .filter(Post.id == post_id)
+        .first()
+    )
+    return dict(row._mapping) if row is not None else None
+
+
+def recount_post_counters() -> int:
+    """likes / comments / reposts から全投稿のカウンタを再計算する（修復用）"""
+    values = {}
+    for name, model in COUNTER_SOURCES.items():
+        values[getattr(Post, name)] = (
+            db.select(db.func.count(model.id))
+            .where(model.post_id == Post.id)
+            .scalar_subquery()
+        )
+    updated = Post.query.update(values, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
+# ----------------------
+# いいね / 転送の切り替え
+# ----------------------
+class ToggleResult(NamedTuple):
+    active: bool  # 切り替え後にいいね（転送）している状態か
+    changed: bool  # 行を追加 / 削除したか
+    count: int  # 切り替え後のカウンタ
+    row_id: int = None  # 追加した行の id
+
+
+def _toggle(model, counter, user_id, post_id, active=None):
+    """(user_id, post_id) の一意インデックスを使って行を追加 / 削除する
+
+    active=None なら現在の状態を反転、True / False ならその状態にする（冪等）。
+    SELECT してから INSERT / DELETE しないので、連打や同時リクエストでも
+    行が重複せずカウンタもずれない。commit は呼び出し側。
+    投稿が存在しない場合は None を返す（呼び出し側で rollback すること）。
+    """
+    table = model.__table__
+    row_id = None
+    changed = False
+
+    if active is None or active:
+        inserted = db.session.execute(
+            sqlite_insert(table)
+            .values(user_id=user_id, post_id=post_id, created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["user_id", "post_id"])
+            .returning(table.c.id)
+        ).first()
+        if inserted is not None:
+            row_id, changed, active = inserted[0], True, True
+        else:
+            # すでに行がある: 反転なら取り消し、active=True ならそのまま
+            active = bool(active)
+
+    if not active:
+        deleted = db.session.execute(
+            db.delete(table)
+            .where(table.c.user_id == user_id, table.c.post_id == post_id)
+            .returning(table.c.id)
+        ).first()
+        changed = deleted is not None
+
+    if changed:
+        counters = bump_post_counters(post_id, **{counter: 1 if active else -1})
+    else:
+        counters = get_post_counters(post_id)
+    if counters is None:
+        return None
+    return ToggleResult(active, changed, counters[counter], row_id)
+
+
+def toggle_like(user_id, post_id, liked=None):
+    return _toggle(Like, "like_count", user_id, post_id, liked)
+
+
+def toggle_repost(user_id, post_id, reposted=None):
+    return _toggle(Repost, "repost_count", user_id, post_id, reposted)
@@ -1,7 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request
 from flask_login import login_required, current_user
+from sqlalchemy.orm import selectinload
 from app.extensions import db
-from app.posts.models import Post, Like, Comment
+from app.posts.models import Post, Comment, bump_post_counters
+from app.posts import engagement
+from app.feed.timeline import fan_out_post
+from app.feed.fragment_cache import fragment_cache
+from app.search.index import index_post, index_comment
 from app.posts.forms import PostForm  # ← 追加: CSRF対応のフォーム
 
 post_bp = Blueprint("post", __name__, url_prefix="/")
@@ -27,6 +32,8 @@ def create_post():
                 user_id=current_user.id
             )
             db.session.add(post)
+            fan_out_post(post)
+            index_post(post)
             db.session.commit()
             flash("投稿を作成しました！", "success")
             return redirect(url_for("post.index"))
@@ -42,22 +49,10 @@ def create_post():
 @login_required
 def like(post_id):
     try:
-        existing_like = Like.query.filter_by(
-            user_id=current_user.id, post_id=post_id
-        ).first()
-
-        if existing_like:
-            db.session.delete(existing_like)
-            db.session.commit()
-            liked = False
-        else:
-            new_like = Like(user_id=current_user.id, post_id=post_id)
-            db.session.add(new_like)
-            db.session.commit()
-            liked = True
-
-        like_count = Like.query.filter_by(post_id=post_id).count()
-        return jsonify({"liked": liked, "like_count": like_count})
+        result = engagement.record(engagement.LIKE, current_user, post_id)
+        if result is None:
+            return jsonify({"error": "投稿が存在しません"}), 404
+        return jsonify({"liked": result.active, "like_count": result.count})
 
     except Exception as e:
         db.session.rollback()
@@ -75,7 +70,12 @@ def comment(post_id):
     try:
         new_comment = Comment(user_id=current_user.id, post_id=post_id, content=content)
         db.session.add(new_comment)
+        if bump_post_counters(post_id, comment_count=1) is None:
+            db.session.rollback()
+            return jsonify({"error": "投稿が存在しません"}), 404
+        index_comment(new_comment)
         db.session.commit()
+        fragment_cache.invalidate(post_id)
         return jsonify(
             {
                 "id": new_comment.id,
@@ -93,24 +93,21 @@ def comment(post_id):
 @post_bp.route("/<int:post_id>", methods=["GET"])
 def detail(post_id):
     post = Post.query.get_or_404(post_id)
+    # コメント投稿者はまとめて 1 クエリで読む（コメントごとに users を引かない）
     comments = (
-        Comment.query.filter_by(post_id=post_id)
-        .order_by(Comment.created_at.asc())
+        Comment.query.options(selectinload(Comment.user))
+        .filter_by(post_id=post_id)
+        .order_by(Comment.created_at.asc(), Comment.id.asc())
         .all()
     )
-    like_count = Like.query.filter_by(post_id=post_id).count()
-    liked_by_user = (
-        Like.query.filter_by(
-            post_id=post_id,
-            user_id=current_user.get_id() if current_user.is_authenticated else None,
-        ).first()
-        is not None
-    )
+    like_count = post.like_count
+    state = engagement.current_viewer_state(current_user, [post.id])
 
     return render_template(
         "posts/detail.html",
         post=post,
         comments=comments,
         like_count=like_count,
-        liked_by_user=liked_by_user,
+        liked_by_user=post.id in state.liked,
+        reposted_by_user=post.id in state.reposted,
     )
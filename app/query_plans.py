@@ -0,0 +1,121 @@
+# app/query_plans.py
+# 主要クエリの EXPLAIN QUERY PLAN を確認し、テーブル全体の走査がないかを調べる
+# (flask check-query-plans)
+import re
+
+from .extensions import db
+from .auth.models import (
+    User,
+    follow_state_query,
+    followers_page_query,
+    following_page_query,
+)
+from .auth.outbox import due_emails_query
+from .posts.models import Post, Repost, viewer_state_query
+from .feed.pagination import (
+    comments_page_query,
+    encode_cursor,
+    feed_page_query,
+    page_comments_query,
+)
+from .feed.timeline import (
+    celebrity_ids_query,
+    celebrity_posts_query,
+    celebrity_reposts_query,
+    post_fanout_query,
+    repost_fanout_query,
+    retract_repost_query,
+    timeline_entries_query,
+)
+from .search.index import search_query
+
+SAMPLE_CURSOR = encode_cursor("2025-01-01 00:00:00", 1)
+SAMPLE_IDS = [1, 2, 3]
+
+# "SCAN posts" / "SCAN posts USING INDEX ..." / "SCAN posts USING COVERING INDEX ..."
+# はどれもテーブル（インデックス）を先頭から走査している。絞り込みに
+# インデックスを使えていれば "SEARCH posts USING ..." になる。
+# (SQLite 3.36 以前は "SCAN TABLE posts"。エイリアスは "comments_1" のようになる)
+_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)")
+_ALIAS_SUFFIX = re.compile(r"_\d+$")
+
+
+def main_queries():
+    """(名前, ステートメント) のリスト。アプリのクエリ関数が組み立てたものをそのまま使う"""
+    return [
+        ("feed_page", feed_page_query(SAMPLE_CURSOR).statement),
+        ("page_comments", page_comments_query(SAMPLE_IDS).statement),
+        ("comments_after", comments_page_query(1, SAMPLE_CURSOR).statement),
+        ("comments_before", comments_page_query(1, SAMPLE_CURSOR, desc=True).statement),
+        ("viewer_state", viewer_state_query(1, SAMPLE_IDS)),
+        ("timeline_page", timeline_entries_query(1, SAMPLE_CURSOR).statement),
+        ("celebrity_ids", celebrity_ids_query(1)),
+        ("celebrity_posts", celebrity_posts_query(SAMPLE_IDS, SAMPLE_CURSOR).statement),
+        (
+            "celebrity_reposts",
+            celebrity_reposts_query(SAMPLE_IDS, SAMPLE_CURSOR).statement,
+        ),
+        ("fan_out_post", post_fanout_query(Post.id == 1)),
+        ("fan_out_repost", repost_fanout_query(Repost.id == 1)),
+        ("retract_repost", retract_repost_query(1, 1)),
+        ("following_page", following_page_query(1, after=1).statement),
+        ("followers_page", followers_page_query(1, after=1).statement),
+        ("follow_state", follow_state_query(1, SAMPLE_IDS)),
+        ("search", search_query("投資信託")),
+        ("email_outbox_due", due_emails_query("2025-01-01 00:00:00", 50)),
+        (
+            "login_by_email",
+            User.query.filter_by(email="user@example.com").statement,
+        ),
+    ]
+
+
+def explain(stmt):
+    """EXPLAIN QUERY PLAN の detail の一覧
+
+    値はアプリと同じくバインド変数で渡す（リテラルを埋め込むと SQLite は
+    実行時とは違うプランを選ぶことがある）。
+    """
+    compiled = stmt.compile(
+        dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    params = compiled.construct_params()
+    args = tuple(params[name] for name in compiled.positiontup or ())
+    rows = (
+        db.session.connection()
+        .exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", args)
+        .all()
+    )
+    return [row[3] for row in rows]
+
+
+def hot_tables():
+    """走査を許さないテーブル（アプリのモデルのテーブル。FTS の仮想テーブルは含まない）"""
+    return set(db.metadata.tables)
+
+
+def full_scans(plan, tables=None):
+    """プラン中で SEARCH ではなく SCAN しているテーブル名"""
+    if tables is None:
+        tables = hot_tables()
+    scanned = []
+    for detail in plan:
+        m = _SCAN.match(detail)
+        if not m:
+            continue
+        table = m.group("table")
+        if table not in tables:
+            table = _ALIAS_SUFFIX.sub("", table)
+        if table in tables:
+            scanned.append(table)
+    return scanned
+
+
+def check_query_plans():
+    """[(名前, プラン, フルスキャンしたテーブル)] を返す"""
+    tables = hot_tables()
+    results = []
+    for name, stmt in main_queries():
+        plan = explain(stmt)
+        results.append((name, plan, full_scans(plan, tables)))
+    return results
@@ -0,0 +1,112 @@
+# app/schema.py
+# Flask-Migrate を使っていないため、db.create_all() では追加されない
+# 既存テーブルへの列・インデックス追加を起動時にここで行う。
+import logging
+
+from sqlalchemy import inspect
+
+from .extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+def _column_ddl(column, dialect) -> str:
+    ddl = f"{column.name} {column.type.compile(dialect=dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def add_missing_columns():
+    """モデルにあって既存 DB にない列を ALTER TABLE で追加する
+
+    戻り値: 追加した "table.column" のリスト
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = _column_ddl(column, engine.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                added.append(f"{table.name}.{column.name}")
+                logger.info("Added column %s.%s", table.name, column.name)
+
+    return added
+
+
+def _dedupe(conn, index):
+    """一意インデックス作成前に重複行を削除する（id が最小の行を残す）"""
+    table = index.table
+    cols = ", ".join(c.name for c in index.columns)
+    result = conn.exec_driver_sql(
+        f"DELETE FROM {table.name} WHERE id NOT IN "
+        f"(SELECT MIN(id) FROM {table.name} GROUP BY {cols})"
+    )
+    if result.rowcount:
+        logger.info("Removed %d duplicate rows from %s", result.rowcount, table.name)
+
+
+def create_missing_indexes():
+    """モデルで宣言したインデックスのうち既存 DB にないものを作成する
+
+    同じ名前で列構成が違うインデックスは作り直す。
+    戻り値: 作成したインデックス名のリスト
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {
+                ix["name"]: ix["column_names"] for ix in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                columns = [c.name for c in index.columns]
+                if index.name in existing:
+                    if existing[index.name] == columns:
+                        continue
+                    conn.exec_driver_sql(f"DROP INDEX {index.name}")
+                    logger.info("Dropped outdated index %s", index.name)
+                if index.unique:
+                    _dedupe(conn, index)
+                index.create(conn)
+                created.append(index.name)
+                logger.info("Created index %s", index.name)
+
+    return created
+
+
+def upgrade_schema():
+    """起動時のスキーマ更新。列・インデックスを追加した場合はカウンタを再計算する
+
+    全文検索の索引（FTS5 仮想テーブル）は create_all() の対象外なのでここで作り、
+    新しく作った場合は既存の投稿・コメントから索引を作る。
+    """
+    from .posts.models import recount_post_counters
+    from .auth.models import recount_follow_counters
+    from .search.index import SEARCH_TABLE, create_search_table, rebuild_search_index
+
+    added = add_missing_columns() + create_missing_indexes()
+    if added:
+        recount_post_counters()
+        recount_follow_counters()
+    if create_search_table():
+        rebuilt = rebuild_search_index()
+        logger.info("Indexed %d posts/comments for search", rebuilt)
+        added.append(SEARCH_TABLE)
+    return added
@@ -0,0 +1,180 @@
+# app/search/index.py
+# 投稿・コメントの全文検索（SQLite FTS5）
+#
+# 日本語は単語の区切りがないため trigram トークナイザを使う。
+# 3 文字以上の語は FTS のインデックスで部分一致検索し bm25 で並べる。
+# 2 文字以下の語はトライグラムにならないので、3 文字以上の語で MATCH した行を
+# LIKE でさらに絞り込むのにだけ使う（短い語だけの検索はテーブル全体の LIKE に
+# なるため受け付けない）。
+import re
+from typing import NamedTuple
+
+from markupsafe import Markup, escape
+
+from app.extensions import db
+
+SEARCH_TABLE = "search_index"
+SEARCH_PAGE_SIZE = 20
+# trigram で索引される最短の語の長さ
+MIN_TERM_LENGTH = 3
+
+# snippet() の強調マーカー（本文に現れない制御文字を使い、あとで <mark> に置き換える）
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+KIND_POST = "post"
+KIND_COMMENT = "comment"
+
+
+def create_search_table():
+    """FTS5 仮想テーブルを作成する。新しく作った場合は True"""
+    exists = db.session.execute(
+        db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": SEARCH_TABLE},
+    ).first()
+    if exists:
+        return False
+    db.session.execute(
+        db.text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            "title, body, kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED, "
+            "tokenize = 'trigram')"
+        )
+    )
+    db.session.commit()
+    return True
+
+
+# ----------------------
+# 書き込み時の同期（commit は呼び出し側）
+# ----------------------
+def _insert(kind, ref_id, post_id, title, body):
+    db.session.execute(
+        db.text(
+            f"INSERT INTO {SEARCH_TABLE} (title, body, kind, ref_id, post_id) "
+            "VALUES (:title, :body, :kind, :ref_id, :post_id)"
+        ),
+        {
+            "title": title or "",
+            "body": body or "",
+            "kind": kind,
+            "ref_id": ref_id,
+            "post_id": post_id,
+        },
+    )
+
+
+def index_post(post):
+    db.session.flush()
+    _insert(KIND_POST, post.id, post.id, post.title, post.content)
+
+
+def index_comment(comment):
+    db.session.flush()
+    _insert(KIND_COMMENT, comment.id, comment.post_id, "", comment.content)
+
+
+def rebuild_search_index():
+    """既存の投稿・コメントから索引を作り直す。戻り値: 登録件数"""
+    create_search_table()
+    db.session.execute(db.text(f"DELETE FROM {SEARCH_TABLE}"))
+    posts = db.session.execute(
+        db.text(
+            f"INSERT INTO {SEARCH_TABLE} (title, body, kind, ref_id, post_id) "
+            "SELECT title, content, :kind, id, id FROM posts"
+        ),
+        {"kind": KIND_POST},
+    ).rowcount
+    comments = db.session.execute(
+        db.text(
+            f"INSERT INTO {SEARCH_TABLE} (title, body, kind, ref_id, post_id) "
+            "SELECT '', content, :kind, id, post_id FROM comments"
+        ),
+        {"kind": KIND_COMMENT},
+    ).rowcount
+    db.session.execute(db.text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return posts + comments
+
+
+# ----------------------
+# 検索
+# ----------------------
+class SearchHit(NamedTuple):
+    kind: str
+    ref_id: int
+    post_id: int
+    title: str
+    snippet: Markup
+
+
+def parse_query(q):
+    """検索語を (MATCH 式, LIKE で絞る短い語のリスト) に分ける
+
+    どの語も部分一致で、FTS5 の演算子（* による前方一致など）は使えない。
+    """
+    long_terms, short_terms = [], []
+    for term in re.split(r"\s+", (q or "").strip()):
+        term = term.replace('"', "")
+        if not term:
+            continue
+        (long_terms if len(term) >= MIN_TERM_LENGTH else short_terms).append(term)
+    match = " AND ".join(f'"{t}"' for t in long_terms)
+    return match, short_terms
+
+
+def _highlight(text):
+    html = str(escape(text))
+    return Markup(html.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_query(q, page=1, per_page=SEARCH_PAGE_SIZE):
+    """search() が発行するステートメント
+
+    MIN_TERM_LENGTH 文字以上の語がなければ None（索引を使えないため検索しない）。
+    """
+    match, short_terms = parse_query(q)
+    if not match:
+        return None
+
+    page = max(int(page or 1), 1)
+    params = {"match": match, "limit": per_page + 1, "offset": (page - 1) * per_page}
+    where = [f"{SEARCH_TABLE} MATCH :match"]
+    for i, term in enumerate(short_terms):
+        where.append(f"(title LIKE :t{i} ESCAPE '\\' OR body LIKE :t{i} ESCAPE '\\')")
+        params[f"t{i}"] = _like_pattern(term)
+
+    snippet = f"snippet({SEARCH_TABLE}, 1, '{_MARK_START}', '{_MARK_END}', '…', 24)"
+    # タイトルの一致を本文の 2 倍に重み付け
+    order = f"bm25({SEARCH_TABLE}, 2.0, 1.0)"
+    return db.text(
+        f"SELECT kind, ref_id, post_id, title, {snippet} AS snippet "
+        f"FROM {SEARCH_TABLE} WHERE {' AND '.join(where)} "
+        f"ORDER BY {order} LIMIT :limit OFFSET :offset"
+    ).bindparams(**params)
+
+
+def needs_longer_term(q) -> bool:
+    """検索語はあるが MIN_TERM_LENGTH 文字以上の語がない"""
+    match, short_terms = parse_query(q)
+    return not match and bool(short_terms)
+
+
+def search(q, page=1, per_page=SEARCH_PAGE_SIZE):
+    """戻り値: (hits, has_next)"""
+    stmt = search_query(q, page, per_page)
+    if stmt is None:
+        return [], False
+
+    rows = db.session.execute(stmt).all()
+    has_next = len(rows) > per_page
+    hits = [
+        SearchHit(kind, int(ref_id), int(post_id), title, _highlight(text or ""))
+        for kind, ref_id, post_id, title, text in rows[:per_page]
+    ]
+    return hits, has_next
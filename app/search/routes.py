@@ -0,0 +1,67 @@
+from flask import Blueprint, render_template, request, jsonify
+from sqlalchemy.orm import joinedload
+
+from app.posts.models import Post
+from app.search.index import MIN_TERM_LENGTH, SEARCH_PAGE_SIZE, needs_longer_term, search
+
+search_bp = Blueprint("search", __name__, template_folder="templates", url_prefix="/search")
+
+
+def _page_arg():
+    try:
+        return max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+
+# 🔍 投稿・コメントの全文検索
+@search_bp.route("/")
+def results():
+    q = request.args.get("q", "").strip()
+    page = _page_arg()
+    hits, has_next = search(q, page=page, per_page=SEARCH_PAGE_SIZE)
+    error = None
+    if needs_longer_term(q):
+        error = f"{MIN_TERM_LENGTH} 文字以上の語を 1 つ以上含めてください。"
+
+    # ヒットした投稿を投稿者ごとまとめて 1 クエリで取得
+    post_ids = {hit.post_id for hit in hits}
+    posts = {}
+    if post_ids:
+        posts = {
+            p.id: p
+            for p in Post.query.options(joinedload(Post.user))
+            .filter(Post.id.in_(post_ids))
+            .all()
+        }
+    hits = [hit for hit in hits if hit.post_id in posts]
+
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "q": q,
+                "page": page,
+                "has_next": has_next,
+                "error": error,
+                "results": [
+                    {
+                        "kind": hit.kind,
+                        "id": hit.ref_id,
+                        "post_id": hit.post_id,
+                        "title": posts[hit.post_id].title,
+                        "snippet": str(hit.snippet),
+                    }
+                    for hit in hits
+                ],
+            }
+        )
+
+    return render_template(
+        "search/results.html",
+        q=q,
+        hits=hits,
+        posts=posts,
+        page=page,
+        has_next=has_next,
+        error=error,
+    )
@@ -0,0 +1,214 @@
+# app/seed.py
+# 負荷確認用のダミーデータ生成（flask seed）
+#
+# ORM を通さず executemany でまとめて INSERT し、batch_size 行ごとに commit する。
+# - フォロー: 人気（フォローされやすさ）を Zipf 分布で割り当てるため、
+#   少数のユーザーにフォロワーが集中する（べき乗則）。
+# - 投稿数・いいね数などはパレート分布（平均を指定）。いいね・コメント・転送は
+#   投稿者の人気に比例して集まる。
+# - パスワードハッシュは全員共通（ハッシュ計算を 1 回で済ませる）。
+# 生成後にカウンタ・タイムライン・検索索引をまとめて作る。
+import bisect
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+SEED_PASSWORD = "password123"
+
+_WORDS = [
+    "インデックス投資", "高配当株", "全世界株式", "米国株", "新NISA", "積立",
+    "複利", "配当金", "家計簿", "節約", "つみたて投資枠", "成長投資枠",
+    "S&P500", "債券", "リバランス", "暴落", "長期保有", "FIRE",
+]
+_COMMENTS = [
+    "参考になります！", "自分も同じです", "なるほど", "勉強になりました",
+    "いいですね", "続けていきましょう", "その考え方好きです",
+]
+
+
+@dataclass
+class SeedConfig:
+    users: int = 1000
+    follows_mean: float = 20
+    follow_skew: float = 1.1  # Zipf の指数（大きいほど一部に集中）
+    posts_mean: float = 10
+    likes_mean: float = 10
+    comments_mean: float = 2
+    reposts_mean: float = 0.5
+    pareto_alpha: float = 1.5  # 投稿数・反応数のばらつき（小さいほど偏る）
+    days: int = 365
+    batch_size: int = 10000
+    seed: int = 0
+
+
+class _Sampler:
+    def __init__(self, rng, cfg):
+        self.rng = rng
+        self.cfg = cfg
+
+    def count(self, mean):
+        """平均 mean のパレート分布に従う非負整数"""
+        if mean <= 0:
+            return 0
+        a = self.cfg.pareto_alpha
+        if a <= 1:
+            x = self.rng.expovariate(1 / mean)
+        else:
+            # paretovariate(a) は最小 1・平均 a / (a - 1)
+            x = mean * (a - 1) / a * self.rng.paretovariate(a)
+        # 切り捨てで平均が下がらないよう確率的に丸める
+        return int(x + self.rng.random())
+
+    def zipf_weights(self, n):
+        """人気順位に対する累積重み（bisect でサンプリングする）"""
+        return list(
+            itertools.accumulate(1 / (r ** self.cfg.follow_skew) for r in range(1, n + 1))
+        )
+
+    def pick(self, cum_weights, population):
+        x = self.rng.random() * cum_weights[-1]
+        return population[bisect.bisect_left(cum_weights, x)]
+
+
+def _ts(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _Writer:
+    """batch_size 行ごとに executemany + commit する"""
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.rows = {}
+
+    def add(self, sql, row):
+        rows = self.rows.setdefault(sql, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(sql)
+
+    def flush(self, sql=None):
+        for key in [sql] if sql else list(self.rows):
+            rows = self.rows.get(key)
+            if rows:
+                self.conn.executemany(key, rows)
+                self.conn.commit()
+                rows.clear()
+
+
+_INSERT_USER = (
+    "INSERT INTO users (id, username, email, password_hash, icon, bio, "
+    "follower_count, following_count) VALUES (?, ?, ?, ?, 'default.png', '', 0, 0)"
+)
+_INSERT_FOLLOW = "INSERT OR IGNORE INTO followers (follower_id, followed_id) VALUES (?, ?)"
+_INSERT_POST = (
+    "INSERT INTO posts (id, title, content, user_id, created_at, "
+    "like_count, comment_count, repost_count, version) VALUES (?, ?, ?, ?, ?, 0, 0, 0, 0)"
+)
+_INSERT_LIKE = "INSERT OR IGNORE INTO likes (user_id, post_id, created_at) VALUES (?, ?, ?)"
+_INSERT_COMMENT = (
+    "INSERT INTO comments (content, user_id, post_id, created_at) VALUES (?, ?, ?, ?)"
+)
+_INSERT_REPOST = (
+    "INSERT OR IGNORE INTO reposts (user_id, post_id, created_at) VALUES (?, ?, ?)"
+)
+
+
+def seed(cfg: SeedConfig, password_hash, echo=logger.info):
+    """ダミーデータを追加する。戻り値: 追加した最初の投稿の id"""
+    rng = random.Random(cfg.seed)
+    sample = _Sampler(rng, cfg)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    raw = db.engine.raw_connection()
+    conn = raw.driver_connection
+    # 大量の INSERT 中だけ fsync を省く（プールへ返す前に元へ戻す）
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        first_user = (conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+        first_post = (conn.execute("SELECT MAX(id) FROM posts").fetchone()[0] or 0) + 1
+        writer = _Writer(conn, cfg.batch_size)
+
+        # ユーザー
+        user_ids = list(range(first_user, first_user + cfg.users))
+        for uid in user_ids:
+            writer.add(
+                _INSERT_USER, (uid, f"seed{uid}", f"seed{uid}@example.com", password_hash)
+            )
+        writer.flush()
+        echo(f"users: {len(user_ids)} ({time.perf_counter() - started:.1f}s)")
+
+        # フォロー（人気順位はランダムに割り当てる）
+        popular = user_ids[:]
+        rng.shuffle(popular)
+        cum = sample.zipf_weights(len(popular))
+        popularity = {uid: 1 / (rank ** cfg.follow_skew) for rank, uid in enumerate(popular, 1)}
+        for uid in user_ids:
+            n = min(sample.count(cfg.follows_mean), len(user_ids) - 1)
+            targets = set()
+            for _ in range(n * 2):
+                if len(targets) >= n:
+                    break
+                target = sample.pick(cum, popular)
+                if target != uid:
+                    targets.add(target)
+            for target in targets:
+                writer.add(_INSERT_FOLLOW, (uid, target))
+        writer.flush()
+        echo(f"follows ({time.perf_counter() - started:.1f}s)")
+
+        # 投稿と反応。反応の数は投稿者の人気で 1〜10 倍に偏らせ、
+        # 全体の平均が likes_mean などのままになるよう平均 1 に正規化する
+        top = max(popularity.values())
+        weights = {uid: 1 + 9 * popularity[uid] / top for uid in user_ids}
+        mean_weight = sum(weights.values()) / len(weights)
+        post_id = first_post
+        span = cfg.days * 24 * 60 * 60
+        for uid in user_ids:
+            boost = weights[uid] / mean_weight
+            for _ in range(sample.count(cfg.posts_mean)):
+                created = now - timedelta(seconds=rng.randrange(span))
+                word = rng.choice(_WORDS)
+                writer.add(
+                    _INSERT_POST,
+                    (
+                        post_id,
+                        f"{word}について",
+                        f"{word}と{rng.choice(_WORDS)}の話。{rng.randrange(10000)}",
+                        uid,
+                        _ts(created),
+                    ),
+                )
+                for sql, mean, content in (
+                    (_INSERT_LIKE, cfg.likes_mean, False),
+                    (_INSERT_COMMENT, cfg.comments_mean, True),
+                    (_INSERT_REPOST, cfg.reposts_mean, False),
+                ):
+                    for _ in range(sample.count(mean * boost)):
+                        actor = rng.choice(user_ids)
+                        # 最近の投稿への反応が未来の時刻にならないようにする
+                        at = _ts(min(created + timedelta(seconds=rng.randrange(86400)), now))
+                        if content:
+                            writer.add(sql, (rng.choice(_COMMENTS), actor, post_id, at))
+                        else:
+                            writer.add(sql, (actor, post_id, at))
+                post_id += 1
+        writer.flush()
+        echo(f"posts and reactions ({time.perf_counter() - started:.1f}s)")
+    finally:
+        # 途中で失敗して開いたままのトランザクションの中では戻せない
+        conn.rollback()
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        raw.close()
+
+    return first_post
@@ -0,0 +1,65 @@
+# tests/conftest.py
+# テスト用のアプリ（instance をテストごとの一時ディレクトリに置き、バックグラウンドスレッドは止める）
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.auth.models import User
+from app.posts.models import Post
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMAIL_OUTBOX_ENABLED", "0")
+    monkeypatch.setenv("BOOKSHELF_LIBRARY_REFRESH", "0")
+    # ハッシュ計算を軽くする（ユーザーを大量に作るため）
+    monkeypatch.setenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1")
+    app = create_app(instance_path=str(tmp_path))
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def make_user(app):
+    count = [0]
+
+    def make(**fields):
+        count[0] += 1
+        user = User(f"user{count[0]}", f"user{count[0]}@example.com", "password123")
+        for name, value in fields.items():
+            setattr(user, name, value)
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def make_post(app):
+    def make(user, created_at, **fields):
+        fields = {"title": "t", "content": "c", **fields}
+        post = Post(user_id=user.id, created_at=created_at, **fields)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    return make
+
+
+@pytest.fixture
+def login(app):
+    """ユーザーでログインしたテストクライアントを返す（パスワードは make_user の既定値）"""
+
+    def login_as(user):
+        client = app.test_client()
+        response = client.post(
+            "/auth/login", data={"email": user.email, "password": "password123"}
+        )
+        assert response.status_code == 302, response.status_code
+        return client
+
+    return login_as
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.bookshelf import providers
+
+
+def test_calls_get_the_remaining_deadline(monkeypatch):
+    monkeypatch.setattr(providers, "_executor", ThreadPoolExecutor(max_workers=1))
+    timeouts = {}
+
+    def busy(timeout=None):
+        timeouts["busy"] = timeout
+        time.sleep(0.2)
+        return []
+
+    def queued(timeout=None):
+        timeouts["queued"] = timeout
+        return []
+
+    calls = {"busy": (busy,), "queued": (queued,)}
+    list(providers.fan_out(calls, 1.0))
+    assert timeouts["busy"] <= 1.0
+    # プールで待った分だけ短い締め切りで呼ばれる
+    assert timeouts["queued"] <= 0.8
+
+
+def test_search_merges_all_providers_by_default(app, monkeypatch):
+    app.config["BOOKSHELF_CACHE_ENABLED"] = False
+    monkeypatch.setitem(
+        providers.BOOK_PROVIDERS,
+        "rakuten",
+        lambda title, timeout=None: [{"title": "A", "isbn": "9784000000001"}],
+    )
+    monkeypatch.setitem(
+        providers.BOOK_PROVIDERS,
+        "openlibrary",
+        lambda title, timeout=None: [{"title": "B", "isbn": "9784000000002"}],
+    )
+    books = app.test_client().get("/bookshelf/search?title=x").get_json()
+    assert sorted(b["title"] for b in books) == ["A", "B"]
@@ -0,0 +1,47 @@
+import io
+import threading
+import time
+
+from PIL import Image
+
+from app.bookshelf import http_client
+from app.bookshelf.covers import CoverCache, cover_key
+
+
+def _png():
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 400), "red").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_widths_of_one_cover_share_a_single_fetch(tmp_path, monkeypatch):
+    cache = CoverCache()
+    cache.folder = str(tmp_path)
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        time.sleep(0.1)
+        return _png()
+
+    monkeypatch.setattr(cache, "_fetch", fetch)
+    key = cover_key("https://covers.openlibrary.org/b/id/1-L.jpg")
+    results = []
+    threads = [
+        threading.Thread(target=lambda w=w: results.append(cache.get(key, w)))
+        for w in (None, 64, 128, 256, 64)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 5
+    assert len(fetched) == 1
+    assert cache._flights == {}
+
+
+def test_each_cover_host_has_its_own_breaker():
+    names = set(http_client.metrics())
+    assert {"covers:openlibrary", "covers:rakuten"} <= names
+    assert "covers" not in names
@@ -0,0 +1,25 @@
+# tests/test_engagement.py
+import threading
+
+from app import create_app
+
+
+def _threads():
+    return [t.name for t in threading.enumerate()]
+
+
+def test_write_behind_thread_starts_on_first_request(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMAIL_OUTBOX_ENABLED", "0")
+    monkeypatch.setenv("BOOKSHELF_LIBRARY_REFRESH", "0")
+    monkeypatch.setenv("ENGAGEMENT_WRITE_MODE", "write_behind")
+    app = create_app(instance_path=str(tmp_path))
+    queue = app.extensions["engagement_queue"]
+    try:
+        # CLI コマンドと同じく、リクエストを受けるまでは起動しない
+        assert not queue._thread.is_alive()
+        app.test_client().get("/metrics")
+        assert queue._thread.is_alive()
+        app.test_client().get("/metrics")
+        assert _threads().count("engagement-flush") == 1
+    finally:
+        queue.stop()
@@ -0,0 +1,22 @@
+# tests/test_fragment_cache.py
+from datetime import datetime
+
+from app.extensions import db
+from app.posts.models import Comment
+
+
+def test_renamed_commenter_changes_cached_card(app, make_user, make_post):
+    author, commenter = make_user(), make_user()
+    post = make_post(author, datetime(2025, 1, 1), comment_count=1)
+    db.session.add(Comment(content="hello", user_id=commenter.id, post_id=post.id))
+    db.session.commit()
+    client = app.test_client()
+
+    assert f"{commenter.username}: hello" in client.get("/").get_data(as_text=True)
+    # 別のワーカーでの変更と同じく、このプロセスのキャッシュは消さずに名前だけ変える
+    commenter.username = "renamed"
+    db.session.commit()
+    assert "renamed: hello" in client.get("/").get_data(as_text=True)
+
+    stats = client.get("/metrics").get_json()["fragment_cache"]
+    assert stats["misses"] >= 2
@@ -0,0 +1,92 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.bookshelf.http_client import (
+    ResponseTooLarge,
+    Upstream,
+    UpstreamClient,
+    UpstreamError,
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    statuses = []
+
+    def do_GET(self):
+        if self.path.startswith("/large"):
+            # /large-unknown-length は Content-Length を付けずに送る
+            self.send_response(200)
+            if self.path == "/large":
+                self.send_header("Content-Length", str(1024 * 1024))
+            self.end_headers()
+            try:
+                for _ in range(64):
+                    self.wfile.write(b"x" * 16384)
+            except OSError:
+                pass
+            return
+        if self.path == "/drip":
+            # 本文を少しずつ送る（ソケット操作ごとのタイムアウトには掛からない）
+            self.send_response(200)
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            for _ in range(100):
+                self.wfile.write(b"x")
+                self.wfile.flush()
+                time.sleep(0.05)
+            return
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retries_unavailable_responses(server):
+    _Handler.statuses = [503, 503]
+    c = UpstreamClient(Upstream("test", retries=2, backoff=0.01))
+    assert c.get_json(f"{server}/") == {"ok": True}
+    assert c.metrics.snapshot()["errors"] == 0
+
+
+def test_total_deadline_covers_slow_body(server):
+    c = UpstreamClient(Upstream("test", read_timeout=1.0, total_timeout=0.5))
+    started = time.monotonic()
+    with pytest.raises(UpstreamError, match="deadline"):
+        c.get(f"{server}/drip")
+    assert time.monotonic() - started < 1.0
+
+
+def test_caller_timeout_shortens_the_deadline(server):
+    c = UpstreamClient(Upstream("test", read_timeout=1.0, total_timeout=10.0))
+    started = time.monotonic()
+    with pytest.raises(UpstreamError):
+        c.get(f"{server}/drip", timeout=0.3)
+    assert time.monotonic() - started < 0.8
+
+
+@pytest.mark.parametrize("path", ["/large", "/large-unknown-length"])
+def test_max_bytes_stops_reading(server, path):
+    c = UpstreamClient(Upstream("test", failure_threshold=1))
+    with pytest.raises(ResponseTooLarge):
+        c.get(f"{server}{path}", max_bytes=64 * 1024)
+    # 大きすぎるのは送信先の障害ではない
+    assert c.breaker.state == c.breaker.CLOSED
@@ -0,0 +1,30 @@
+from app.bookshelf import libraries
+from app.bookshelf.libraries import LibraryCatalogue, library_entry
+
+
+def test_library_entry_accepts_null_geocode():
+    entry = library_entry({"libid": "1", "formal": "村立図書館", "geocode": None})
+    assert (entry["lat"], entry["lon"]) == (None, None)
+
+
+def test_sparse_area_queries_calil_once(monkeypatch):
+    calls = []
+
+    def fake_calil(lat, lon, timeout=None):
+        calls.append((lat, lon))
+        return [
+            {"libid": "1", "formal": "町立図書館", "geocode": "140.10,40.10"},
+            {"libid": "2", "formal": "位置不明", "geocode": None},
+        ]
+
+    monkeypatch.setattr(libraries, "find_nearby_libraries", fake_calil)
+    catalogue = LibraryCatalogue()
+    assert catalogue.nearest(40.1, 140.1) is None
+
+    found = catalogue.fetch_nearby(40.1, 140.1)
+    assert [e["id"] for e in found] == ["1"]
+    # 5 件に満たなくても、問い合わせ済みの格子では手元の分を返す
+    assert [e["id"] for e in catalogue.nearest(40.1, 140.1)] == ["1"]
+    assert len(calls) == 1
+    # 問い合わせていない格子は従来どおりカーリルへ
+    assert catalogue.nearest(35.0, 135.0) is None
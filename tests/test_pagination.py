@@ -0,0 +1,62 @@
+# tests/test_pagination.py
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.posts.models import Post
+from app.feed.pagination import encode_cursor, feed_page_query, load_feed_page
+from app.query_plans import explain
+
+
+def test_feed_cursor_uses_index_range(app):
+    query = feed_page_query(encode_cursor("2025-01-01 00:00:00", 10))
+    plan = explain(query.statement)
+    assert any(
+        d.startswith("SEARCH posts USING") and "created_at<" in d for d in plan
+    ), plan
+
+
+def test_feed_pages_across_equal_timestamps(app, make_user, make_post):
+    user = make_user()
+    base = datetime(2025, 1, 1)
+    # 3 件ずつ同じ時刻の投稿を 4 組
+    for i in range(12):
+        make_post(user, base + timedelta(minutes=i // 3))
+    expected = [
+        p.id
+        for p in Post.query.order_by(Post.created_at.desc(), Post.id.desc())
+    ]
+
+    seen, cursor = [], None
+    while True:
+        posts, cursor = load_feed_page(cursor=cursor, limit=5)
+        seen.extend(p.id for p in posts)
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_page_comments_reads_per_post_prefix(app, make_user, make_post):
+    from app.posts.models import Comment
+    from app.feed.pagination import attach_comments, load_comments_page, page_comments_query
+
+    user = make_user()
+    base = datetime(2025, 1, 1)
+    posts = [make_post(user, base, comment_count=8) for _ in range(2)]
+    for post in posts:
+        for i in range(8):
+            db.session.add(
+                Comment(content=str(i), user_id=user.id, post_id=post.id,
+                        created_at=base + timedelta(minutes=i // 4))
+            )
+    db.session.commit()
+
+    plan = explain(page_comments_query([p.id for p in posts]).statement)
+    assert any("ix_comments_post_created (post_id=?)" in d for d in plan), plan
+    assert not any(d.startswith("SCAN comments") for d in plan), plan
+
+    attach_comments(posts)
+    for post in posts:
+        first = [c.content for c in post.ordered_comments]
+        assert first == ["0", "1", "2", "3", "4"]
+        rest, cursor = load_comments_page(post.id, after=post.comments_cursor)
+        assert [c.content for c in rest] == ["5", "6", "7"] and cursor is None
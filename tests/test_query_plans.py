@@ -0,0 +1,16 @@
+from app.query_plans import check_query_plans, full_scans
+
+
+def test_main_queries_do_not_scan_hot_tables(app):
+    scanned = {name: (plan, scans) for name, plan, scans in check_query_plans() if scans}
+    assert scanned == {}
+
+
+def test_scan_using_index_is_reported():
+    plan = [
+        "SCAN posts USING INDEX ix_posts_created",
+        "SCAN comments_1 USING COVERING INDEX ix_comments_post_created",
+        "SEARCH users USING INTEGER PRIMARY KEY (rowid=?)",
+        "SCAN search_index VIRTUAL TABLE INDEX 0:M5",
+    ]
+    assert full_scans(plan, {"posts", "comments", "users"}) == ["posts", "comments"]
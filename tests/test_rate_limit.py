@@ -0,0 +1,34 @@
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def proxied_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMAIL_OUTBOX_ENABLED", "0")
+    monkeypatch.setenv("BOOKSHELF_LIBRARY_REFRESH", "0")
+    monkeypatch.setenv("PROXY_FIX_X_FOR", "1")
+    monkeypatch.setenv("AUTH_RATE_LIMIT_IP", "2/60")
+    monkeypatch.setenv("AUTH_RATE_LIMIT_ACCOUNT", "")
+    app = create_app(instance_path=str(tmp_path))
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+def _login(client, forwarded_for):
+    return client.post(
+        "/auth/login",
+        data={"email": "nobody@example.com", "password": "password123"},
+        headers={"X-Forwarded-For": forwarded_for},
+    )
+
+
+def test_login_limit_keys_on_forwarded_client_address(proxied_app):
+    client = proxied_app.test_client()
+    assert _login(client, "203.0.113.1").status_code == 200
+    assert _login(client, "203.0.113.1").status_code == 200
+    assert _login(client, "203.0.113.1").status_code == 429
+    # 同じプロキシ経由でも別のクライアントは制限されない
+    assert _login(client, "203.0.113.2").status_code == 200
+    # クライアントが付けたヘッダーは信用しない（右から 1 段だけ使う）
+    assert _login(client, "198.51.100.9, 203.0.113.1").status_code == 429
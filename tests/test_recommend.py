@@ -0,0 +1,44 @@
+import time
+
+from app.bookshelf import recommend
+from app.bookshelf.providers import book_key, genre_tags
+from app.bookshelf.recommend import RecommendIndex, recommender
+
+
+def _book(n, **fields):
+    return {"title": f"book{n}", "isbn": f"97840000{n:05d}", **fields}
+
+
+def test_genre_ids_become_hierarchical_tags():
+    assert genre_tags("001004008/001004008") == "genre:001004 genre:001004008"
+    assert genre_tags(None) == ""
+
+
+def test_cooccurrence_keeps_top_partners(monkeypatch):
+    monkeypatch.setattr(recommend, "COOCCUR_LIMIT", 2)
+    books = [_book(n) for n in range(5)]
+    shelves = [books, books[:3], books[:2]]
+    index = RecommendIndex(books, shelves)
+    partners = index.cooccur[index.ids[book_key(books[0])]]
+    assert len(partners) == 2
+    assert partners[index.ids[book_key(books[1])]] == 3
+
+
+def test_recommend_is_empty_until_the_index_is_built(app, monkeypatch):
+    built = []
+
+    def slow_build():
+        time.sleep(0.2)
+        built.append(True)
+        recommender._index = RecommendIndex(
+            [_book(1, tags="genre:001004"), _book(2, tags="genre:001004")]
+        )
+
+    monkeypatch.setattr(recommender, "build", slow_build)
+    history = [_book(1, tags="genre:001004")]
+    assert recommender.recommend(history) == []
+    for _ in range(50):
+        if built:
+            break
+        time.sleep(0.05)
+    assert [b["title"] for b in recommender.recommend(history)] == ["book2"]
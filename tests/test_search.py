@@ -0,0 +1,56 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app.extensions import db
+from app.posts.models import Comment
+from app.search.index import index_post, search, search_query
+from app.query_plans import explain
+
+
+def _post(make_user, make_post, content):
+    post = make_post(make_user(), datetime(2025, 1, 1), content=content)
+    index_post(post)
+    db.session.commit()
+    return post
+
+
+def test_short_terms_only_filter_trigram_matches(app, make_user, make_post):
+    hit = _post(make_user, make_post, "投資信託の積立を始めた")
+    _post(make_user, make_post, "投資信託の解約")
+
+    hits, _ = search("投資信託 積立")
+    assert [h.post_id for h in hits] == [hit.id]
+    plan = explain(search_query("投資信託 積立"))
+    assert plan[0].startswith("SCAN search_index VIRTUAL TABLE INDEX"), plan
+
+    # 2 文字以下の語だけでは索引を使えないので検索しない
+    assert search_query("積立") is None
+    assert search("積立") == ([], False)
+    response = app.test_client().get("/search/?q=積立&format=json")
+    assert response.json["error"]
+
+
+def test_asterisk_is_not_a_prefix_operator(app, make_user, make_post):
+    _post(make_user, make_post, "investment")
+    assert search("invest*") == ([], False)
+    assert len(search("invest")[0]) == 1
+
+
+def test_detail_loads_comment_authors_in_one_query(app, make_user, make_post):
+    post = _post(make_user, make_post, "本文")
+    for _ in range(5):
+        db.session.add(Comment(content="c", user_id=make_user().id, post_id=post.id))
+    db.session.commit()
+    db.session.expire_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        response = app.test_client().get(f"/{post.id}")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    assert response.status_code == 200
+    user_selects = [s for s in statements if s.lstrip().startswith("SELECT users")]
+    assert len(user_selects) <= 2, user_selects
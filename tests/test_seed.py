@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from app.extensions import db
+from app.seed import SeedConfig, seed
+
+
+def test_seed_keeps_reaction_means_and_past_timestamps(app):
+    cfg = SeedConfig(
+        users=20, follows_mean=5, posts_mean=50, likes_mean=2, days=2, seed=1
+    )
+    started = datetime.utcnow()
+    seed(cfg, "x", echo=lambda *_: None)
+
+    posts, likes, latest = db.session.execute(
+        db.text(
+            "SELECT (SELECT count(*) FROM posts), (SELECT count(*) FROM likes), "
+            "(SELECT max(created_at) FROM likes)"
+        )
+    ).one()
+    # 人気による偏りを付けても 1 投稿あたりの平均は likes_mean 前後
+    assert 0.75 * cfg.likes_mean < likes / posts < 1.25 * cfg.likes_mean
+    assert latest <= started.strftime("%Y-%m-%d %H:%M:%S.%f")
@@ -0,0 +1,56 @@
+# tests/test_timeline.py
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.posts import engagement
+from app.posts.models import TimelineEntry
+from app.feed.timeline import fan_out_post, home_timeline
+
+BASE = datetime(2025, 1, 1)
+
+
+def _timeline_ids(user):
+    posts, _ = home_timeline(user)
+    return [p.id for p in posts]
+
+
+def _publish(make_post, user, minutes):
+    post = make_post(user, BASE + timedelta(minutes=minutes))
+    fan_out_post(post)
+    db.session.commit()
+    return post
+
+
+def test_celebrity_reposts_are_merged_at_read_time(app, make_user, make_post):
+    app.config["TIMELINE_FANOUT_LIMIT"] = 1
+    reader, other, celebrity, stranger = (make_user() for _ in range(4))
+    reader.follow(celebrity)
+    other.follow(celebrity)
+    db.session.commit()
+
+    post = _publish(make_post, stranger, 0)
+    engagement.record(engagement.REPOST, celebrity, post.id, True)
+
+    assert _timeline_ids(reader) == [post.id]
+
+
+def test_crossing_the_fanout_limit(app, make_user, make_post, login):
+    app.config["TIMELINE_FANOUT_LIMIT"] = 1
+    reader, other, author = (make_user() for _ in range(3))
+    login(reader).post(f"/auth/follow/{author.id}")
+    first = _publish(make_post, author, 0)
+    assert TimelineEntry.query.filter_by(user_id=reader.id, post_id=first.id).count() == 1
+
+    # 2 人目のフォローで上限を超える: 展開済みのエントリは消え、読み込み時に取得する
+    login(other).post(f"/auth/follow/{author.id}")
+    assert TimelineEntry.query.filter_by(user_id=reader.id, actor_id=author.id).count() == 0
+    second = _publish(make_post, author, 1)
+    assert _timeline_ids(reader) == [second.id, first.id]
+    assert _timeline_ids(other) == [second.id, first.id]
+
+    # 上限以下に戻る: 読み込み時に取得していた投稿を展開し直す
+    login(other).post(f"/auth/unfollow/{author.id}")
+    entries = TimelineEntry.query.filter_by(user_id=reader.id, actor_id=author.id)
+    assert {e.post_id for e in entries} == {first.id, second.id}
+    assert _timeline_ids(reader) == [second.id, first.id]
+    assert _timeline_ids(other) == []
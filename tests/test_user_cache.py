@@ -0,0 +1,12 @@
+from app.auth.user_cache import user_cache
+
+
+def test_metrics_report_user_cache_hits(app, make_user):
+    user = make_user()
+    user_cache.clear()
+    user_cache.load(user.id)
+    user_cache.load(user.id)
+
+    stats = app.test_client().get("/metrics").get_json()["user_cache"]
+    assert stats["entries"] == 1
+    assert stats["hits"] >= 1